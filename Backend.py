@@ -1,16 +1,16 @@
 # backend/app.py
 import os
 import json
-import base64
 from typing import List, Dict, Any, Optional
 from urllib.parse import quote
 
-import requests
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
+from sap_client import SapClient
+
 # optional — your project already used langchain_openai ChatOpenAI
 # if you don't use it, you can stub or remove the llm part
 try:
@@ -30,22 +30,14 @@ SAP_PASSWORD = os.getenv("SAP_PASSWORD")
 if not SAP_USERNAME or not SAP_PASSWORD:
     raise RuntimeError("Missing SAP_USERNAME or SAP_PASSWORD env vars")
 
-# Basic auth header
-_auth_bytes = f"{SAP_USERNAME}:{SAP_PASSWORD}".encode("utf-8")
-_auth_b64 = base64.b64encode(_auth_bytes).decode("utf-8")
-
-# Reusable requests session
-session = requests.Session()
-session.headers.update({
-    "Authorization": f"Basic {_auth_b64}",
-    "Accept": "application/json",
-    "Content-Type": "application/json",
-})
 # NOTE: only set verify=False during local dev if required by your environment
 VERIFY_SSL = False
 
 DEFAULT_TIMEOUT = 60
 
+# Shared SAP client: pooled keep-alive session, cached CSRF token, retries
+sap = SapClient(SAP_USERNAME, SAP_PASSWORD, timeout=DEFAULT_TIMEOUT, verify=VERIFY_SSL)
+
 # LLM client (internal GenAI gateway) — optional
 LLM_ENABLED = False
 if ChatOpenAI is not None and os.getenv("OPENAI_API_KEY"):
@@ -159,10 +151,9 @@ def build_odata_url(
 
 def fetch_financial_statements(url: str) -> List[Dict[str, Any]]:
     """
-    GET the provided OData URL (with X-CSRF-Token: Fetch) and return the d.results array.
+    GET the provided OData URL (CSRF token fetched once and reused by SapClient) and return the d.results array.
     """
-    headers = {"X-CSRF-Token": "Fetch"}
-    resp = session.get(url, headers=headers, timeout=DEFAULT_TIMEOUT, verify=VERIFY_SSL)
+    resp = sap.get(url)
     if resp.status_code != 200:
         raise HTTPException(status_code=500, detail=f"SAP error: {resp.status_code} {resp.text[:400]}")
     try:
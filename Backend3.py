@@ -1,22 +1,48 @@
 # backend/app.py
 import os
 import json
-import base64
+import asyncio
+import contextvars
+import hashlib
+import inspect
 import logging
-from typing import List, Dict, Any, Optional
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import asynccontextmanager
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from urllib.parse import quote
 
-import requests
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
 from dotenv import load_dotenv
 
-# optional LLM client import (kept optional)
-try:
-    from langchain_openai import ChatOpenAI
-except Exception:
-    ChatOpenAI = None
+from admission import AdmissionController, AdmissionRejected, RequestCharge, current_charge, current_client
+import export
+from insights import pre_summary, preview_nodes, render_pre_summary
+from cache_backend import MISSING, CacheLockTimeout, InProcessCache, cache_key, make_cache_backend
+from consolidation import Consolidation
+from cpu_pool import CpuPool, StageError
+from jobs import JobManager
+import memdiag
+from period_cube import CubeCache, PeriodCube
+from push import PushHub
+from skeleton import (
+    SkeletonMismatch,
+    align_rows,
+    extend_skeleton,
+    make_skeleton,
+    materialize,
+    merge_skeletons,
+    period_select,
+)
+from tree_builder import TreeBuildStats, build_tree, project_tree
+from tree_index import TreeIndex, node_key
 
 # load .env
 load_dotenv()
@@ -35,41 +61,150 @@ SAP_ODATA_BASEPATH = os.getenv(
 )  # default to FinStmntSet path
 SAP_CLIENT = os.getenv("SAP_CLIENT", "100")
 
-if not SAP_USERNAME or not SAP_PASSWORD or not SAP_BASE_URL:
-    raise RuntimeError("Missing SAP_USERNAME / SAP_PASSWORD / SAP_BASE_URL in environment")
+VERIFY_SSL = os.getenv("VERIFY_SSL", "False").lower() in ("1", "true", "yes")
+DEFAULT_TIMEOUT = int(os.getenv("DEFAULT_TIMEOUT", "60"))
+TREE_CACHE_TTL = int(os.getenv("TREE_CACHE_TTL", "300"))  # seconds; 0 disables caching
+SUMMARY_CACHE_TTL = int(os.getenv("SUMMARY_CACHE_TTL", "3600"))
+CUBE_MAX_BYTES = int(os.getenv("CUBE_MAX_BYTES", str(64 * 1024 * 1024)))  # per cube
+CUBE_CACHE_MAX_BYTES = int(os.getenv("CUBE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))  # all cubes
+CUBE_FETCH_CONCURRENCY = int(os.getenv("CUBE_FETCH_CONCURRENCY", "4"))
+CONSOLIDATION_MAX_COMPANIES = int(os.getenv("CONSOLIDATION_MAX_COMPANIES", "50"))
+CONSOLIDATION_FETCH_CONCURRENCY = int(os.getenv("CONSOLIDATION_FETCH_CONCURRENCY", "4"))
 
-# Basic auth header
-_auth_bytes = f"{SAP_USERNAME}:{SAP_PASSWORD}".encode("utf-8")
-_auth_b64 = base64.b64encode(_auth_bytes).decode("utf-8")
+# admission control for SAP-bound requests (cache hits bypass it)
+SAP_MAX_CONCURRENCY = int(os.getenv("SAP_MAX_CONCURRENCY", "4"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "32"))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "30"))
+CLIENT_RATE_PER_MIN = float(os.getenv("CLIENT_RATE_PER_MIN", "30"))
+CLIENT_BURST = float(os.getenv("CLIENT_BURST", "10"))
+# proxies whose X-Client-Id / X-Forwarded-For headers are trusted for rate limiting
+TRUSTED_PROXIES = {p.strip() for p in os.getenv("TRUSTED_PROXIES", "").split(",") if p.strip()}
 
-# Reusable requests session
-session = requests.Session()
-session.headers.update({
-    "Authorization": f"Basic {_auth_b64}",
-    "Accept": "application/json",
-    "Content-Type": "application/json",
-})
+# background statement builds (POST /jobs/financial-statements)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", "3600"))  # seconds finished jobs stay queryable
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", "3600"))  # cache TTL of job-built trees
+JOB_START_METHOD = os.getenv("JOB_START_METHOD", "spawn")
 
-VERIFY_SSL = os.getenv("VERIFY_SSL", "False").lower() in ("1", "true", "yes")
-DEFAULT_TIMEOUT = int(os.getenv("DEFAULT_TIMEOUT", "60"))
+# process pool for CPU-bound stages of a cache miss (0 = run inline)
+CPU_POOL_WORKERS = int(os.getenv("CPU_POOL_WORKERS", "2"))
+CPU_POOL_SHM_MIN_BYTES = int(os.getenv("CPU_POOL_SHM_MIN_BYTES", str(1024 * 1024)))
+CPU_POOL_START_METHOD = os.getenv("CPU_POOL_START_METHOD", "spawn")
+
+# deeper nodes are re-rooted by the tree builder (keeps JSON nesting bounded)
+TREE_MAX_DEPTH = int(os.getenv("TREE_MAX_DEPTH", "200"))
+# hierarchy structure per (sap-client, P_VERSN, P_KTOPL); 0 disables the amounts-only path
+SKELETON_CACHE_TTL = int(os.getenv("SKELETON_CACHE_TTL", "86400"))
+# parsed TreeIndex objects kept per worker (LRU) for node-level endpoints
+TREE_INDEX_MEMO_SIZE = int(os.getenv("TREE_INDEX_MEMO_SIZE", "32"))
+
+# opt-in memory diagnostics (see memdiag.py): MEMORY_DIAGNOSTICS, MEMORY_LOG_THRESHOLD_MB, MEMORY_TRACE_FRAMES
+memdiag.configure()
+memory_log = memdiag.RequestLog()
+
+# shared by all workers when CACHE_BACKEND=file|redis (see cache_backend.py)
+cache = make_cache_backend()
+
+# WebSocket push channel (/ws)
+PUSH_QUEUE_SIZE = int(os.getenv("PUSH_QUEUE_SIZE", "100"))  # events buffered per connection
+PUSH_MAX_DELTA = int(os.getenv("PUSH_MAX_DELTA", "500"))  # larger tree changes push full_refresh
+PUSH_MAX_TOPICS = int(os.getenv("PUSH_MAX_TOPICS", "50"))  # subscriptions per connection
+PUSH_POLL_INTERVAL = float(os.getenv("PUSH_POLL_INTERVAL", "2"))  # seconds; picks up other workers' events (0 = off)
+
+push = PushHub(PUSH_QUEUE_SIZE, PUSH_MAX_DELTA)
+jobs = JobManager(
+    JOB_WORKERS, JOB_RETENTION, JOB_START_METHOD, on_finish=lambda job: publish_job(job), store=cache
+)
+cpu = CpuPool(CPU_POOL_WORKERS, CPU_POOL_SHM_MIN_BYTES, CPU_POOL_START_METHOD)
+
+admission = AdmissionController(
+    max_concurrency=SAP_MAX_CONCURRENCY,
+    max_queue=ADMISSION_QUEUE_SIZE,
+    max_wait=ADMISSION_MAX_WAIT,
+    rate_per_min=CLIENT_RATE_PER_MIN,
+    burst=CLIENT_BURST,
+)
+
+# warm the LLM stack in the background at startup instead of on the first summary
+LLM_WARMUP = os.getenv("LLM_WARMUP", "True").lower() in ("1", "true", "yes")
+
+# POST /summarize_tree/batch
+SUMMARY_BATCH_MAX_ITEMS = int(os.getenv("SUMMARY_BATCH_MAX_ITEMS", "100"))
+SUMMARY_BATCH_CONCURRENCY = int(os.getenv("SUMMARY_BATCH_CONCURRENCY", "4"))
+SUMMARY_ITEM_TIMEOUT = float(os.getenv("SUMMARY_ITEM_TIMEOUT", "60"))  # seconds per LLM attempt
+SUMMARY_RETRIES = int(os.getenv("SUMMARY_RETRIES", "2"))  # extra attempts after a failure
+SUMMARY_RETRY_BACKOFF = float(os.getenv("SUMMARY_RETRY_BACKOFF", "1.0"))
+
+
+# -------------------- LAZY CLIENTS --------------------
+# SAP client and LLM client (langchain_openai is slow to import) are built on
+# first use so workers start serving tree traffic immediately.
+_sap = None
+_sap_lock = threading.Lock()
+
+_llm = None
+_llm_state = "cold" if os.getenv("OPENAI_API_KEY") else "disabled"  # cold | warm | failed | disabled
+_llm_lock = threading.Lock()
+
+
+def sap_config_error() -> Optional[str]:
+    if not SAP_USERNAME or not SAP_PASSWORD or not SAP_BASE_URL:
+        return "Missing SAP_USERNAME / SAP_PASSWORD / SAP_BASE_URL in environment"
+    return None
+
+
+def get_sap():
+    """Shared SapClient: pooled keep-alive session, cached CSRF token, retries."""
+    global _sap
+    if _sap is None:
+        with _sap_lock:
+            if _sap is None:
+                err = sap_config_error()
+                if err:
+                    raise RuntimeError(err)
+                from sap_client import SapClient
+
+                _sap = SapClient(SAP_USERNAME, SAP_PASSWORD, timeout=DEFAULT_TIMEOUT, verify=VERIFY_SSL)
+    return _sap
+
+
+def get_llm():
+    """ChatOpenAI client, or None when not configured / init failed (fallback summary)."""
+    global _llm, _llm_state
+    if _llm_state in ("warm", "failed", "disabled"):
+        return _llm
+    with _llm_lock:
+        if _llm_state == "cold":
+            try:
+                from langchain_openai import ChatOpenAI
+
+                _llm = ChatOpenAI(
+                    model=os.getenv("LLM_MODEL", "bedrock.anthropic.claude-opus-4"),
+                    temperature=0,
+                    base_url=os.getenv("LLM_BASE_URL", "https://genai-sharedservice-americas.pwcinternal.com"),
+                    api_key=os.getenv("OPENAI_API_KEY"),
+                )
+                _llm_state = "warm"
+            except Exception as e:
+                logger.warning("LLM init failed (will use fallback): %s", e)
+                _llm_state = "failed"
+    return _llm
 
-# optional LLM config
-LLM_ENABLED = False
-if ChatOpenAI is not None and os.getenv("OPENAI_API_KEY"):
-    try:
-        llm = ChatOpenAI(
-            model=os.getenv("LLM_MODEL", "bedrock.anthropic.claude-opus-4"),
-            temperature=0,
-            base_url=os.getenv("LLM_BASE_URL", "https://genai-sharedservice-americas.pwcinternal.com"),
-            api_key=os.getenv("OPENAI_API_KEY"),
-        )
-        LLM_ENABLED = True
-    except Exception as e:
-        logger.warning("LLM init failed (will use fallback): %s", e)
-        LLM_ENABLED = False
 
 # -------------------- FASTAPI --------------------
-app = FastAPI(title="SAP Financial Statements API (env-driven)")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if LLM_WARMUP and _llm_state == "cold":
+        threading.Thread(target=get_llm, name="llm-warmup", daemon=True).start()
+    poller = asyncio.create_task(poll_push_topics()) if PUSH_POLL_INTERVAL > 0 else None
+    yield
+    if poller is not None:
+        poller.cancel()
+    jobs.shutdown()
+    cpu.shutdown()
+
+
+app = FastAPI(title="SAP Financial Statements API (env-driven)", lifespan=lifespan)
 
 # Dev CORS: allow all. Restrict in production.
 app.add_middleware(
@@ -81,7 +216,64 @@ app.add_middleware(
 )
 
 
+def client_id(request: Request) -> str:
+    """
+    Rate-limit identity: the source IP, or what a trusted proxy (TRUSTED_PROXIES)
+    forwards in X-Client-Id / X-Forwarded-For. Clients cannot pick their own
+    id, or a fresh X-Client-Id per request would get a fresh bucket each time.
+    """
+    peer = request.client.host if request.client else "anonymous"
+    if peer not in TRUSTED_PROXIES:
+        return peer
+    forwarded = request.headers.get("X-Forwarded-For", "").split(",")[0].strip()
+    return request.headers.get("X-Client-Id") or forwarded or peer
+
+
+@app.middleware("http")
+async def identify_client(request: Request, call_next):
+    current_client.set(client_id(request))
+    current_charge.set(RequestCharge())
+    return await call_next(request)
+
+
+@app.middleware("http")
+async def memory_diagnostics(request: Request, call_next):
+    # the report endpoint itself (deep=true walks every cached index) would top its own list
+    if not memdiag.ENABLED or request.url.path == "/admin/memory":
+        return await call_next(request)
+    with memory_log.measure(f"{request.method} {request.url.path}") as record:
+        response = await call_next(request)
+        # unknown for streamed bodies
+        record["response_bytes"] = int(response.headers["content-length"]) if "content-length" in response.headers else None
+    return response
+
+
+@app.exception_handler(CacheLockTimeout)
+async def cache_lock_timeout(request: Request, exc: CacheLockTimeout):
+    # another worker is still loading the same key
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "5"})
+
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected(request: Request, exc: AdmissionRejected):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
 # -------------------- HELPERS --------------------
+SELECT_FIELDS = [
+    "FinancialStatementVariant", "FinancialStatementItem", "FinancialStatementItemText",
+    "Currency", "Ledger", "HierarchyNode", "OperativeGLAccount", "OperativeGLAccountName", "FinStatementHierarchyLevelVal",
+    "ParentNode", "ChildNode", "NodeType", "ReportingPeriodAmount", "ComparisonPeriodAmount", "RelativeDifferencePercent",
+    "AbsoluteDifferenceAmount", "CorporateGroupAccount", "CorporateGroupAccountName", "PlanningCategory", "FunctionalArea",
+]
+# always selected under a fields= projection: the tree builder links on them
+STRUCTURE_FIELDS = ["HierarchyNode", "ParentNode"]
+
+
 def _enc(val: Optional[str]) -> str:
     if val is None or val == "":
         return "%27%27"
@@ -119,6 +311,7 @@ def build_odata_url(
     P_FROM_COMPYEARPERIOD: Optional[str] = None,
     P_TO_COMPYEARPERIOD: Optional[str] = None,
     sap_client: str = SAP_CLIENT,
+    select: Optional[List[str]] = None,
 ) -> str:
     P_KTOPL = P_KTOPL or "0808"
     P_VERSN = P_VERSN or "2000_DRAFT"
@@ -154,12 +347,7 @@ def build_odata_url(
     ident_pairs = ",".join(f"{k}={_enc(v)}" for k, v in parts.items())
     ident_segment = f"({ident_pairs})/Result"
 
-    select_clause = (
-        "$select=FinancialStatementVariant,FinancialStatementItem,FinancialStatementItemText,"
-        "Currency,Ledger,HierarchyNode,OperativeGLAccount,OperativeGLAccountName,FinStatementHierarchyLevelVal,"
-        "ParentNode,ChildNode,NodeType,ReportingPeriodAmount,ComparisonPeriodAmount,RelativeDifferencePercent,"
-        "AbsoluteDifferenceAmount,CorporateGroupAccount,CorporateGroupAccountName,PlanningCategory,FunctionalArea"
-    )
+    select_clause = "$select=" + ",".join(select or SELECT_FIELDS)
 
     extra = "&$top=1000000&$orderby=HierarchyNode,FinStatementHierarchyLevelVal,FinancialStatementItem,OperativeGLAccount asc"
 
@@ -167,49 +355,554 @@ def build_odata_url(
     return url
 
 
-def fetch_financial_statements(url: str) -> List[Dict[str, Any]]:
+def fetch_statement_body(url: str) -> bytes:
+    """The raw SAP response body (network I/O only; parsing is a CPU stage)."""
     logger.info("Fetching SAP OData URL: %s", url)
-    headers = {"X-CSRF-Token": "Fetch"}
-    resp = session.get(url, headers=headers, timeout=DEFAULT_TIMEOUT, verify=VERIFY_SSL)
-    if resp.status_code != 200:
-        logger.error("SAP responded %s: %s", resp.status_code, resp.text[:400])
-        raise HTTPException(status_code=500, detail=f"SAP error: {resp.status_code} {resp.text[:400]}")
-    try:
-        data = resp.json()
-    except Exception as e:
-        logger.exception("Invalid JSON from SAP")
-        raise HTTPException(status_code=500, detail=f"Invalid JSON from SAP: {e}")
-    results = data.get("d", {}).get("results", [])
-    if not isinstance(results, list):
-        logger.error("Unexpected SAP response structure: %s", data)
-        raise HTTPException(status_code=500, detail="Unexpected SAP response structure (missing d.results list)")
+    with memdiag.stage("fetch") as info:
+        resp = get_sap().get(url)
+        if resp.status_code != 200:
+            logger.error("SAP responded %s: %s", resp.status_code, resp.text[:400])
+            raise HTTPException(status_code=500, detail=f"SAP error: {resp.status_code} {resp.text[:400]}")
+        info["sap_bytes"] = len(resp.content)
+    return resp.content
+
+
+def parse_statement_body(body: bytes) -> List[Dict[str, Any]]:
+    with memdiag.stage("parse", sap_bytes=len(body)) as info:
+        try:
+            data = json.loads(body)
+        except Exception as e:
+            logger.exception("Invalid JSON from SAP")
+            raise HTTPException(status_code=500, detail=f"Invalid JSON from SAP: {e}")
+        results = data.get("d", {}).get("results", []) if isinstance(data, dict) else None
+        if not isinstance(results, list):
+            logger.error("Unexpected SAP response structure: %s", str(data)[:400])
+            raise HTTPException(status_code=500, detail="Unexpected SAP response structure (missing d.results list)")
+        info["rows"] = len(results)
     return results
 
 
+def fetch_financial_statements(url: str) -> List[Dict[str, Any]]:
+    return parse_statement_body(fetch_statement_body(url))
+
+
 def build_tree_with_children(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    for r in records:
-        if "Children" not in r:
-            r["Children"] = []
-    by_id = {str(r.get("HierarchyNode")): r for r in records if r.get("HierarchyNode") is not None}
-    roots: List[Dict[str, Any]] = []
-    for r in records:
-        parent = r.get("ParentNode")
-        if parent and str(parent) in by_id:
-            by_id[str(parent)]["Children"].append(r)
-        else:
-            roots.append(r)
+    with memdiag.stage("build", rows=len(records)):
+        roots, _ = build_tree(records, TREE_MAX_DEPTH)
     return roots
 
 
+# -------------------- TREE CACHE --------------------
+# The shared cache holds each tree pre-serialized as the /financial-statements
+# JSON body: bytes move between workers cheaply and the full tree is served
+# as-is. A worker only parses them into a TreeIndex when an endpoint needs
+# node-level access (root/max_depth, rows, export, trend...).
+# parsed indexes are several times the size of their payload: keep a bounded LRU
+_tree_index_memo = InProcessCache(TREE_INDEX_MEMO_SIZE)
+tree_stats = TreeBuildStats()
+
+
+def content_hash(obj: Any) -> str:
+    return hashlib.sha1(json.dumps(obj, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")).hexdigest()
+
+
+def tree_key(url: str) -> str:
+    return cache_key("treejson", url)
+
+
+def tree_topic(url: str) -> str:
+    return "tree:" + tree_key(url)
+
+
+def publish_tree(url: str, entry: Dict[str, Any]) -> None:
+    """Push a rebuilt full tree here, and leave its etag where other workers' pollers look."""
+    cache.set(cache_key("tree-etag", tree_key(url)), entry["etag"], max(JOB_RESULT_TTL, TREE_CACHE_TTL))
+    push.publish_tree(tree_topic(url), entry)
+
+
+def build_tree_payload(
+    url: str,
+    report: Optional[Callable[..., None]] = None,
+    select: Optional[List[str]] = None,
+    skeleton: Optional[bytes] = None,
+    fetch: Callable[[str], bytes] = fetch_statement_body,
+    offload: Optional[Callable[..., Tuple[bytes, Dict[str, Any], Optional[bytes]]]] = None,
+) -> Tuple[bytes, Dict[str, Any], Optional[bytes]]:
+    """
+    Fetch one tree from SAP and turn it into its serialized payload.
+    `url` selects every field. Given the cached hierarchy `skeleton`, only the
+    non-hierarchy columns (amounts, ledger, account names...) are fetched and
+    mapped onto it by node position; otherwise the full rows are fetched and
+    linked, and a new skeleton comes back as the third item. When the period
+    rows hold nodes the skeleton lacks (another company code, say), the new
+    skeleton is the cached one extended with them.
+
+    The network fetch runs in the calling thread via `fetch`; the CPU part
+    (tree_payload_from_body) runs via `offload` (the CPU pool), or inline
+    with progress `report`s when no offload is given (job workers).
+    """
+    report = report or (lambda stage, **counts: None)
+
+    def build(body: bytes, skel: Optional[bytes], full: bool) -> Tuple[bytes, Dict[str, Any], Optional[bytes]]:
+        if offload is not None:
+            return offload(body, select, skel, full)
+        return tree_payload_from_body(body, select, skel, full, report)
+
+    if skeleton is not None:
+        report("fetching")
+        body = fetch(projected_url(url, period_select(select or SELECT_FIELDS)))
+        try:
+            return build(body, skeleton, False)
+        except SkeletonMismatch as e:
+            logger.info("Hierarchy skeleton lacks nodes, extending it: %s", e)
+        # the skeleton is extended from a full fetch even under a projection
+        report("fetching")
+        return build(fetch(url), skeleton, True)
+
+    report("fetching")
+    body = fetch(url if select is None else projected_url(url, select))
+    return build(body, None, select is None)
+
+
+def tree_payload_from_body(
+    body: bytes,
+    select: Optional[List[str]] = None,
+    skeleton: Optional[bytes] = None,
+    full: bool = True,
+    report: Optional[Callable[..., None]] = None,
+) -> Tuple[bytes, Dict[str, Any], Optional[bytes]]:
+    """
+    Parse, build and serialize one fetched SAP body; the CPU-heavy part of a
+    cache miss. A partial (period) body is mapped onto `skeleton` and raises
+    SkeletonMismatch when it does not cover the rows; a `full` body is linked
+    by build_tree and returns a skeleton, extending `skeleton` when given.
+    With MEMORY_DIAGNOSTICS on, the parse / build / serialize memory stages are
+    returned under diagnostics["memory"] (this may run in another process).
+    """
+    report = report or (lambda stage, **counts: None)
+    new_skeleton: Optional[bytes] = None
+    with memdiag.recording() as stages:
+        records = parse_statement_body(body)
+        report("building", rows_fetched=len(records))
+        if skeleton is not None and not full:
+            skel = json.loads(skeleton)
+            with memdiag.stage("build", rows=len(records), skeleton_bytes=len(skeleton)):
+                roots, diagnostics = materialize(skel, *align_rows(skel, records))
+        else:
+            with memdiag.stage("build", rows=len(records)):
+                roots, diagnostics = build_tree(records, TREE_MAX_DEPTH)
+                if skeleton is not None:
+                    new_skeleton = extend_skeleton(json.loads(skeleton), roots, TREE_MAX_DEPTH)
+                elif full:
+                    new_skeleton = make_skeleton(roots, TREE_MAX_DEPTH)
+
+        report("serializing", rows_fetched=diagnostics["rows"], nodes_built=diagnostics["nodes"])
+        with memdiag.stage("serialize", nodes=diagnostics["nodes"]) as info:
+            if select is not None:
+                roots = project_tree(roots, select)
+            payload = json.dumps({"records": roots, "diagnostics": diagnostics}, separators=(",", ":")).encode("utf-8")
+            info["payload_bytes"] = len(payload)
+    if stages:
+        diagnostics = {**diagnostics, "memory": stages}
+    return payload, diagnostics, new_skeleton
+
+
+def _tree_payload_stage(
+    body: bytes, select: Optional[List[str]], skeleton: Optional[bytes], full: bool
+) -> Tuple[bytes, Dict[str, Any], Optional[bytes]]:
+    # runs in the CPU pool; SkeletonMismatch pickles back as is
+    try:
+        return tree_payload_from_body(body, select, skeleton, full)
+    except HTTPException as e:
+        raise StageError(e.status_code, e.detail)
+
+
+def offload_tree_payload(
+    body: bytes, select: Optional[List[str]], skeleton: Optional[bytes], full: bool
+) -> Tuple[bytes, Dict[str, Any], Optional[bytes]]:
+    try:
+        return cpu.run(_tree_payload_stage, body, select, skeleton, full)
+    except StageError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+
+def admitted_fetch(url: str) -> bytes:
+    """SAP fetch under admission control: only the network call holds a slot."""
+    with admission.admit():
+        return fetch_statement_body(url)
+
+
+def make_tree_entry(payload: bytes, diagnostics: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "built_at": time.time(),
+        "payload": payload,
+        "etag": hashlib.sha1(payload).hexdigest(),
+        "diagnostics": diagnostics,
+    }
+
+
+def record_tree_diagnostics(url: str, diagnostics: Dict[str, Any]) -> None:
+    tree_stats.record(url, diagnostics)
+    if not diagnostics["ok"]:
+        logger.warning("Inconsistent SAP hierarchy for %s: %s", url, diagnostics["counts"])
+
+
+def skeleton_key(url: str) -> str:
+    """
+    The hierarchy only depends on the client, FS version and chart of accounts;
+    the skeleton keeps nothing else (skeleton.HIERARCHY_FIELDS). Which of its
+    nodes have rows varies with the company and period, so one skeleton grows
+    to the union of the nodes seen (skeleton.extend_skeleton).
+    """
+    return cache_key("hierarchy", "|".join(re.findall(r"sap-client=[^&]*|P_(?:VERSN|KTOPL)=%27.*?%27(?=[,)])", url)))
+
+
+def store_skeleton(url: str, skeleton: Optional[bytes]) -> None:
+    if skeleton is None or SKELETON_CACHE_TTL <= 0:
+        return
+    key = skeleton_key(url)
+    # concurrent builds for different companies each extend the skeleton they read
+    with cache.lock(key, timeout=30):
+        current = cache.get(key)
+        if current is not MISSING:
+            skeleton = merge_skeletons(skeleton, current, TREE_MAX_DEPTH)
+        cache.set(key, skeleton, SKELETON_CACHE_TTL)
+
+
+def _load_tree_entry(url: str, select: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Build the tree for the full-field `url` (cut down to `select`), reusing the cached skeleton."""
+    skeleton = cache.get(skeleton_key(url)) if SKELETON_CACHE_TTL > 0 else MISSING
+    payload, diagnostics, new_skeleton = build_tree_payload(
+        url,
+        select=select,
+        skeleton=None if skeleton is MISSING else skeleton,
+        fetch=admitted_fetch,
+        offload=offload_tree_payload,
+    )
+    memdiag.extend(diagnostics.get("memory"))
+    store_skeleton(url, new_skeleton)
+    record_tree_diagnostics(url, diagnostics)
+    entry = make_tree_entry(payload, diagnostics)
+    if select is None:
+        publish_tree(url, entry)
+    return entry
+
+
+# fields= projections: a projected tree is cached under its own (narrower
+# $select) URL, and the full-field URL's "projections" key lists which ones
+# are cached, so a request can be cut down from any cached superset instead
+# of going back to SAP.
+def projected_url(url: str, select: List[str]) -> str:
+    return url.replace("$select=" + ",".join(SELECT_FIELDS), "$select=" + ",".join(select), 1)
+
+
+def _cached_projections(url: str) -> List[List[str]]:
+    known = cache.get(cache_key("projections", url))
+    return [] if known is MISSING else known
+
+
+def _remember_projection(url: str, select: List[str]) -> None:
+    known = _cached_projections(url)
+    if select not in known and TREE_CACHE_TTL > 0:
+        cache.set(cache_key("projections", url), known + [select], TREE_CACHE_TTL)
+
+
+def _project_from_wider(url: str, select: List[str]) -> Optional[Dict[str, Any]]:
+    wanted = set(select)
+    # widest first: the full tree, then cached projections with the most fields
+    candidates = [None] + sorted((p for p in _cached_projections(url) if wanted < set(p)), key=len, reverse=True)
+    for wider in candidates:
+        entry = cache.get(tree_key(url if wider is None else projected_url(url, wider)))
+        if entry is MISSING:
+            continue
+        roots = project_tree(json.loads(entry["payload"])["records"], select)
+        payload = json.dumps({"records": roots, "diagnostics": entry.get("diagnostics")}, separators=(",", ":")).encode("utf-8")
+        # same data as the wider tree: keep its build time and expiry
+        narrow = {**make_tree_entry(payload, entry.get("diagnostics")), "built_at": entry["built_at"]}
+        ttl = int(TREE_CACHE_TTL - (time.time() - entry["built_at"]))
+        if ttl > 0:
+            cache.set(tree_key(projected_url(url, select)), narrow, ttl)
+            _remember_projection(url, select)
+        return narrow
+    return None
+
+
+def get_tree_entry(url: str, select: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Cached tree for the full-field `url`, cut down to `select` when given."""
+    if select is None:
+        return cache.get_or_load(tree_key(url), TREE_CACHE_TTL, lambda: _load_tree_entry(url))
+
+    purl = projected_url(url, select)
+    entry = cache.get(tree_key(purl))
+    if entry is MISSING:
+        entry = _project_from_wider(url, select)
+    if entry is None:
+        entry = cache.get_or_load(tree_key(purl), TREE_CACHE_TTL, lambda: _load_tree_entry(url, select))
+        _remember_projection(url, select)
+    return entry
+
+
+def get_tree_index(url: str, select: Optional[List[str]] = None) -> TreeIndex:
+    key = tree_key(url if select is None else projected_url(url, select))
+    index = _tree_index_memo.get(key)
+    if index is not MISSING:
+        return index
+
+    entry = get_tree_entry(url, select)
+    index = TreeIndex(
+        json.loads(entry["payload"])["records"],
+        etag=entry["etag"],
+        built_at=entry["built_at"],
+        diagnostics=entry.get("diagnostics"),
+    )
+    # expires with the tree it was parsed from
+    ttl = TREE_CACHE_TTL - (time.time() - entry["built_at"])
+    if ttl > 0:
+        _tree_index_memo.set(key, index, ttl)
+    return index
+
+
+def full_tree_response(request: Request, entry: Dict[str, Any]) -> Response:
+    """The whole tree straight from the cached bytes: no parsing or re-serializing."""
+    headers = validators(entry["etag"], entry["built_at"])
+    if is_not_modified(request, entry["etag"], entry["built_at"]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry["payload"], media_type="application/json", headers=headers)
+
+
+# -------------------- BACKGROUND JOBS --------------------
+def _statement_job(job_id: str, progress: Any, url: str) -> Dict[str, Any]:
+    """
+    Runs in a job worker process (no admission control: JOB_WORKERS bounds SAP
+    load). Returns a tree cache entry; the parent stores it under the URL's key.
+    """
+    counts: Dict[str, int] = {"rows_fetched": 0, "nodes_built": 0}
+
+    def report(stage: str, **kw: int) -> None:
+        counts.update(kw)
+        progress[job_id] = {"stage": stage, **counts}
+
+    try:
+        cached = cache.get(skeleton_key(url)) if SKELETON_CACHE_TTL > 0 else MISSING
+        payload, diagnostics, skeleton = build_tree_payload(url, report, skeleton=None if cached is MISSING else cached)
+        report("done")
+        return {**make_tree_entry(payload, diagnostics), "skeleton": skeleton}
+    except Exception as e:
+        report("failed")
+        if isinstance(e, HTTPException):
+            # HTTPException does not survive pickling back to the parent
+            raise RuntimeError(e.detail)
+        raise
+
+
+def _store_statement_job(job, entry: Dict[str, Any]) -> str:
+    key = tree_key(job.key)
+    store_skeleton(job.key, entry.pop("skeleton", None))
+    record_tree_diagnostics(job.key, entry["diagnostics"])
+    cache.set(key, entry, max(JOB_RESULT_TTL, TREE_CACHE_TTL))
+    _tree_index_memo.delete(key)
+    publish_tree(job.key, entry)
+    return job.key
+
+
+def _summary_job(job_id: str, progress: Any, scope: str, nodes: list) -> Dict[str, Any]:
+    """Runs in a job worker process; the worker builds its own LLM client on first use."""
+    progress[job_id] = {"stage": "summarizing"}
+    stats = pre_summary(nodes)
+    llm = get_llm()
+    summary_text = local_summary(stats) if llm is None else _summarize_with_retries(llm, scope, stats, nodes)[0]
+    progress[job_id] = {"stage": "done"}
+    return {"summary": summary_text, "stats": stats, "llm": llm is not None}
+
+
+def _store_summary_job(job, result: Dict[str, Any]) -> Dict[str, Any]:
+    llm = result.pop("llm")  # internal: only LLM answers are cached, not the local fallback
+    if SUMMARY_CACHE_TTL > 0 and llm:
+        cache.set(job.key, result["summary"], SUMMARY_CACHE_TTL)
+    return result
+
+
+def job_event(job) -> Dict[str, Any]:
+    return {"type": "job", **job.to_dict(jobs.progress(job.id)), "result_url": f"/jobs/{job.id}/result"}
+
+
+def publish_job(job) -> None:
+    topic = f"job:{job.id}"
+    push.mark(topic, job.status)
+    push.publish(topic, job_event(job))
+
+
+def poll_shared_events(topics: List[str]) -> None:
+    """
+    Push what other workers did to this worker's subscribers: trees rebuilt
+    there (their etag moved in the cache) and jobs they own that finished.
+    """
+    for topic in topics:
+        kind, _, ident = topic.partition(":")
+        if kind == "tree":
+            etag = cache.get(cache_key("tree-etag", ident))
+            if etag is MISSING or etag == push.version(topic):
+                continue
+            entry = cache.get(ident)
+            if entry is not MISSING and entry["etag"] == etag:  # else not stored yet: next round
+                push.publish_tree(topic, entry)
+        elif kind == "job":
+            job = jobs.get(ident)
+            if job is not None and job.status in ("done", "failed") and push.version(topic) != job.status:
+                publish_job(job)
+
+
+async def poll_push_topics() -> None:
+    while True:
+        await asyncio.sleep(PUSH_POLL_INTERVAL)
+        topics = push.topics()
+        if not topics:
+            continue
+        try:
+            await run_in_threadpool(poll_shared_events, topics)
+        except Exception:
+            logger.exception("Polling shared push events failed")
+
+
+def job_or_404(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job
+
+
+# -------------------- CONDITIONAL GET --------------------
+def validators(etag: str, last_modified: Optional[float]) -> Dict[str, str]:
+    headers = {"ETag": f'"{etag}"'}
+    if last_modified is not None:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+    return headers
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[float]) -> bool:
+    """RFC 9110: If-None-Match wins over If-Modified-Since when both are sent."""
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        tags = {t.strip().removeprefix("W/") for t in inm.split(",")}
+        return "*" in tags or f'"{etag}"' in tags
+    ims = request.headers.get("if-modified-since")
+    if ims and last_modified is not None:
+        try:
+            return int(last_modified) <= int(parsedate_to_datetime(ims).timestamp())
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def conditional(request: Request, response: Response, etag: str, last_modified: Optional[float]) -> Optional[Response]:
+    """304 response if the client's copy is current, else stamp validators on `response`."""
+    headers = validators(etag, last_modified)
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+# -------------------- PERIOD CUBE --------------------
+cube_cache = CubeCache(CUBE_CACHE_MAX_BYTES)
+
+
+def period_slice_params(params: Dict[str, Any], period: str) -> Dict[str, Any]:
+    out = dict(params)
+    out.update(
+        P_FROM_YEARPERIOD=period,
+        P_TO_YEARPERIOD=period,
+        P_YEAR=period[:4],
+        P_FROM_COMPYEARPERIOD=None,
+        P_TO_COMPYEARPERIOD=None,
+        P_COMP_YEAR=None,
+    )
+    return out
+
+
+def get_period_cube(params: Dict[str, Any], periods: List[str]) -> PeriodCube:
+    urls = [build_odata_url(**period_slice_params(params, p)) for p in periods]
+    key = cache_key("cube", "|".join(urls))
+    cube = cube_cache.get(key)
+    if cube is not None and time.time() - cube.built_at < TREE_CACHE_TTL:
+        return cube
+
+    # each slice goes through the tree cache, so overlapping trends share SAP pulls
+    # copy the request context into each task so admission sees the calling client
+    with ThreadPoolExecutor(max_workers=max(1, min(CUBE_FETCH_CONCURRENCY, len(urls)))) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, get_tree_index, u) for u in urls]
+        slices = [f.result() for f in futures]
+
+    est = PeriodCube.estimate_bytes(max(len(s) for s in slices), len(periods))
+    if est > CUBE_MAX_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Trend cube would need ~{est} bytes (limit {CUBE_MAX_BYTES}); request fewer periods.",
+        )
+    cube = PeriodCube(periods, slices)
+    if not cube.diagnostics["ok"]:
+        logger.warning("Inconsistent hierarchy across trend periods %s: %s", ",".join(periods), cube.diagnostics["counts"])
+    cube_cache.put(key, cube)
+    return cube
+
+
+# -------------------- CONSOLIDATION --------------------
+def _timed_tree_index(url: str) -> Tuple[TreeIndex, float]:
+    started = time.perf_counter()
+    index = get_tree_index(url)
+    return index, time.perf_counter() - started
+
+
+def get_consolidation(params: Dict[str, Any], companies: List[str]) -> Tuple[Consolidation, Dict[str, Any]]:
+    """Merged company statements (cached with the trend cubes) and the fetch timings of this call."""
+    urls = [build_odata_url(**{**params, "P_BUKRS": c}) for c in companies]
+    key = cache_key("consolidation", "|".join(urls))
+    cons = cube_cache.get(key)
+    if cons is not None and time.time() - cons.built_at < TREE_CACHE_TTL:
+        return cons, {"cached": True}
+
+    # each company goes through the tree cache, like the trend slices
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, min(CONSOLIDATION_FETCH_CONCURRENCY, len(urls)))) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, _timed_tree_index, u) for u in urls]
+        fetched = [f.result() for f in futures]
+    timings = {
+        "cached": False,
+        "fetch": time.perf_counter() - started,
+        "fetch_by_company": {c: round(t, 6) for c, (_, t) in zip(companies, fetched)},
+    }
+
+    slices = [index for index, _ in fetched]
+    est = Consolidation.estimate_bytes(sum(len(s) for s in slices), len(companies))
+    if est > CUBE_MAX_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Consolidation would need ~{est} bytes (limit {CUBE_MAX_BYTES}); request fewer companies.",
+        )
+    cons = Consolidation(companies, slices)
+    cube_cache.put(key, cons)
+    return cons, timings
+
+
 # -------------------- Pydantic models --------------------
 class SummarizeRequest(BaseModel):
     scope: str
     nodes: list
 
 
-# -------------------- ROUTES --------------------
-@app.get("/financial-statements")
-def financial_statements(
+class SummarizeBatchRequest(BaseModel):
+    items: List[SummarizeRequest] = Field(..., min_length=1, max_length=SUMMARY_BATCH_MAX_ITEMS)
+
+
+class VisibleRowsRequest(BaseModel):
+    expanded: List[str] = []  # HierarchyNode ids currently open in the UI
+    expand_all: bool = False
+    offset: int = Field(0, ge=0)
+    limit: int = Field(200, ge=0, le=5000)
+
+
+# -------------------- QUERY PARAMS --------------------
+def statement_params(
     P_KTOPL: Optional[str] = Query(None),
     P_VERSN: Optional[str] = Query(None),
     P_BILABTYP: Optional[str] = Query(None),
@@ -228,7 +921,8 @@ def financial_statements(
     compYear: Optional[str] = Query(None),
     compMonth: Optional[str] = Query(None),
     sap_client: str = Query(SAP_CLIENT),
-):
+) -> Dict[str, Any]:
+    """Shared statement query params -> build_odata_url() kwargs."""
     if endYear or endMonth:
         computed = sap_yearperiod(endYear, endMonth)
         if computed is None:
@@ -245,54 +939,627 @@ def financial_statements(
         P_TO_COMPYEARPERIOD = computed_comp
         P_COMP_YEAR = compYear or P_COMP_YEAR
 
+    return {
+        "P_KTOPL": P_KTOPL,
+        "P_VERSN": P_VERSN,
+        "P_BILABTYP": P_BILABTYP,
+        "P_XKTOP2": P_XKTOP2,
+        "P_COMP_YEAR": P_COMP_YEAR,
+        "P_YEAR": P_YEAR,
+        "P_BUKRS": P_BUKRS,
+        "P_RLDNR": P_RLDNR,
+        "P_CURTP": P_CURTP,
+        "P_FROM_YEARPERIOD": P_FROM_YEARPERIOD,
+        "P_TO_YEARPERIOD": P_TO_YEARPERIOD,
+        "P_FROM_COMPYEARPERIOD": P_FROM_COMPYEARPERIOD,
+        "P_TO_COMPYEARPERIOD": P_TO_COMPYEARPERIOD,
+        "sap_client": sap_client,
+    }
+
+
+def field_projection(
+    fields: Optional[str] = Query(
+        None, description="Comma-separated record fields to return (HierarchyNode/ParentNode always included)"
+    ),
+) -> Optional[List[str]]:
+    """fields= -> $select list in SELECT_FIELDS order, or None for every field."""
+    if not fields:
+        return None
+    wanted = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = sorted(wanted - set(SELECT_FIELDS))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    wanted.update(STRUCTURE_FIELDS)
+    if len(wanted) == len(SELECT_FIELDS):
+        return None
+    return [f for f in SELECT_FIELDS if f in wanted]
+
+
+def statement_params_from(raw: Dict[str, Any]) -> Dict[str, Any]:
+    """statement_params() for parameters that do not come from a query string (WebSocket messages)."""
+    kwargs = {
+        name: (str(raw[name]) if raw.get(name) is not None else None) if name in raw else p.default.default
+        for name, p in inspect.signature(statement_params).parameters.items()
+    }
+    return statement_params(**kwargs)
+
+
+def odata_url_for(params: Dict[str, Any]) -> str:
     try:
-        odata_url = build_odata_url(
-            P_KTOPL=P_KTOPL,
-            P_VERSN=P_VERSN,
-            P_BILABTYP=P_BILABTYP,
-            P_XKTOP2=P_XKTOP2,
-            P_COMP_YEAR=P_COMP_YEAR,
-            P_YEAR=P_YEAR,
-            P_BUKRS=P_BUKRS,
-            P_RLDNR=P_RLDNR,
-            P_CURTP=P_CURTP,
-            P_FROM_YEARPERIOD=P_FROM_YEARPERIOD,
-            P_TO_YEARPERIOD=P_TO_YEARPERIOD,
-            P_FROM_COMPYEARPERIOD=P_FROM_COMPYEARPERIOD,
-            P_TO_COMPYEARPERIOD=P_TO_COMPYEARPERIOD,
-            sap_client=sap_client,
-        )
+        return build_odata_url(**params)
     except Exception as e:
         logger.exception("Failed to build URL")
         raise HTTPException(status_code=500, detail=f"Failed to build OData URL: {e}")
 
-    records = fetch_financial_statements(odata_url)
-    tree = build_tree_with_children(records)
-    return {"records": tree}
 
+# -------------------- ROUTES --------------------
+@app.get("/healthz")
+def healthz():
+    """Liveness: the worker is up (no SAP / LLM checks)."""
+    return {"status": "ok"}
 
-@app.post("/summarize_tree")
-def summarize_tree(body: SummarizeRequest):
-    nodes_preview = body.nodes[:50]
-    prompt = (
+
+@app.get("/readyz")
+def readyz(require_llm: bool = Query(False, description="Also require a warm LLM client")):
+    """Readiness for tree traffic; the LLM only gates readiness when require_llm=true."""
+    err = sap_config_error()
+    ready = err is None and (not require_llm or _llm_state == "warm")
+    body = {"ready": ready, "sap": err or "configured", "llm": _llm_state}
+    if not ready:
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+
+@app.get("/financial-statements")
+def financial_statements(
+    request: Request,
+    response: Response,
+    params: Dict[str, Any] = Depends(statement_params),
+    max_depth: Optional[int] = Query(None, ge=0, description="Levels to return below the root(s)"),
+    root: Optional[str] = Query(None, description="HierarchyNode to return the subtree of"),
+    select: Optional[List[str]] = Depends(field_projection),
+):
+    odata_url = odata_url_for(params)
+    if root is None and max_depth is None:
+        return full_tree_response(request, get_tree_entry(odata_url, select))
+
+    index = get_tree_index(odata_url, select)
+    not_modified = conditional(request, response, index.etag, index.built_at)
+    if not_modified is not None:
+        return not_modified
+
+    if root is not None:
+        if root not in index:
+            raise HTTPException(status_code=404, detail=f"Unknown HierarchyNode: {root}")
+        return {
+            "records": [index.truncated(root, max_depth)],
+            "path": index.path(root),
+            "diagnostics": index.diagnostics,
+        }
+    return {"records": [index.truncated(node_key(r), max_depth) for r in index.roots], "diagnostics": index.diagnostics}
+
+
+@app.post("/financial-statements/rows")
+def financial_statements_rows(
+    body: VisibleRowsRequest,
+    params: Dict[str, Any] = Depends(statement_params),
+    select: Optional[List[str]] = Depends(field_projection),
+):
+    """
+    Window [offset, offset + limit) of the flattened pre-order rows visible with
+    `expanded` open (or everything, with expand_all) for a virtualized list.
+    Rows carry no Children; Depth / ChildCount / Expanded drive the rendering.
+    """
+    index = get_tree_index(odata_url_for(params), select)
+    total, ids = index.visible_window(body.expanded, body.offset, body.limit, expand_all=body.expand_all)
+    expanded = set(body.expanded)
+    rows = []
+    for node_id in ids:
+        row = {k: v for k, v in index.by_id[node_id].items() if k != "Children"}
+        child_count = len(index.children[node_id])
+        row["Depth"] = index.depth[node_id]
+        row["ChildCount"] = child_count
+        row["Expanded"] = child_count > 0 and (body.expand_all or node_id in expanded)
+        rows.append(row)
+    return {"total": total, "offset": body.offset, "rows": rows}
+
+
+@app.get("/financial-statements/export")
+def financial_statements_export(
+    request: Request,
+    params: Dict[str, Any] = Depends(statement_params),
+    format: str = Query("csv", description="csv | xlsx | parquet"),
+    root: Optional[str] = Query(None, description="Only export the subtree of this HierarchyNode"),
+    select: Optional[List[str]] = Depends(field_projection),
+):
+    """Stream the cached tree as a flattened, indented table with subtree rollups."""
+    fmt = format.lower()
+    if fmt not in export.WRITERS:
+        raise HTTPException(status_code=400, detail=f"Unknown export format: {format}")
+    if fmt not in export.available_formats():
+        raise HTTPException(status_code=501, detail=f"Export format {fmt} is not installed on this server")
+
+    if select is not None:
+        # the indented label and rollup columns are computed from these
+        needed = set(select) | set(export.ROLLUP_FIELDS) | {"FinancialStatementItemText"}
+        select = [f for f in SELECT_FIELDS if f in needed]
+    index = get_tree_index(odata_url_for(params), select)
+    if root is not None and root not in index:
+        raise HTTPException(status_code=404, detail=f"Unknown HierarchyNode: {root}")
+
+    headers = validators(index.etag, index.built_at)
+    if is_not_modified(request, index.etag, index.built_at):
+        return Response(status_code=304, headers=headers)
+
+    filename = f"financial-statement-{params.get('P_BUKRS') or params.get('P_KTOPL') or 'export'}.{fmt}"
+    headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return StreamingResponse(export.WRITERS[fmt](index, select or SELECT_FIELDS, root), media_type=export.MEDIA_TYPES[fmt], headers=headers)
+
+
+@app.post("/jobs/financial-statements", status_code=202)
+def create_statement_job(params: Dict[str, Any] = Depends(statement_params)):
+    """Build a statement in the background; identical running requests share one job."""
+    url = odata_url_for(params)
+    job = jobs.submit("financial-statements", url, _statement_job, url, on_done=_store_statement_job)
+    return {
+        **job.to_dict(jobs.progress(job.id)),
+        "status_url": f"/jobs/{job.id}",
+        "result_url": f"/jobs/{job.id}/result",
+    }
+
+
+@app.post("/jobs/summaries", status_code=202)
+def create_summary_job(body: SummarizeRequest):
+    """Summarize in the background; subscribe to job:<job_id> on /ws to be told when it is ready."""
+    key = summary_key(body.scope, body.nodes)
+    job = jobs.submit("summary", key, _summary_job, body.scope, body.nodes, on_done=_store_summary_job)
+    return {
+        **job.to_dict(jobs.progress(job.id)),
+        "status_url": f"/jobs/{job.id}",
+        "result_url": f"/jobs/{job.id}/result",
+    }
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_or_404(job_id)
+    return job.to_dict(jobs.progress(job.id))
+
+
+@app.get("/jobs/{job_id}/result")
+def get_job_result(
+    job_id: str,
+    request: Request,
+    response: Response,
+    format: str = Query("json", description="json | csv | xlsx | parquet"),
+    max_depth: Optional[int] = Query(None, ge=0),
+):
+    """Finished job result, served from the tree cache (JSON or a streamed export)."""
+    job = job_or_404(job_id)
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=f"Job failed: {job.error}")
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}", headers={"Retry-After": "5"})
+    if job.kind == "summary":
+        return job.result
+
+    fmt = format.lower()
+    if fmt == "json" and max_depth is None:
+        return full_tree_response(request, get_tree_entry(job.result))
+
+    index = get_tree_index(job.result)
+    if fmt != "json":
+        if fmt not in export.available_formats():
+            raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+        return StreamingResponse(export.WRITERS[fmt](index, SELECT_FIELDS), media_type=export.MEDIA_TYPES[fmt])
+
+    not_modified = conditional(request, response, index.etag, index.built_at)
+    if not_modified is not None:
+        return not_modified
+    return {"records": [index.truncated(node_key(r), max_depth) for r in index.roots], "diagnostics": index.diagnostics}
+
+
+@app.get("/admin/sap-stats")
+def sap_stats():
+    """Connection pool / CSRF token reuse counters for this worker."""
+    return get_sap().stats()
+
+
+@app.get("/admin/admission")
+def admission_metrics():
+    """SAP admission queue depth, wait times and rejections for this worker."""
+    return admission.metrics()
+
+
+@app.get("/admin/push")
+def push_metrics():
+    """WebSocket connections, subscriptions and events pushed by this worker."""
+    return push.metrics()
+
+
+@app.get("/admin/tree-builds")
+def tree_build_metrics():
+    """Duplicate / orphan / cycle / depth-cut counts from this worker's tree builds."""
+    return tree_stats.metrics()
+
+
+@app.get("/admin/memory")
+def memory_metrics(
+    top: int = Query(10, ge=1, le=100, description="Allocation sites / largest keys to list"),
+    deep: bool = Query(False, description="Also walk parsed tree indexes for their retained size (slow)"),
+):
+    """
+    RSS, traced allocations and per-key cache sizes of this worker, plus the
+    heaviest recent requests with their fetch / build / serialize stages
+    (MEMORY_DIAGNOSTICS=true for the traced numbers).
+    """
+    shared = cache.sizes()
+    memo = dict(_tree_index_memo.items())
+    cubes = cube_cache.sizes()
+    out: Dict[str, Any] = {
+        "enabled": memdiag.ENABLED,
+        "log_threshold_bytes": memdiag.LOG_THRESHOLD_BYTES,
+        "rss_bytes": memdiag.rss_bytes(),
+        "max_rss_bytes": memdiag.max_rss_bytes(),
+        "caches": {
+            "shared": {
+                "keys": len(shared),
+                "bytes": sum(shared.values()),
+                "largest": dict(sorted(shared.items(), key=lambda kv: -kv[1])[:top]),
+            },
+            "tree_indexes": {
+                k: {"nodes": len(index), **({"bytes": memdiag.deep_size(index)} if deep else {})}
+                for k, index in memo.items()
+            },
+            "cubes": {"keys": len(cubes), "bytes": sum(cubes.values()), "by_key": cubes},
+        },
+    }
+    if memdiag.ENABLED:
+        out["traced"] = {"current_bytes": memdiag.traced_bytes(), "top": memdiag.top_allocations(top)}
+        out["requests"] = memory_log.snapshot()
+    return out
+
+
+@app.get("/financial-statements/trend")
+def financial_statements_trend(
+    request: Request,
+    response: Response,
+    params: Dict[str, Any] = Depends(statement_params),
+    periods: str = Query(..., description="Comma-separated SAP periods (YYYYPPP), e.g. 2025001,2025002"),
+    base: Optional[str] = Query(None, description="Period to compare from"),
+    compare: Optional[str] = Query(None, description="Period to compare to"),
+    root: Optional[str] = Query(None),
+    max_depth: Optional[int] = Query(None, ge=0),
+    rollup: bool = Query(True, description="Sum the leaf rows under each node instead of its own amount"),
+):
+    period_list = [p.strip() for p in periods.split(",") if p.strip()]
+    if not period_list or any(not re.fullmatch(r"\d{7}", p) for p in period_list):
+        raise HTTPException(status_code=400, detail="periods must be a comma-separated list of YYYYPPP values.")
+    period_list = list(dict.fromkeys(period_list))
+    for p in (base, compare):
+        if p is not None and p not in period_list:
+            raise HTTPException(status_code=400, detail=f"Period {p} is not in periods.")
+    if (base is None) != (compare is None):
+        raise HTTPException(status_code=400, detail="base and compare must be given together.")
+
+    cube = get_period_cube(params, period_list)
+    if root is not None and root not in cube.index:
+        raise HTTPException(status_code=404, detail=f"Unknown HierarchyNode: {root}")
+    not_modified = conditional(request, response, cube.etag, cube.last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    b = cube.period_pos(base) if base else None
+    c = cube.period_pos(compare) if compare else None
+    rows = []
+    for node_id in cube.rows(root, max_depth):
+        node = cube.index.by_id[node_id]
+        row = {
+            "HierarchyNode": node["HierarchyNode"],
+            "ParentNode": node["ParentNode"],
+            "FinancialStatementItem": node["FinancialStatementItem"],
+            "FinancialStatementItemText": node["FinancialStatementItemText"],
+            "Depth": cube.index.depth[node_id],
+            "Values": [cube.value(node_id, p, rollup) for p in range(len(period_list))],
+        }
+        if b is not None:
+            row.update(cube.compare(node_id, b, c, rollup))
+        rows.append(row)
+
+    return {
+        "periods": period_list,
+        "base": base,
+        "compare": compare,
+        "rows": rows,
+        "diagnostics": cube.diagnostics,
+        "cube": {
+            "nodes": len(cube.index),
+            "periods": len(period_list),
+            "memory_bytes": cube.memory_bytes,
+            "cache_bytes": cube_cache.total_bytes,
+            "cache_limit_bytes": CUBE_CACHE_MAX_BYTES,
+        },
+    }
+
+
+# -------------------- SUMMARIES --------------------
+def summary_prompt(scope: str, stats: Dict[str, Any], nodes: list) -> str:
+    # statistics over the whole selection, plus the first nodes as sent for names and context
+    return (
         "You are an assistant summarizing SAP Financial Statement hierarchies.\n"
-        "User has selected the following scope and nodes from a tree view.\n\n"
-        f"Scope: {body.scope}\n\n"
-        "Nodes JSON:\n"
-        f"{json.dumps(nodes_preview, indent=2)}\n\n"
+        "User has selected the following scope and nodes from a tree view; the statistics "
+        "were computed over all selected nodes (amounts: current vs comparison period).\n\n"
+        f"Scope: {scope}\n\n"
+        "Statistics JSON:\n"
+        f"{json.dumps(stats, separators=(',', ':'), default=str)}\n\n"
+        "Nodes JSON (preview):\n"
+        f"{json.dumps(preview_nodes(nodes), separators=(',', ':'), default=str)}\n\n"
         "Summarize the key financial insights (major items, directions, and any obvious patterns). Use short, clear bullet points."
     )
 
-    if not LLM_ENABLED:
-        local_summary = "LLM not configured. Preview of nodes:\n"
-        local_summary += "\n".join([f"- {n.get('FinancialStatementItem','<item>')} ({n.get('HierarchyNode')})" for n in nodes_preview[:10]])
-        return {"summary": local_summary}
 
-    try:
-        response = llm.invoke([{"role": "user", "content": prompt}])
-        summary_text = getattr(response, "content", None) or (response[0].get("content") if isinstance(response, list) and response else str(response))
-    except Exception as e:
-        logger.exception("LLM call failed")
-        raise HTTPException(status_code=500, detail=f"LLM call failed: {str(e)}")
+def summary_key(scope: str, nodes: list) -> str:
+    return cache_key("summary", scope + json.dumps(nodes, sort_keys=True, default=str))
+
+
+def local_summary(stats: Dict[str, Any]) -> str:
+    return "LLM not configured. Statistics for the selection:\n" + render_pre_summary(stats)
+
+
+def invoke_llm(llm, prompt: str, **kwargs: Any) -> str:
+    llm_response = llm.invoke([{"role": "user", "content": prompt}], **kwargs)
+    return getattr(llm_response, "content", None) or (llm_response[0].get("content") if isinstance(llm_response, list) and llm_response else str(llm_response))
+
 
-    return {"summary": summary_text}
+def _summarize_with_retries(llm, scope: str, stats: Dict[str, Any], nodes: list) -> Tuple[str, int]:
+    """(summary, attempts) for one batch item; raises the last error once retries run out."""
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            # forwarded to the OpenAI client as a per-request timeout, so a hung call
+            # frees its batch slot instead of pinning it
+            return invoke_llm(llm, summary_prompt(scope, stats, nodes), timeout=SUMMARY_ITEM_TIMEOUT), attempt
+        except Exception as e:
+            if attempt > SUMMARY_RETRIES:
+                raise
+            logger.warning("Summary attempt %d for %r failed, retrying: %s", attempt, scope, e)
+            time.sleep(SUMMARY_RETRY_BACKOFF * 2 ** (attempt - 1))
+
+
+@app.get("/financial-statements/consolidated")
+def financial_statements_consolidated(
+    request: Request,
+    response: Response,
+    params: Dict[str, Any] = Depends(statement_params),
+    companies: str = Query(..., description="Comma-separated company codes (P_BUKRS) to consolidate"),
+    root: Optional[str] = Query(None, description="Merged node id (FinancialStatementItem|CorporateGroupAccount)"),
+    max_depth: Optional[int] = Query(None, ge=0),
+    rollup: bool = Query(True, description="Sum the leaf rows under each node instead of its own amount"),
+    contributions: bool = Query(True, description="Include per-company amounts for drill-down"),
+):
+    """
+    One tree across several company codes, merged on FinancialStatementItem /
+    CorporateGroupAccount, with group totals and per-company contributions.
+    Stage timings (seconds) come back in the body and as a Server-Timing header.
+    """
+    company_list = list(dict.fromkeys(c.strip() for c in companies.split(",") if c.strip()))
+    if not company_list:
+        raise HTTPException(status_code=400, detail="companies must list at least one company code.")
+    if len(company_list) > CONSOLIDATION_MAX_COMPANIES:
+        raise HTTPException(status_code=400, detail=f"At most {CONSOLIDATION_MAX_COMPANIES} companies per consolidation.")
+
+    cons, timings = get_consolidation(params, company_list)
+    if root is not None and root not in cons.index:
+        raise HTTPException(status_code=404, detail=f"Unknown consolidated node: {root}")
+    not_modified = conditional(request, response, cons.etag, cons.last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    started = time.perf_counter()
+    records = cons.tree(root, max_depth, rollup, contributions)
+    if not timings["cached"]:
+        timings.update(cons.timings)
+    timings["serialize"] = time.perf_counter() - started
+    response.headers["Server-Timing"] = ", ".join(
+        f"{stage};dur={timings[stage] * 1000:.1f}" for stage in ("fetch", "merge", "rollup", "serialize") if stage in timings
+    )
+    return {
+        "companies": company_list,
+        "records": records,
+        "diagnostics": cons.diagnostics,
+        "timings": timings,
+    }
+
+
+@app.post("/summarize_tree")
+def summarize_tree(
+    body: SummarizeRequest,
+    response: Response,
+    stream: bool = Query(False, description="NDJSON: statistics line first, then the LLM summary"),
+):
+    stats = pre_summary(body.nodes)
+    llm = get_llm()
+    if llm is None:
+        return {"summary": local_summary(stats), "stats": stats}
+
+    key = summary_key(body.scope, body.nodes)
+    summary_text = cache.get(key)
+
+    def llm_summary() -> str:
+        try:
+            text = invoke_llm(llm, summary_prompt(body.scope, stats, body.nodes))
+        except Exception as e:
+            logger.exception("LLM call failed")
+            raise HTTPException(status_code=500, detail=f"LLM call failed: {str(e)}")
+        if SUMMARY_CACHE_TTL > 0:
+            cache.set(key, text, SUMMARY_CACHE_TTL)
+        return text
+
+    if stream:
+        def generate():
+            yield (json.dumps({"stage": "preliminary", "stats": stats}, default=str) + "\n").encode("utf-8")
+            try:
+                text = llm_summary() if summary_text is MISSING else summary_text
+                final = {"stage": "final", "summary": text}
+            except HTTPException as e:
+                final = {"stage": "failed", "error": e.detail}
+            yield (json.dumps(final) + "\n").encode("utf-8")
+
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+    if summary_text is MISSING:
+        summary_text = llm_summary()
+
+    # validator only: POST is unsafe, so If-None-Match is not answered with 304 (RFC 9110)
+    response.headers.update(validators(content_hash(summary_text), None))
+    return {"summary": summary_text, "stats": stats}
+
+
+@app.post("/summarize_tree/batch")
+def summarize_tree_batch(body: SummarizeBatchRequest):
+    """
+    Summaries for many scopes at once, streamed as NDJSON in completion order.
+    Identical items share one LLM call (each line lists the request `indexes`
+    it answers); cached summaries come first, then a "preliminary" statistics
+    line for every item still waiting on the LLM. The last line is a totals record.
+    """
+    groups: Dict[str, List[int]] = {}
+    for i, item in enumerate(body.items):
+        groups.setdefault(summary_key(item.scope, item.nodes), []).append(i)
+
+    def line(obj: Dict[str, Any]) -> bytes:
+        return (json.dumps(obj, default=str) + "\n").encode("utf-8")
+
+    def generate():
+        llm = get_llm()
+        failed = 0
+        pending: Dict[str, SummarizeRequest] = {}
+        stats: Dict[str, Dict[str, Any]] = {}
+        for key, indexes in groups.items():
+            item = body.items[indexes[0]]
+            stats[key] = pre_summary(item.nodes)
+            if llm is None:
+                yield line({"indexes": indexes, "scope": item.scope, "status": "ok", "summary": local_summary(stats[key]), "stats": stats[key], "cached": False})
+                continue
+            hit = cache.get(key)
+            if hit is MISSING:
+                pending[key] = item
+            else:
+                yield line({"indexes": indexes, "scope": item.scope, "status": "ok", "summary": hit, "stats": stats[key], "cached": True})
+        for key, item in pending.items():
+            yield line({"indexes": groups[key], "scope": item.scope, "status": "preliminary", "stats": stats[key]})
+
+        if pending:
+            pool = ThreadPoolExecutor(max_workers=max(1, min(SUMMARY_BATCH_CONCURRENCY, len(pending))))
+            try:
+                started = time.monotonic()
+                futures = {
+                    pool.submit(contextvars.copy_context().run, _summarize_with_retries, llm, item.scope, stats[key], item.nodes): key
+                    for key, item in pending.items()
+                }
+                for future in as_completed(futures):
+                    key = futures[future]
+                    out = {"indexes": groups[key], "scope": pending[key].scope, "cached": False}
+                    try:
+                        summary_text, attempts = future.result()
+                    except Exception as e:
+                        logger.warning("Batch summary for %r failed: %s", pending[key].scope, e)
+                        failed += 1
+                        out.update(status="error", error=str(e) or e.__class__.__name__)
+                    else:
+                        if SUMMARY_CACHE_TTL > 0:
+                            cache.set(key, summary_text, SUMMARY_CACHE_TTL)
+                        out.update(status="ok", summary=summary_text, attempts=attempts)
+                    out["elapsed"] = round(time.monotonic() - started, 3)
+                    yield line(out)
+            finally:
+                # client went away: drop the items that have not started yet
+                pool.shutdown(wait=False, cancel_futures=True)
+
+        yield line({"done": True, "items": len(body.items), "unique": len(groups), "llm_calls": len(pending), "failed": failed})
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+# -------------------- PUSH CHANNEL --------------------
+async def _push_sender(ws: WebSocket, sub) -> None:
+    while True:
+        await ws.send_text(await sub.queue.get())
+
+
+async def _push_command(sub, msg: Dict[str, Any]) -> Dict[str, Any]:
+    op = msg.get("op")
+    if op == "ping":
+        return {"type": "pong"}
+    if op not in ("subscribe", "unsubscribe"):
+        return {"type": "error", "detail": f"Unknown op: {op}"}
+
+    url = None
+    if op == "unsubscribe" and msg.get("topic"):
+        topic = str(msg["topic"])
+    elif msg.get("job"):
+        topic = f"job:{msg['job']}"
+    elif isinstance(msg.get("params"), dict):
+        try:
+            url = odata_url_for(statement_params_from(msg["params"]))
+        except HTTPException as e:
+            return {"type": "error", "detail": e.detail}
+        topic = tree_topic(url)
+    else:
+        return {"type": "error", "detail": "Expected one of topic, job or params"}
+
+    if op == "unsubscribe":
+        push.unsubscribe(sub, topic)
+        return {"type": "unsubscribed", "topic": topic}
+    if topic not in sub.topics and len(sub.topics) >= PUSH_MAX_TOPICS:
+        return {"type": "error", "detail": f"At most {PUSH_MAX_TOPICS} subscriptions per connection"}
+
+    ack: Dict[str, Any] = {"type": "subscribed", "topic": topic}
+    if url is None:
+        job = jobs.get(str(msg["job"]))
+        if job is None:
+            return {"type": "error", "detail": f"Unknown job: {msg['job']}"}
+        push.subscribe(sub, topic)
+        # already finished jobs are reported right away, running ones when they end
+        # (a job finishing right now may push its event before this ack)
+        ack["job"] = await run_in_threadpool(job_event, job)
+        if job.status in ("done", "failed"):
+            push.mark(topic, job.status)
+        return ack
+
+    push.subscribe(sub, topic)
+    entry = await run_in_threadpool(cache.get, tree_key(url))
+    if entry is not MISSING:
+        # deltas are computed against the tree the client can fetch right now
+        await run_in_threadpool(push.seed_tree, topic, entry["payload"], entry["etag"])
+        ack["etag"] = entry["etag"]
+    return ack
+
+
+@app.websocket("/ws")
+async def push_channel(ws: WebSocket):
+    """
+    Push channel. Clients send {"op": "subscribe"|"unsubscribe", ...} with
+    "params" (statement query params), "job" (a job id) or, to unsubscribe,
+    "topic". The server pushes "tree" events when a subscribed statement is
+    rebuilt (changed / added / removed nodes with their amounts, or
+    full_refresh) and "job" events when a job finishes.
+    """
+    await ws.accept()
+    sub = push.connect()
+    sender = asyncio.create_task(_push_sender(ws, sub))
+    try:
+        while True:
+            try:
+                msg = await ws.receive_json()
+            except (ValueError, KeyError):
+                msg = None
+            reply = await _push_command(sub, msg) if isinstance(msg, dict) else {"type": "error", "detail": "Expected a JSON object"}
+            # replies share the event queue so only the sender task writes to the socket
+            await sub.queue.put(json.dumps(reply, default=str))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        push.disconnect(sub)
+        sender.cancel()
@@ -0,0 +1,162 @@
+import math
+import time
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Optional
+
+# set per request by the HTTP middleware; read where the SAP call is made
+current_client: contextvars.ContextVar[str] = contextvars.ContextVar("current_client", default="anonymous")
+
+
+class RequestCharge:
+    """
+    One user request's rate-limit charge, shared by the SAP fetches it fans
+    out to (trend slices, consolidated companies run in copied contexts), so
+    the request costs one token however many fetches it needs.
+    """
+
+    __slots__ = ("_lock", "_charged")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._charged = False
+
+    def first(self) -> bool:
+        """True exactly once: for the fetch that pays the token."""
+        with self._lock:
+            first, self._charged = not self._charged, True
+            return first
+
+
+current_charge: contextvars.ContextVar[Optional[RequestCharge]] = contextvars.ContextVar("current_charge", default=None)
+
+
+class AdmissionRejected(Exception):
+    """Raised instead of queuing an SAP-bound request; mapped to 429/503 + Retry-After."""
+
+    def __init__(self, status_code: int, retry_after: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.detail = detail
+
+
+class TokenBucket:
+    def __init__(self, rate_per_sec: float, burst: float):
+        self.rate = rate_per_sec
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Take one token; returns 0 on success or the seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+
+class AdmissionController:
+    """
+    Gate in front of SAP fetches (cache hits never pass through it):
+      1. per-client token bucket (rate_per_min, burst)  -> 429
+         charged once per user request (current_charge), not per fetch
+      2. bounded wait queue (max_queue waiting)          -> 503
+      3. global SAP concurrency cap, waiting at most max_wait seconds -> 503
+    """
+
+    MAX_CLIENTS = 10000  # bucket table is LRU-bounded
+
+    def __init__(self, max_concurrency: int, max_queue: int, max_wait: float, rate_per_min: float, burst: float):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.rate_per_min = rate_per_min
+        self.burst = burst
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._waiting = 0
+        self._in_flight = 0
+        self._max_waiting = 0
+        self._admitted = 0
+        self._rejected: Dict[str, int] = {"rate_limited": 0, "queue_full": 0, "wait_timeout": 0}
+        self._waits: Deque[float] = deque(maxlen=1000)
+
+    def _take_token(self, client: str) -> float:
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = TokenBucket(self.rate_per_min / 60.0, self.burst)
+                if len(self._buckets) > self.MAX_CLIENTS:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client)
+            return bucket.take()
+
+    def _reject(self, reason: str, status_code: int, retry_after: float, detail: str) -> AdmissionRejected:
+        with self._lock:
+            self._rejected[reason] += 1
+        return AdmissionRejected(status_code, max(1, math.ceil(retry_after)), detail)
+
+    @contextmanager
+    def admit(self, client: Optional[str] = None):
+        client = client or current_client.get()
+        charge = current_charge.get()
+        wait_for = self._take_token(client) if charge is None or charge.first() else 0.0
+        if wait_for > 0:
+            raise self._reject("rate_limited", 429, wait_for, f"Too many SAP requests for client {client}")
+
+        with self._lock:
+            if self._waiting >= self.max_queue:
+                full = True
+            else:
+                full = False
+                self._waiting += 1
+                self._max_waiting = max(self._max_waiting, self._waiting)
+        if full:
+            raise self._reject("queue_full", 503, self.max_wait, "SAP request queue is full")
+
+        started = time.monotonic()
+        acquired = self._slots.acquire(timeout=self.max_wait)
+        waited = time.monotonic() - started
+        with self._lock:
+            self._waiting -= 1
+            self._waits.append(waited)
+            if acquired:
+                self._in_flight += 1
+                self._admitted += 1
+        if not acquired:
+            raise self._reject("wait_timeout", 503, self.max_wait, "Timed out waiting for an SAP slot")
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self._in_flight,
+                "queue_depth": self._waiting,
+                "max_queue_depth_seen": self._max_waiting,
+                "queue_limit": self.max_queue,
+                "admitted": self._admitted,
+                "rejected": dict(self._rejected),
+                "wait_seconds": {
+                    "samples": len(waits),
+                    "p50": waits[len(waits) // 2] if waits else None,
+                    "p95": waits[int(len(waits) * 0.95)] if waits else None,
+                    "max": waits[-1] if waits else None,
+                },
+                "clients_tracked": len(self._buckets),
+            }
@@ -1,15 +1,15 @@
 import os
 import json
-import base64
 from typing import List, Dict, Any
 
-import requests
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 
 from langchain_openai import ChatOpenAI
 
+from sap_client import SapClient
+
 # ===================== CONFIG =====================
 
 # Hard-coded OData URL exactly as required
@@ -51,22 +51,11 @@ SAP_PASSWORD = os.getenv("SAP_PASSWORD")
 if not SAP_USERNAME or not SAP_PASSWORD:
     raise RuntimeError("Missing SAP_USERNAME or SAP_PASSWORD env vars")
 
-# Basic auth header
-_auth_bytes = f"{SAP_USERNAME}:{SAP_PASSWORD}".encode("utf-8")
-_auth_b64 = base64.b64encode(_auth_bytes).decode("utf-8")
-
-# Reusable session
-session = requests.Session()
-session.headers.update(
-    {
-        "Authorization": f"Basic {_auth_b64}",
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-    }
-)
-
 DEFAULT_TIMEOUT = 60
 
+# Shared SAP client: pooled keep-alive session, cached CSRF token, retries
+sap = SapClient(SAP_USERNAME, SAP_PASSWORD, timeout=DEFAULT_TIMEOUT)
+
 # LLM client (internal GenAI gateway)
 llm = ChatOpenAI(
     model="bedrock.anthropic.claude-opus-4",
@@ -91,14 +80,10 @@ app.add_middleware(
 
 def fetch_financial_statements() -> List[Dict[str, Any]]:
     """
-    Do a GET to SAP OData with X-CSRF-Token: Fetch.
+    Do a GET to SAP OData (CSRF token fetched once and reused by SapClient).
     Returns flat list of SAP records (d.results).
     """
-    headers = {
-        "X-CSRF-Token": "Fetch",
-    }
-
-    resp = session.get(SAP_ODATA_URL, headers=headers, timeout=DEFAULT_TIMEOUT)
+    resp = sap.get(SAP_ODATA_URL)
 
     if resp.status_code != 200:
         raise HTTPException(
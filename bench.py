@@ -0,0 +1,323 @@
+"""
+Backend benchmarks (run from the repo root; SAP is never contacted).
+
+    python bench.py            # run all
+    python bench.py import     # run one
+"""
+import os
+import gc
+import sys
+import json
+import asyncio
+import time
+import random
+import argparse
+import threading
+import subprocess
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List
+
+BENCHES: Dict[str, Callable[[argparse.Namespace], None]] = {}
+
+# dummy config so Backend3 imports without a real SAP / LLM gateway
+BENCH_ENV = {
+    "SAP_USERNAME": "bench",
+    "SAP_PASSWORD": "bench",
+    "SAP_BASE_URL": "http://sap.invalid",
+}
+
+
+def bench(name: str):
+    def register(fn):
+        BENCHES[name] = fn
+        return fn
+    return register
+
+
+def _env(**extra: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update(BENCH_ENV)
+    env.update(extra)
+    return env
+
+
+def synthetic_records(n: int, fanout: int = 8, seed: int = 0) -> List[Dict[str, Any]]:
+    """Flat SAP-shaped rows forming a tree with ~fanout children per node."""
+    rnd = random.Random(seed)
+    out = []
+    for i in range(n):
+        rep = round(rnd.uniform(-1e6, 1e6), 2)
+        comp = round(rnd.uniform(-1e6, 1e6), 2)
+        out.append({
+            "FinancialStatementVariant": "2000_DRAFT",
+            "FinancialStatementItem": f"FS{i % 500:04d}",
+            "FinancialStatementItemText": f"Item {i}",
+            "Currency": "EUR",
+            "Ledger": "0L",
+            "HierarchyNode": f"{i:08d}",
+            "ParentNode": "" if i == 0 else f"{(i - 1) // fanout:08d}",
+            "NodeType": "L" if i * fanout + 1 >= n else "N",
+            "ReportingPeriodAmount": f"{rep:.2f}",
+            "ComparisonPeriodAmount": f"{comp:.2f}",
+            "AbsoluteDifferenceAmount": f"{rep - comp:.2f}",
+            "CorporateGroupAccount": f"CG{i % 97}",
+        })
+    return out
+
+
+def _setup_backend(**env: str):
+    """
+    Backend3 configured with `env`. Settings are module globals read at import,
+    so when an earlier bench already imported it they are set on the module too.
+    """
+    os.environ.update(BENCH_ENV)
+    os.environ.update(env)
+    os.environ.setdefault("LLM_WARMUP", "False")
+    import Backend3
+
+    for name, value in env.items():
+        current = getattr(Backend3, name, None)
+        if isinstance(current, bool):
+            setattr(Backend3, name, value.lower() in ("1", "true", "yes"))
+        elif isinstance(current, (int, float)):
+            setattr(Backend3, name, type(current)(value))
+        else:
+            setattr(Backend3, name, value)
+    return Backend3
+
+
+def fake_sap_server(records: List[Dict[str, Any]]) -> ThreadingHTTPServer:
+    """Local HTTP server answering every GET with the same OData payload."""
+    body = json.dumps({"d": {"results": records}}).encode("utf-8")
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _percentiles(samples: List[float]) -> str:
+    s = sorted(samples)
+    if not s:
+        return "no samples"
+    return (
+        f"p50 {s[len(s) // 2] * 1000:7.1f} ms  p95 {s[int(len(s) * 0.95)] * 1000:7.1f} ms  "
+        f"max {s[-1] * 1000:7.1f} ms  (n={len(s)})"
+    )
+
+
+# -------------------- import time --------------------
+@bench("import")
+def bench_import(args: argparse.Namespace) -> None:
+    """Cold-import profile of Backend3 (python -X importtime), best of N runs."""
+    code = "import time; t = time.perf_counter(); import Backend3; print(time.perf_counter() - t)"
+    walls: List[float] = []
+    stderr = ""
+    for _ in range(args.repeat):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            capture_output=True, text=True, env=_env(LLM_WARMUP="False"), check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        walls.append(float(proc.stdout.strip().splitlines()[-1]))
+        stderr = proc.stderr
+
+    # "import time: self [us] | cumulative | imported package"; nesting is 2 spaces
+    # per level, so Backend3's direct imports are the entries indented one level
+    top = []
+    loaded = set()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, raw = line[len("import time:"):].split("|")
+        loaded.add(raw.strip())
+        if len(raw) - len(raw.lstrip()) == 3:
+            top.append((int(cumulative), raw.strip()))
+    top.sort(reverse=True)
+
+    print(f"import Backend3: best {min(walls) * 1000:.1f} ms, worst {max(walls) * 1000:.1f} ms ({args.repeat} runs)")
+    print("slowest direct imports of Backend3 (cumulative, last run):")
+    for us, name in top[:args.top]:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+    heavy = sorted(n for n in loaded if n in ("langchain_openai", "langchain_core", "openai", "requests"))
+    print("eagerly imported heavy deps:", ", ".join(heavy) or "none")
+
+
+# -------------------- export throughput --------------------
+@bench("export")
+def bench_export(args: argparse.Namespace) -> None:
+    """Throughput and traced peak memory of each export writer over a cached tree."""
+    B = _setup_backend()
+    import export
+    from tree_index import TreeIndex
+
+    index = TreeIndex(B.build_tree_with_children(synthetic_records(args.rows)))
+    for fmt in sorted(export.WRITERS):
+        if fmt not in export.available_formats():
+            print(f"  {fmt:8s} skipped (dependency not installed)")
+            continue
+        t = time.perf_counter()
+        size = sum(len(chunk) for chunk in export.WRITERS[fmt](index, B.SELECT_FIELDS))
+        elapsed = time.perf_counter() - t
+        line = (
+            f"  {fmt:8s} {args.rows / elapsed:10,.0f} rows/s  {size / elapsed / 1e6:7.1f} MB/s  "
+            f"{size / 1e6:7.1f} MB out"
+        )
+        if args.trace_memory:
+            # separate pass: tracemalloc slows allocation-heavy writers several-fold
+            tracemalloc.start()
+            for _ in export.WRITERS[fmt](index, B.SELECT_FIELDS):
+                pass
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            line += f"  peak +{peak / 1e6:.1f} MB"
+        print(line)
+
+
+# -------------------- small-request latency during a large build --------------------
+@bench("gil")
+def bench_gil(args: argparse.Namespace) -> None:
+    """/healthz latency while a large tree is fetched + built, inline vs CPU process pool."""
+    server = fake_sap_server(synthetic_records(args.rows))
+    # no skeleton cache: both runs fetch and link the full rows
+    B = _setup_backend(
+        SAP_BASE_URL=f"http://127.0.0.1:{server.server_address[1]}", CPU_POOL_WORKERS="0", SKELETON_CACHE_TTL="0"
+    )
+    from cpu_pool import CpuPool
+    from fastapi.testclient import TestClient
+
+    client = TestClient(B.app)
+    try:
+        for workers in (0, 2):
+            B.cpu = CpuPool(workers, B.CPU_POOL_SHM_MIN_BYTES, B.CPU_POOL_START_METHOD)
+            if workers:
+                B.cpu.run(len, b"warm-up")  # exclude process start-up from the measurement
+            url = B.build_odata_url(P_BUKRS=f"GIL{workers}")  # distinct key: always a cache miss
+            failed: List[BaseException] = []
+
+            def load() -> None:
+                try:
+                    B.get_tree_entry(url)
+                except BaseException as e:  # reported below instead of timing a failed build
+                    failed.append(e)
+
+            build = threading.Thread(target=load)
+            latencies: List[float] = []
+            t = time.perf_counter()
+            build.start()
+            while build.is_alive():
+                started = time.perf_counter()
+                client.get("/healthz")
+                latencies.append(time.perf_counter() - started)
+                time.sleep(0.005)
+            elapsed = time.perf_counter() - t
+            B.cpu.shutdown()
+            if failed:
+                raise RuntimeError(f"tree build against the fake SAP server failed: {failed[0]!r}")
+            mode = "inline" if not workers else f"pool({workers})"
+            print(f"  {mode:8s} build {elapsed:6.2f}s  /healthz {_percentiles(latencies)}")
+    finally:
+        server.shutdown()
+
+
+# -------------------- idle WebSocket subscribers --------------------
+async def _ws_connect(app, topic_params: Dict[str, Any], port: int):
+    """Drive one /ws connection straight through ASGI (no server or client library needed)."""
+    inbox: asyncio.Queue = asyncio.Queue()
+    outbox: asyncio.Queue = asyncio.Queue()
+    scope = {
+        "type": "websocket", "asgi": {"version": "3.0"}, "path": "/ws", "raw_path": b"/ws", "root_path": "",
+        "scheme": "ws", "query_string": b"", "headers": [], "subprotocols": [],
+        "server": ("bench", 80), "client": ("127.0.0.1", port),
+    }
+    await inbox.put({"type": "websocket.connect"})
+    task = asyncio.create_task(app(scope, inbox.get, outbox.put))
+    assert (await outbox.get())["type"] == "websocket.accept"
+    await inbox.put({"type": "websocket.receive", "text": json.dumps({"op": "subscribe", "params": topic_params})})
+    ack = json.loads((await outbox.get())["text"])
+    return inbox, outbox, task, ack
+
+
+async def _push_load(B, subscribers: int, rows: int) -> None:
+    url = B.odata_url_for(B.statement_params_from({"P_BUKRS": "PUSH"}))
+    records = synthetic_records(rows)
+    roots, diagnostics = B.build_tree(records)
+    B.cache.set(B.tree_key(url), B.make_tree_entry(json.dumps({"records": roots}).encode("utf-8"), diagnostics), 3600)
+
+    conns = [await _ws_connect(B.app, {"P_BUKRS": "PUSH"}, 9999)]  # seeds the shared amount snapshot
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    t = time.perf_counter()
+    conns += [await _ws_connect(B.app, {"P_BUKRS": "PUSH"}, 10000 + i) for i in range(subscribers - 1)]
+    connect_time = time.perf_counter() - t
+    gc.collect()
+    diff = tracemalloc.take_snapshot().compare_to(before, "filename")
+    tracemalloc.stop()
+    held = sum(st.size_diff for st in diff)
+    hub = sum(st.size_diff for st in diff if st.traceback[0].filename.endswith("push.py"))
+    n = max(1, subscribers - 1)
+    print(f"  {subscribers} idle subscribers connected in {connect_time:.2f}s")
+    print(f"  {held / n / 1024:.1f} KiB per connection (framework + in-memory transport), "
+          f"of which push hub {hub / n:.0f} B")
+
+    # one refresh changing 1% of the amounts, pushed to every subscriber
+    for rec in records[::100]:
+        rec["ReportingPeriodAmount"] = f"{float(rec['ReportingPeriodAmount']) + 1:.2f}"
+    roots, diagnostics = B.build_tree(records)
+    entry = B.make_tree_entry(json.dumps({"records": roots}).encode("utf-8"), diagnostics)
+    t = time.perf_counter()
+    await asyncio.to_thread(B.push.publish_tree, conns[0][3]["topic"], entry)
+    sizes = [len((await outbox.get())["text"]) for _, outbox, _, _ in conns]
+    print(f"  delta of {len(records[::100])} nodes ({sizes[0] / 1024:.1f} KiB) fanned out to all in "
+          f"{(time.perf_counter() - t) * 1000:.0f} ms")
+    print(f"  hub: {B.push.metrics()}")
+
+    for inbox, _, task, _ in conns:
+        await inbox.put({"type": "websocket.disconnect", "code": 1000})
+    await asyncio.gather(*(task for _, _, task, _ in conns), return_exceptions=True)
+
+
+@bench("push")
+def bench_push(args: argparse.Namespace) -> None:
+    """Memory per idle /ws subscriber and fan-out time of one tree delta."""
+    B = _setup_backend(CPU_POOL_WORKERS="0")
+    asyncio.run(_push_load(B, args.subscribers, min(args.rows, 20000)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("bench", nargs="*", help=f"benchmarks to run (default: all of {', '.join(sorted(BENCHES))})")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--rows", type=int, default=50000, help="synthetic tree size")
+    parser.add_argument("--trace-memory", action="store_true", help="also report tracemalloc peaks")
+    parser.add_argument("--subscribers", type=int, default=2000, help="idle WebSocket connections (push)")
+    args = parser.parse_args()
+    unknown = [b for b in args.bench if b not in BENCHES]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    for name in args.bench or sorted(BENCHES):
+        print(f"==== {name} ====")
+        t = time.perf_counter()
+        BENCHES[name](args)
+        print(f"({time.perf_counter() - t:.1f}s)\n")
+
+
+if __name__ == "__main__":
+    main()
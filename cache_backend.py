@@ -0,0 +1,435 @@
+import os
+import time
+import pickle
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import memdiag
+
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:  # Windows
+    import msvcrt
+
+logger = logging.getLogger("sap-finstat-api")
+
+MISSING = object()
+
+
+class CacheLockTimeout(TimeoutError):
+    """Another worker held a key's load lock for longer than the timeout."""
+
+
+def cache_key(namespace: str, raw: str) -> str:
+    """Stable, filesystem/redis-safe key for an arbitrary string (e.g. an OData URL)."""
+    return f"{namespace}:{hashlib.sha1(raw.encode('utf-8')).hexdigest()}"
+
+
+class CacheBackend:
+    """
+    Minimal cache interface shared by all workers' tree and summary caches.
+
+    get() returns MISSING on a miss or expiry. lock() is a per-key mutex that
+    must hold across processes for the cross-process backends, so that
+    get_or_load() lets exactly one worker refresh an expired key while the
+    others wait and then read the fresh value.
+    """
+
+    def get(self, key: str) -> Any:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any, ttl: int) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def lock(self, key: str, timeout: float = 120.0):
+        """Context manager holding the per-key lock."""
+        raise NotImplementedError
+
+    def sizes(self, limit: int = 1000) -> Dict[str, int]:
+        """Stored (pickled) size in bytes of up to `limit` live keys, for memory diagnostics."""
+        raise NotImplementedError
+
+    def get_or_load(self, key: str, ttl: int, loader: Callable[[], Any]) -> Any:
+        value = self.get(key)
+        if value is not MISSING:
+            return value
+        with self.lock(key):
+            # another worker may have refreshed the key while we waited
+            value = self.get(key)
+            if value is not MISSING:
+                return value
+            value = loader()
+            if ttl > 0:
+                self.set(key, value, ttl)
+            return value
+
+
+# -------------------- in-process --------------------
+class InProcessCache(CacheBackend):
+    """
+    Dict store with TTLs, bounded to max_entries and, if set, to max_bytes of
+    values (memdiag.deep_size, measured once on set): least recently used
+    first, after anything expired. The newest entry is always kept. Expired
+    entries are also swept every SWEEP_INTERVAL seconds, so keys that are
+    never read again do not pile up.
+    """
+
+    SWEEP_INTERVAL = 60.0
+
+    def __init__(self, max_entries: int = 1024, max_bytes: Optional[int] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[str, Tuple[float, Any, int]]" = OrderedDict()  # key -> (expires_at, value, size)
+        self._bytes = 0
+        self._guard = threading.Lock()
+        self._locks: Dict[str, List[Any]] = {}  # key -> [lock, holders + waiters]
+        self._swept = time.monotonic()
+
+    @property
+    def total_bytes(self) -> int:
+        return self._bytes
+
+    def get(self, key: str) -> Any:
+        with self._guard:
+            hit = self._data.get(key)
+            if hit is None:
+                return MISSING
+            if hit[0] < time.time():
+                self._drop(key)
+                return MISSING
+            self._data.move_to_end(key)
+            return hit[1]
+
+    def set(self, key: str, value: Any, ttl: int) -> None:
+        size = memdiag.deep_size(value) if self.max_bytes is not None else 0
+        with self._guard:
+            self._drop(key)
+            self._data[key] = (time.time() + ttl, value, size)
+            self._bytes += size
+            if self._over() or time.monotonic() - self._swept > self.SWEEP_INTERVAL:
+                self._sweep()
+            while self._over() and len(self._data) > 1:
+                self._bytes -= self._data.popitem(last=False)[1][2]
+
+    def _over(self) -> bool:
+        return len(self._data) > self.max_entries or (self.max_bytes is not None and self._bytes > self.max_bytes)
+
+    def _drop(self, key: str) -> None:
+        hit = self._data.pop(key, None)
+        if hit is not None:
+            self._bytes -= hit[2]
+
+    def _sweep(self) -> None:
+        now = time.time()
+        for k in [k for k, (expires_at, _, _) in self._data.items() if expires_at < now]:
+            self._drop(k)
+        self._swept = time.monotonic()
+
+    def delete(self, key: str) -> None:
+        with self._guard:
+            self._drop(key)
+
+    def items(self) -> List[Tuple[str, Any]]:
+        """Live (key, value) pairs, least recently used first."""
+        now = time.time()
+        with self._guard:
+            return [(k, v) for k, (expires_at, v, _) in self._data.items() if expires_at >= now]
+
+    def sizes(self, limit: int = 1000) -> Dict[str, int]:
+        return {k: len(pickle.dumps(v, protocol=pickle.HIGHEST_PROTOCOL)) for k, v in self.items()[:limit]}
+
+    @contextmanager
+    def lock(self, key: str, timeout: float = 120.0):
+        with self._guard:
+            slot = self._locks.setdefault(key, [threading.Lock(), 0])
+            slot[1] += 1
+        try:
+            if not slot[0].acquire(timeout=timeout):
+                raise CacheLockTimeout(f"Timed out waiting for cache lock {key}")
+            try:
+                yield
+            finally:
+                slot[0].release()
+        finally:
+            # drop the lock once nobody holds or waits for it
+            with self._guard:
+                slot[1] -= 1
+                if not slot[1]:
+                    del self._locks[key]
+
+
+# -------------------- on-disk (cross-process, no external services) --------------------
+def _try_lock(fd: int) -> bool:
+    try:
+        if msvcrt is not None:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(fd: int) -> None:
+    if msvcrt is not None:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+class FileCache(CacheBackend):
+    """
+    Pickle-per-key store in a local directory shared by all workers on the host.
+    Writes are atomic (tmp file + os.replace). Locks are OS advisory locks on a
+    per-key lock file (flock / msvcrt), which the OS releases if the holder
+    dies, so a long load is never mistaken for a stale lock. Each file's mtime
+    is its expiry time; every SWEEP_INTERVAL seconds a worker deletes expired
+    entries, unused lock files and abandoned temp files.
+    """
+
+    POLL_INTERVAL = 0.05
+    SWEEP_INTERVAL = 300.0
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._swept = time.monotonic()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key.replace(":", "_") + ".pkl")
+
+    def get(self, key: str) -> Any:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                expires_at, value = pickle.load(f)
+                ino = os.fstat(f.fileno()).st_ino
+        except FileNotFoundError:
+            return MISSING
+        except Exception as e:
+            logger.warning("Discarding unreadable cache entry %s: %s", key, e)
+            self.delete(key)
+            return MISSING
+        if expires_at < time.time():
+            self._unlink_if(path, ino)
+            return MISSING
+        return value
+
+    @staticmethod
+    def _unlink_if(path: str, ino: int) -> None:
+        """Delete an expired file unless a writer has replaced it meanwhile."""
+        try:
+            if os.stat(path).st_ino == ino:
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def set(self, key: str, value: Any, ttl: int) -> None:
+        expires_at = time.time() + ttl
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump((expires_at, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.utime(tmp, (expires_at, expires_at))
+            os.replace(tmp, self._path(key))
+        except Exception:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        if time.monotonic() - self._swept > self.SWEEP_INTERVAL:
+            self._swept = time.monotonic()
+            self.sweep()
+
+    def sweep(self) -> int:
+        """Delete expired entries, unheld lock files of missing keys and old temp files."""
+        now = time.time()
+        removed = 0
+        with os.scandir(self.directory) as it:
+            entries = list(it)
+        names = {e.name for e in entries}
+        for e in entries:
+            try:
+                if e.name.endswith(".pkl"):
+                    st = e.stat()
+                    if st.st_mtime < now:
+                        self._unlink_if(e.path, st.st_ino)
+                        removed += 1
+                elif e.name.endswith(".tmp") and e.stat().st_mtime < now - 3600:
+                    os.unlink(e.path)
+                    removed += 1
+                elif e.name.endswith(".pkl.lock") and e.name[:-5] not in names:
+                    removed += self._unlink_lock(e.path)
+            except FileNotFoundError:
+                pass
+        return removed
+
+    @staticmethod
+    def _unlink_lock(path: str) -> int:
+        # only unlink a lock file nobody holds; lock() re-checks it is still linked
+        fd = os.open(path, os.O_RDWR)
+        try:
+            if not _try_lock(fd):
+                return 0
+            try:
+                os.unlink(path)
+                return 1
+            finally:
+                _unlock(fd)
+        finally:
+            os.close(fd)
+
+    def delete(self, key: str) -> None:
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def sizes(self, limit: int = 1000) -> Dict[str, int]:
+        out: Dict[str, int] = {}
+        now = time.time()
+        with os.scandir(self.directory) as it:
+            for e in it:
+                if len(out) >= limit:
+                    break
+                if e.name.endswith(".pkl"):
+                    try:
+                        st = e.stat()
+                    except FileNotFoundError:
+                        continue
+                    if st.st_mtime >= now:
+                        out[e.name[:-4].replace("_", ":", 1)] = st.st_size
+        return out
+
+    @contextmanager
+    def lock(self, key: str, timeout: float = 120.0):
+        path = self._path(key) + ".lock"
+        deadline = time.monotonic() + timeout
+        while True:
+            fd = os.open(path, os.O_CREAT | os.O_RDWR)
+            try:
+                while not _try_lock(fd):
+                    if time.monotonic() > deadline:
+                        raise CacheLockTimeout(f"Timed out waiting for cache lock {key}")
+                    time.sleep(self.POLL_INTERVAL)
+            except BaseException:
+                os.close(fd)
+                raise
+            # the sweep may have unlinked this lock file while we waited on it
+            try:
+                linked = os.stat(path).st_ino == os.fstat(fd).st_ino
+            except FileNotFoundError:
+                linked = False
+            if linked:
+                break
+            _unlock(fd)
+            os.close(fd)
+        try:
+            yield
+        finally:
+            _unlock(fd)
+            os.close(fd)
+
+
+# -------------------- Redis-compatible (optional) --------------------
+class RedisCache(CacheBackend):
+    """
+    Shared Redis store. A held lock is a LOCK_TTL lease that a watchdog thread
+    renews every LOCK_TTL / 3 seconds, so a load that outlasts the SAP timeout
+    plus retries keeps its lock, while a worker that dies releases it within
+    LOCK_TTL.
+    """
+
+    LOCK_TTL = 30.0
+
+    def __init__(self, url: str, prefix: str = "finstat:"):
+        try:
+            import redis
+            from redis.exceptions import LockError, LockNotOwnedError
+        except ImportError as e:
+            raise RuntimeError("CACHE_BACKEND=redis requires the 'redis' package") from e
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._lock_error = LockError
+        self._lock_not_owned = LockNotOwnedError
+
+    def get(self, key: str) -> Any:
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return MISSING
+        return pickle.loads(raw)
+
+    def set(self, key: str, value: Any, ttl: int) -> None:
+        self.client.set(self.prefix + key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), ex=ttl)
+
+    def delete(self, key: str) -> None:
+        self.client.delete(self.prefix + key)
+
+    def sizes(self, limit: int = 1000) -> Dict[str, int]:
+        out: Dict[str, int] = {}
+        for raw in self.client.scan_iter(match=self.prefix + "*", count=500):
+            key = raw.decode("utf-8")[len(self.prefix):]
+            if key.endswith(":lock"):
+                continue
+            out[key] = self.client.strlen(raw)
+            if len(out) >= limit:
+                break
+        return out
+
+    @contextmanager
+    def lock(self, key: str, timeout: float = 120.0):
+        lk = self.client.lock(self.prefix + key + ":lock", timeout=self.LOCK_TTL, blocking_timeout=timeout)
+        if not lk.acquire():
+            raise CacheLockTimeout(f"Timed out waiting for cache lock {key}")
+        done = threading.Event()
+        watchdog = threading.Thread(target=self._renew, args=(lk, key, done), name="cache-lock-renew", daemon=True)
+        watchdog.start()
+        try:
+            yield
+        finally:
+            done.set()
+            watchdog.join()
+            try:
+                lk.release()
+            except self._lock_not_owned:
+                logger.warning("Cache lock %s expired before release; another worker may have loaded it too", key)
+
+    def _renew(self, lk: Any, key: str, done: threading.Event) -> None:
+        while not done.wait(self.LOCK_TTL / 3):
+            try:
+                lk.reacquire()  # reset the lease to LOCK_TTL
+            except self._lock_error as e:
+                logger.warning("Lost cache lock %s while loading: %s", key, e)
+                return
+            except Exception as e:  # redis unreachable: retry on the next tick
+                logger.warning("Could not renew cache lock %s: %s", key, e)
+
+
+def make_cache_backend(kind: Optional[str] = None) -> CacheBackend:
+    """
+    CACHE_BACKEND=memory (default) | file | redis
+      memory: CACHE_MAX_BYTES (default 256 MiB), CACHE_MAX_ENTRIES (default 1024)
+      file:  CACHE_DIR (default <tmp>/finstat-cache)
+      redis: CACHE_REDIS_URL (default redis://localhost:6379/0)
+    """
+    kind = (kind or os.getenv("CACHE_BACKEND", "memory")).lower()
+    if kind == "memory":
+        return InProcessCache(
+            int(os.getenv("CACHE_MAX_ENTRIES", "1024")),
+            int(os.getenv("CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+        )
+    if kind == "file":
+        return FileCache(os.getenv("CACHE_DIR", os.path.join(tempfile.gettempdir(), "finstat-cache")))
+    if kind == "redis":
+        return RedisCache(os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0"))
+    raise RuntimeError(f"Unknown CACHE_BACKEND: {kind}")
@@ -0,0 +1,156 @@
+import time
+import hashlib
+from array import array
+from typing import Any, Dict, List, Optional
+
+from period_cube import parse_amount
+from tree_builder import build_tree
+from tree_index import TreeIndex, leaf_prefix
+
+# amounts that are consolidated (summed across companies)
+AMOUNT_FIELDS = ["ReportingPeriodAmount", "ComparisonPeriodAmount"]
+
+# structure copied from the first company that has a merged node
+SKELETON_FIELDS = [
+    "NodeType",
+    "FinancialStatementItem",
+    "FinancialStatementItemText",
+    "CorporateGroupAccount",
+    "CorporateGroupAccountName",
+    "OperativeGLAccount",
+    "OperativeGLAccountName",
+]
+
+
+def merge_key(rec: Dict[str, Any]) -> str:
+    """
+    Consolidation identity of a statement row: its FS item and group account,
+    plus the operative G/L account for account rows (which share their parent
+    item's FinancialStatementItem). Rows with none of these (pure text /
+    grouping nodes) fall back to their HierarchyNode.
+    """
+    item = rec.get("FinancialStatementItem") or ""
+    account = rec.get("CorporateGroupAccount") or ""
+    gl = rec.get("OperativeGLAccount") or ""
+    if not item and not account and not gl:
+        return f"node:{rec.get('HierarchyNode')}"
+    if gl:
+        return f"{item}|{account}|{gl}"
+    return f"{item}|{account}"
+
+
+class Consolidation:
+    """
+    Node x company matrices of AMOUNT_FIELDS over the merged hierarchy of
+    several company statements.
+
+    Company rows are merged on merge_key(); the merged tree is linked with
+    tree_builder.build_tree (first company to mention a node decides its
+    parent, so key collisions cannot create cycles). Rows are laid out in
+    pre-order, so each field gets one column per company plus a group total,
+    each with leaf prefix sums (tree_index.leaf_prefix): own amounts and
+    subtree rollups for the group or any single company are O(1) lookups.
+    """
+
+    ITEMSIZE = array("d").itemsize
+
+    def __init__(self, companies: List[str], slices: List[TreeIndex]):
+        self.companies = list(companies)
+        self.built_at = time.time()
+        self.etag = hashlib.sha1(
+            "|".join(f"{c}={s.etag}" for c, s in zip(companies, slices)).encode("utf-8")
+        ).hexdigest()
+        self.last_modified = max((s.built_at or self.built_at for s in slices), default=self.built_at)
+        self.timings: Dict[str, float] = {}
+
+        started = time.perf_counter()
+        nodes: Dict[str, Dict[str, Any]] = {}
+        for sl in slices:
+            for node_id in sl.order:
+                rec = sl.by_id[node_id]
+                key = merge_key(rec)
+                if key in nodes:
+                    continue
+                parent = sl.parent.get(node_id)
+                nodes[key] = {
+                    "HierarchyNode": key,
+                    "ParentNode": merge_key(sl.by_id[parent]) if parent is not None else None,
+                    **{f: rec.get(f) for f in SKELETON_FIELDS},
+                }
+        roots, self.diagnostics = build_tree(list(nodes.values()))
+        self.index = TreeIndex(roots)
+        self.timings["merge"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        n = len(self.index)
+        tin = self.index.tin
+        leaf = self.index.leaf_mask()
+        zeros = bytes(n * self.ITEMSIZE)
+        # values[field][c] / prefix[field][c]; column len(companies) is the group total
+        self.values: Dict[str, List[array]] = {}
+        self.prefix: Dict[str, List[array]] = {}
+        for field in AMOUNT_FIELDS:
+            total = array("d", zeros)
+            cols = []
+            for sl in slices:
+                col = array("d", zeros)
+                for rec in sl.by_id.values():
+                    pos = tin.get(merge_key(rec))
+                    if pos is not None:  # left out of the merged tree only if unreachable
+                        amount = parse_amount(rec.get(field))
+                        col[pos] += amount
+                        total[pos] += amount
+                cols.append(col)
+            cols.append(total)
+            self.values[field] = cols
+            self.prefix[field] = [leaf_prefix(col, leaf) for col in cols]
+        self.timings["rollup"] = time.perf_counter() - started
+
+    @staticmethod
+    def estimate_bytes(nodes: int, companies: int) -> int:
+        return (2 * nodes + 1) * (companies + 1) * len(AMOUNT_FIELDS) * Consolidation.ITEMSIZE
+
+    @property
+    def memory_bytes(self) -> int:
+        return sum(a.buffer_info()[1] * a.itemsize for f in AMOUNT_FIELDS for a in self.values[f] + self.prefix[f])
+
+    def value(self, field: str, node_id: str, company: Optional[int] = None, rollup: bool = True) -> float:
+        """Group total (company=None) or one company's amount, own or summed over the subtree."""
+        c = len(self.companies) if company is None else company
+        lo = self.index.tin[node_id]
+        if not rollup:
+            return self.values[field][c][lo]
+        hi = self.index.tout[node_id]
+        return self.prefix[field][c][hi + 1] - self.prefix[field][c][lo]
+
+    def tree(
+        self, root: Optional[str] = None, max_depth: Optional[int] = None, rollup: bool = True, contributions: bool = True
+    ) -> List[Dict[str, Any]]:
+        """Consolidated records with Children[], optionally per-company Contributions."""
+        if root is None:
+            lo, hi, base = 0, len(self.index) - 1, 0
+        else:
+            lo, hi, base = self.index.tin[root], self.index.tout[root], self.index.depth[root]
+        out: List[Dict[str, Any]] = []
+        built: Dict[str, Dict[str, Any]] = {}
+        for node_id in self.index.order[lo:hi + 1]:
+            depth = self.index.depth[node_id] - base
+            if max_depth is not None and depth > max_depth:
+                continue
+            rec = {k: v for k, v in self.index.by_id[node_id].items() if k != "Children"}
+            for field in AMOUNT_FIELDS:
+                rec[field] = self.value(field, node_id, rollup=rollup)
+            if contributions:
+                rec["Contributions"] = {
+                    company: {field: self.value(field, node_id, c, rollup) for field in AMOUNT_FIELDS}
+                    for c, company in enumerate(self.companies)
+                }
+            rec["Children"] = []
+            built[node_id] = rec
+            parent = self.index.parent.get(node_id)
+            if node_id == root or parent not in built:
+                out.append(rec)
+            else:
+                built[parent]["Children"].append(rec)
+        return out
+
@@ -0,0 +1,110 @@
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Callable, Optional, Tuple
+
+logger = logging.getLogger("sap-finstat-api")
+
+
+class StageError(Exception):
+    """Picklable stand-in for errors raised in a pool worker (HTTPException is not)."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def _share(value: Any, min_shm_bytes: int) -> Tuple[str, Any]:
+    if isinstance(value, (bytes, bytearray)) and len(value) >= min_shm_bytes:
+        shm = shared_memory.SharedMemory(create=True, size=len(value))
+        try:
+            shm.buf[:len(value)] = value
+            return "shm", (shm.name, len(value))
+        finally:
+            # the parent attaches by name and unlinks after copying out
+            shm.close()
+    return "value", value
+
+
+def _run_and_share(fn: Callable[..., Any], min_shm_bytes: int, args: Tuple[Any, ...]) -> Tuple[str, Any]:
+    """
+    Worker-side wrapper. Stages take and return bytes (raw SAP bodies,
+    pre-serialized JSON) rather than dict graphs, optionally as a tuple with
+    small metadata; large ones go through shared memory instead of the pipe.
+    """
+    result = fn(*(_read(kind, value) for kind, value in args))
+    if isinstance(result, tuple):
+        return "tuple", tuple(_share(v, min_shm_bytes) for v in result)
+    return _share(result, min_shm_bytes)
+
+
+def _read(kind: str, payload: Any) -> Any:
+    """Copy a ("shm", ...) value out of shared memory; the creator unlinks it."""
+    if kind != "shm":
+        return payload
+    name, size = payload
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return bytes(shm.buf[:size])
+    finally:
+        shm.close()
+
+
+def _unwrap(kind: str, payload: Any) -> Any:
+    if kind == "tuple":
+        return tuple(_unwrap(k, p) for k, p in payload)
+    value = _read(kind, payload)
+    if kind == "shm":
+        _unlink(payload[0])
+    return value
+
+
+def _unlink(name: str) -> None:
+    shm = shared_memory.SharedMemory(name=name)
+    shm.close()
+    shm.unlink()
+
+
+class CpuPool:
+    """
+    Process pool for CPU-bound stages (SAP JSON parsing, tree building,
+    hashing, serialization) so they do not hold the serving process's GIL.
+    Network I/O stays in the serving threads: stages get the fetched bytes.
+    workers=0 runs stages inline in the calling thread.
+    """
+
+    def __init__(self, workers: int, min_shm_bytes: int = 1024 * 1024, start_method: str = "spawn"):
+        self.workers = workers
+        self.min_shm_bytes = min_shm_bytes
+        self.start_method = start_method
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                ctx = multiprocessing.get_context(self.start_method)
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx)
+            return self._pool
+
+    def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run a top-level (picklable) stage function and return its result."""
+        if self.workers <= 0:
+            return fn(*args)
+        shared = [_share(a, self.min_shm_bytes) for a in args]
+        try:
+            kind, payload = self._get_pool().submit(_run_and_share, fn, self.min_shm_bytes, tuple(shared)).result()
+        finally:
+            for k, a in shared:
+                if k == "shm":
+                    _unlink(a[0])
+        return _unwrap(kind, payload)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
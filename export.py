@@ -0,0 +1,179 @@
+import io
+import os
+import csv
+import tempfile
+from array import array
+from operator import sub
+from typing import Any, Dict, Iterator, List, Optional
+
+from period_cube import parse_amount
+from tree_index import TreeIndex, leaf_prefix
+
+# amount fields that also get a subtree rollup column (<field>Rollup), summed
+# over the leaf rows below a node as in tree_index.leaf_prefix
+ROLLUP_FIELDS = ["ReportingPeriodAmount", "ComparisonPeriodAmount", "AbsoluteDifferenceAmount"]
+
+BATCH_ROWS = 5000
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def available_formats() -> List[str]:
+    out = ["csv"]
+    try:
+        import openpyxl  # noqa: F401
+        out.append("xlsx")
+    except ImportError:
+        pass
+    try:
+        import pyarrow  # noqa: F401
+        out.append("parquet")
+    except ImportError:
+        pass
+    return out
+
+
+def export_columns(fields: List[str]) -> List[str]:
+    return ["Level", "IndentedText"] + list(fields) + [f + "Rollup" for f in ROLLUP_FIELDS]
+
+
+def subtree_rollups(index: TreeIndex, root: Optional[str] = None) -> Dict[str, array]:
+    """Per-node sums of ROLLUP_FIELDS over the subtree's leaves, one array per field indexed by tin."""
+    lo, hi = (0, len(index) - 1) if root is None else (index.tin[root], index.tout[root])
+    ids = index.order[lo:hi + 1]
+    leaf = index.leaf_mask(lo, hi)
+    ends = [index.tout[node_id] - lo + 1 for node_id in ids]
+    sums: Dict[str, array] = {}
+    for f in ROLLUP_FIELDS:
+        col = [parse_amount(index.by_id[node_id].get(f)) if leaf[k] else 0.0 for k, node_id in enumerate(ids)]
+        pre = leaf_prefix(col, leaf)
+        sums[f] = array("d", map(sub, map(pre.__getitem__, ends), pre[:-1]))  # pre[tout + 1] - pre[tin]
+    return sums
+
+
+def iter_rows(index: TreeIndex, fields: List[str], root: Optional[str] = None) -> Iterator[List[Any]]:
+    """Flattened pre-order rows (no Children), one list per node in export_columns() order."""
+    lo, hi = (0, len(index) - 1) if root is None else (index.tin[root], index.tout[root])
+    base = 0 if root is None else index.depth[root]
+    sums = subtree_rollups(index, root)
+    for pos in range(lo, hi + 1):
+        node_id = index.order[pos]
+        rec = index.by_id[node_id]
+        level = index.depth[node_id] - base
+        row = [level, "  " * level + str(rec.get("FinancialStatementItemText") or "")]
+        row.extend(rec.get(f) for f in fields)
+        row.extend(sums[f][pos - lo] for f in ROLLUP_FIELDS)
+        yield row
+
+
+def _batches(rows: Iterator[List[Any]], size: int = BATCH_ROWS) -> Iterator[List[List[Any]]]:
+    batch: List[List[Any]] = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# -------------------- writers (each yields bytes chunks) --------------------
+def stream_csv(index: TreeIndex, fields: List[str], root: Optional[str] = None) -> Iterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(export_columns(fields))
+    for batch in _batches(iter_rows(index, fields, root)):
+        writer.writerows(batch)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+def stream_xlsx(index: TreeIndex, fields: List[str], root: Optional[str] = None) -> Iterator[bytes]:
+    # write_only workbooks spool rows to disk; the zip is only complete after save(),
+    # so build it in a temp file and stream that back in chunks
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("FinancialStatement")
+    ws.append(export_columns(fields))
+    for row in iter_rows(index, fields, root):
+        ws.append(row)
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        wb.save(path)
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(1024 * 1024)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.unlink(path)
+
+
+class _DrainSink(io.RawIOBase):
+    """Write-only file object whose buffered bytes are handed out after each row group."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        data = bytes(b)
+        self._chunks.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def drain(self) -> bytes:
+        out = b"".join(self._chunks)
+        self._chunks = []
+        return out
+
+
+def stream_parquet(index: TreeIndex, fields: List[str], root: Optional[str] = None) -> Iterator[bytes]:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    columns = export_columns(fields)
+    schema = pa.schema(
+        [("Level", pa.int32()), ("IndentedText", pa.string())]
+        + [(f, pa.string()) for f in fields]
+        + [(f + "Rollup", pa.float64()) for f in ROLLUP_FIELDS]
+    )
+    sink = _DrainSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for batch in _batches(iter_rows(index, fields, root)):
+            cols = list(zip(*batch))
+            arrays = [
+                pa.array([None if v is None else (v if t != pa.string() else str(v)) for v in col], type=t)
+                for col, t in zip(cols, schema.types)
+            ]
+            writer.write_table(pa.Table.from_arrays(arrays, names=columns))
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+WRITERS = {
+    "csv": stream_csv,
+    "xlsx": stream_xlsx,
+    "parquet": stream_parquet,
+}
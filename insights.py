@@ -0,0 +1,185 @@
+from statistics import median
+from typing import Any, Dict, List, Optional, Tuple
+
+from period_cube import parse_amount
+
+# robust z-score (median / MAD) above which a leaf's change is an outlier
+OUTLIER_Z = 3.5
+# 0.6745 scales MAD to a standard deviation for normally distributed data
+MAD_SCALE = 0.6745
+
+
+# payload keys: flat/nested SAP rows, or the tree view's nodes (tree_view.js transformFromBackend)
+ID_KEYS = ("HierarchyNode", "id")
+ITEM_KEYS = ("FinancialStatementItem", "code")
+TEXT_KEYS = ("FinancialStatementItemText", "itemText", "name")
+CURRENT_KEYS = ("ReportingPeriodAmount", "amount")
+COMPARISON_KEYS = ("ComparisonPeriodAmount", "comparison")
+DELTA_KEYS = ("AbsoluteDifferenceAmount", "diffAbs")
+CHILDREN_KEYS = ("Children", "children")
+# raw nodes quoted in the LLM prompt next to the statistics
+PREVIEW_NODES = 50
+
+
+def _first(node: Dict[str, Any], keys: Tuple[str, ...]) -> Any:
+    for k in keys:
+        value = node.get(k)
+        if value is not None and value != "":
+            return value
+    return None
+
+
+def _children(node: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [c for c in _first(node, CHILDREN_KEYS) or [] if isinstance(c, dict)]
+
+
+def _walk(nodes: List[Dict[str, Any]]):
+    """(node, id, nested parent id) for the selected nodes and their nested children, pre-order, once per id."""
+    seen = set()
+    stack = [(n, None) for n in reversed(nodes) if isinstance(n, dict)]
+    while stack:
+        node, parent_id = stack.pop()
+        node_id = _first(node, ID_KEYS)
+        key = str(node_id) if node_id is not None else f"#{len(seen)}"
+        if key in seen:
+            continue
+        seen.add(key)
+        yield node, key, parent_id
+        for child in reversed(_children(node)):
+            stack.append((child, key))
+
+
+def _flatten(nodes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Selected nodes plus nested children, pre-order, first occurrence per id.
+    A node is a parent if it has nested children or another selected row
+    names it as ParentNode (flat SAP rows).
+    """
+    out: List[Dict[str, Any]] = []
+    for node, key, parent_id in _walk(nodes):
+        cur = parse_amount(_first(node, CURRENT_KEYS))
+        prev = parse_amount(_first(node, COMPARISON_KEYS))
+        delta = _first(node, DELTA_KEYS)
+        parent_node = node.get("ParentNode")
+        out.append({
+            "id": key,
+            "parent": parent_id if parent_id is not None else (str(parent_node) if parent_node else None),
+            "item": _first(node, ITEM_KEYS),
+            "text": _first(node, TEXT_KEYS),
+            "current": cur,
+            "comparison": prev,
+            "delta": parse_amount(delta) if delta is not None else cur - prev,
+            "has_children": bool(_children(node)),
+        })
+    parents = {r["parent"] for r in out}
+    for r in out:
+        r["has_children"] = r["has_children"] or r["id"] in parents
+    return out
+
+
+def preview_nodes(nodes: List[Dict[str, Any]], limit: int = PREVIEW_NODES) -> List[Dict[str, Any]]:
+    """The first `limit` selected nodes as sent, without their nested children (for the LLM prompt)."""
+    out: List[Dict[str, Any]] = []
+    for node, _, _ in _walk(nodes):
+        if len(out) >= limit:
+            break
+        out.append({k: v for k, v in node.items() if k not in CHILDREN_KEYS})
+    return out
+
+
+def _pct(delta: float, base: float) -> Optional[float]:
+    return round(100.0 * delta / abs(base), 2) if base else None
+
+
+def _row(r: Dict[str, Any], **extra: Any) -> Dict[str, Any]:
+    return {
+        "HierarchyNode": r["id"],
+        "FinancialStatementItem": r["item"],
+        "FinancialStatementItemText": r["text"],
+        "current": round(r["current"], 2),
+        "comparison": round(r["comparison"], 2),
+        "delta": round(r["delta"], 2),
+        **extra,
+    }
+
+
+def pre_summary(nodes: List[Dict[str, Any]], top: int = 5) -> Dict[str, Any]:
+    """
+    Deterministic statistics over a selected scope, cheap enough to run on
+    every summary request (one pass plus sorts over the selection):
+      - totals over the leaves of the selection (parents would double count)
+      - top movers by absolute change, with their share of the parent
+      - variance concentration: share of total |change| in the top movers, HHI
+      - sign flips between the comparison and reporting period
+      - outliers by robust z-score of the change (median / MAD)
+    """
+    rows = _flatten(nodes)
+    by_id = {r["id"]: r for r in rows}
+    leaves = [r for r in rows if not r["has_children"]] or rows
+
+    cur_total = sum(r["current"] for r in leaves)
+    prev_total = sum(r["comparison"] for r in leaves)
+    abs_total = sum(abs(r["delta"]) for r in leaves)
+
+    def share_of_parent(r: Dict[str, Any]) -> Optional[float]:
+        parent = by_id.get(r["parent"]) if r["parent"] is not None else None
+        if parent is None or not parent["current"]:
+            return None
+        return round(r["current"] / parent["current"], 4)
+
+    movers = sorted(leaves, key=lambda r: abs(r["delta"]), reverse=True)[:top]
+    top_share = sum(abs(r["delta"]) for r in movers) / abs_total if abs_total else 0.0
+    hhi = sum((abs(r["delta"]) / abs_total) ** 2 for r in leaves) if abs_total else 0.0
+
+    flips = [r for r in rows if r["current"] and r["comparison"] and (r["current"] > 0) != (r["comparison"] > 0)]
+    flips.sort(key=lambda r: abs(r["delta"]), reverse=True)
+
+    outliers: List[Dict[str, Any]] = []
+    if len(leaves) >= 3:
+        deltas = [r["delta"] for r in leaves]
+        med = median(deltas)
+        mad = median(abs(d - med) for d in deltas)
+        if mad:
+            scored = [(MAD_SCALE * (r["delta"] - med) / mad, r) for r in leaves]
+            outliers = [_row(r, z=round(z, 2)) for z, r in sorted(scored, key=lambda s: abs(s[0]), reverse=True) if abs(z) > OUTLIER_Z][:top]
+
+    return {
+        "nodes": len(rows),
+        "leaves": len(leaves),
+        "totals": {
+            "current": round(cur_total, 2),
+            "comparison": round(prev_total, 2),
+            "delta": round(cur_total - prev_total, 2),
+            "delta_pct": _pct(cur_total - prev_total, prev_total),
+        },
+        "top_movers": [
+            _row(r, delta_pct=_pct(r["delta"], r["comparison"]), share_of_parent=share_of_parent(r)) for r in movers
+        ],
+        "concentration": {"top_movers_share": round(top_share, 4), "hhi": round(hhi, 4)},
+        "sign_flips": [_row(r) for r in flips[:top]],
+        "sign_flip_count": len(flips),
+        "outliers": outliers,
+    }
+
+
+def render_pre_summary(stats: Dict[str, Any]) -> str:
+    """Plain bullet-point rendering of pre_summary(), used when no LLM is available."""
+    t = stats["totals"]
+    lines = [
+        f"- {stats['nodes']} nodes ({stats['leaves']} leaves): current {t['current']:,.2f} vs "
+        f"comparison {t['comparison']:,.2f}, change {t['delta']:,.2f}"
+        + (f" ({t['delta_pct']:+.2f}%)" if t["delta_pct"] is not None else ""),
+    ]
+    if stats["top_movers"]:
+        lines.append(f"- Top {len(stats['top_movers'])} movers account for "
+                     f"{100 * stats['concentration']['top_movers_share']:.0f}% of the absolute change:")
+        for m in stats["top_movers"]:
+            label = m["FinancialStatementItemText"] or m["FinancialStatementItem"] or m["HierarchyNode"]
+            lines.append(f"  - {label}: {m['delta']:+,.2f}" + (f" ({m['delta_pct']:+.2f}%)" if m["delta_pct"] is not None else ""))
+    if stats["sign_flip_count"]:
+        labels = ", ".join(str(f["FinancialStatementItemText"] or f["HierarchyNode"]) for f in stats["sign_flips"])
+        lines.append(f"- {stats['sign_flip_count']} sign flips, e.g. {labels}")
+    if stats["outliers"]:
+        labels = ", ".join(str(o["FinancialStatementItemText"] or o["HierarchyNode"]) for o in stats["outliers"])
+        lines.append(f"- Unusual changes: {labels}")
+    return "\n".join(lines)
@@ -0,0 +1,255 @@
+import time
+import uuid
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from cache_backend import MISSING, CacheBackend, cache_key
+
+logger = logging.getLogger("sap-finstat-api")
+
+
+class Job:
+    def __init__(self, job_id: str, kind: str, key: str):
+        self.id = job_id
+        self.kind = kind
+        self.key = key  # what the job computes (e.g. the OData URL), used for de-duplication
+        self.status = "queued"  # queued | running | done | failed
+        self.error: Optional[str] = None
+        self.result: Any = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    def to_dict(self, progress: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "error": self.error,
+            "progress": progress or {},
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "elapsed": (self.finished_at or time.time()) - self.created_at,
+        }
+
+    def record(self, progress: Dict[str, Any]) -> Dict[str, Any]:
+        """What the shared store keeps, so any worker can answer for the job."""
+        return {**self.to_dict(progress), "key": self.key, "result": self.result}
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "Job":
+        job = cls(record["job_id"], record["kind"], record["key"])
+        job.status = record["status"]
+        job.error = record["error"]
+        job.result = record["result"]
+        job.created_at = record["created_at"]
+        job.finished_at = record["finished_at"]
+        return job
+
+
+def _run_job(fn: Callable[..., Any], job_id: str, progress: Any, *args: Any) -> Any:
+    # worker side: the first progress entry is what moves a job from queued to running
+    progress[job_id] = {"stage": "running"}
+    return fn(job_id, progress, *args)
+
+
+class JobManager:
+    """
+    Runs long statement builds in a process pool so fetch + build + serialize
+    never hold the serving process's GIL.
+
+    Job functions must be importable top-level callables taking
+    (job_id, progress, *args); `progress` is a Manager dict shared with the
+    parent, so workers report progress[job_id] = {...} while running.
+    on_done(job, result) runs in the parent when a job succeeds; on_finish(job)
+    runs after every job ends, succeeded or failed.
+
+    With a shared `store` (the cache backend), the owning worker mirrors each
+    job's status and progress into it (on submit and finish, and every
+    MIRROR_INTERVAL while running), so status and result requests can land on
+    any worker. Identical submissions are de-duplicated across workers too.
+    """
+
+    MIRROR_INTERVAL = 0.5
+
+    def __init__(
+        self,
+        max_workers: int,
+        retention: int,
+        start_method: str = "spawn",
+        on_finish: Optional[Callable[[Job], None]] = None,
+        store: Optional[CacheBackend] = None,
+    ):
+        self.max_workers = max_workers
+        self.retention = retention
+        self.start_method = start_method
+        self.on_finish = on_finish
+        self.store = store
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._manager = None
+        self._progress = None
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._mirrored: Dict[str, Any] = {}  # job id -> last (status, progress) written to the store
+        self._mirror: Optional[threading.Thread] = None
+
+    def _ensure_pool(self) -> None:
+        # created on first submit so idle workers (and startup) pay nothing
+        if self._pool is None:
+            ctx = multiprocessing.get_context(self.start_method)
+            self._manager = ctx.Manager()
+            self._progress = self._manager.dict()
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=ctx)
+
+    def submit(
+        self,
+        kind: str,
+        key: str,
+        fn: Callable[..., Any],
+        *args: Any,
+        on_done: Optional[Callable[[Job, Any], Any]] = None,
+    ) -> Job:
+        with self._lock:
+            self._expire()
+            running = [
+                j for j in self._jobs.values() if j.kind == kind and j.key == key and j.status in ("queued", "running")
+            ]
+        if running:
+            return self._refresh(running[0])
+        if self.store is None:
+            return self._start(kind, key, fn, args, on_done)
+        active = cache_key("jobkey", f"{kind}|{key}")
+        with self.store.lock(active, timeout=10):
+            job_id = self.store.get(active)
+            if job_id is not MISSING:
+                other = self.get(job_id)
+                if other is not None and other.status in ("queued", "running"):
+                    return other
+            job = self._start(kind, key, fn, args, on_done)
+            self.store.set(active, job.id, self.retention)
+        return job
+
+    def _start(
+        self, kind: str, key: str, fn: Callable[..., Any], args: Any, on_done: Optional[Callable[[Job, Any], Any]]
+    ) -> Job:
+        with self._lock:
+            self._ensure_pool()
+            job = Job(uuid.uuid4().hex, kind, key)
+            self._jobs[job.id] = job
+            self._progress[job.id] = {"stage": "queued"}
+            future = self._pool.submit(_run_job, fn, job.id, self._progress, *args)
+        self._save(job)
+        self._ensure_mirror()
+        future.add_done_callback(lambda f: self._finish(job, f, on_done))
+        return job
+
+    def _finish(self, job: Job, future: Future, on_done: Optional[Callable[[Job, Any], Any]]) -> None:
+        try:
+            result = future.result()
+            if on_done is not None:
+                result = on_done(job, result)
+            job.result = result
+            job.status = "done"
+        except Exception as e:
+            logger.exception("Job %s failed", job.id)
+            job.error = str(e) or e.__class__.__name__
+            job.status = "failed"
+        job.finished_at = time.time()
+        self._save(job)
+        if self.on_finish is not None:
+            try:
+                self.on_finish(job)
+            except Exception:
+                logger.exception("on_finish for job %s failed", job.id)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """The job, from this worker or (when another worker owns it) from the shared store."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return self._refresh(job)
+        record = self._load(job_id)
+        return None if record is None else Job.from_record(record)
+
+    def progress(self, job_id: str) -> Dict[str, Any]:
+        with self._lock:
+            local = job_id in self._jobs
+        if not local:
+            record = self._load(job_id)
+            return dict(record["progress"]) if record else {}
+        if self._progress is None:
+            return {}
+        try:
+            return dict(self._progress.get(job_id) or {})
+        except Exception:  # manager already shut down
+            return {}
+
+    def _refresh(self, job: Job) -> Job:
+        if job.status == "queued" and self.progress(job.id).get("stage", "queued") != "queued":
+            job.status = "running"
+        return job
+
+    # ---- shared store ----
+    def _load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if self.store is None:
+            return None
+        record = self.store.get(cache_key("job", job_id))
+        return None if record is MISSING else record
+
+    def _save(self, job: Job) -> None:
+        if self.store is None:
+            return
+        progress = self.progress(job.id)
+        self._refresh(job)
+        state = (job.status, progress)
+        if self._mirrored.get(job.id) == state:
+            return
+        try:
+            self.store.set(cache_key("job", job.id), job.record(progress), self.retention)
+            self._mirrored[job.id] = state
+        except Exception:
+            logger.exception("Could not store state of job %s", job.id)
+
+    def _ensure_mirror(self) -> None:
+        if self.store is None:
+            return
+        with self._lock:
+            if self._mirror is not None and self._mirror.is_alive():
+                return
+            self._mirror = threading.Thread(target=self._mirror_loop, name="job-mirror", daemon=True)
+            self._mirror.start()
+
+    def _mirror_loop(self) -> None:
+        # runs while this worker owns unfinished jobs
+        while True:
+            time.sleep(self.MIRROR_INTERVAL)
+            with self._lock:
+                active = [j for j in self._jobs.values() if j.status in ("queued", "running")]
+                if not active:
+                    self._mirror = None
+                    return
+            for job in active:
+                self._save(job)
+
+    def list(self) -> List[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _expire(self) -> None:
+        cutoff = time.time() - self.retention
+        for job_id in [j.id for j in self._jobs.values() if j.finished_at and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+            self._mirrored.pop(job_id, None)
+            if self._progress is not None:
+                self._progress.pop(job_id, None)
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+            self._progress = None
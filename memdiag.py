@@ -0,0 +1,222 @@
+import os
+import sys
+import time
+import heapq
+import logging
+import threading
+import tracemalloc
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, List, Optional
+
+logger = logging.getLogger("sap-finstat-api")
+
+ENABLED = False
+LOG_THRESHOLD_BYTES = 256 * 1024 * 1024
+
+
+def configure() -> None:
+    """
+    Read the MEMORY_* settings (after .env is loaded) and start tracing when
+    enabled. Opt-in: tracemalloc slows allocation-heavy code (tree building,
+    JSON) noticeably. CPU pool and job workers call this on import too.
+    """
+    global ENABLED, LOG_THRESHOLD_BYTES
+    ENABLED = os.getenv("MEMORY_DIAGNOSTICS", "False").lower() in ("1", "true", "yes")
+    LOG_THRESHOLD_BYTES = int(float(os.getenv("MEMORY_LOG_THRESHOLD_MB", "256")) * 1024 * 1024)
+    if ENABLED and not tracemalloc.is_tracing():
+        tracemalloc.start(int(os.getenv("MEMORY_TRACE_FRAMES", "1")))
+
+
+class _Recording:
+    """Stage records of the work in progress (a request, or one pool stage)."""
+
+    __slots__ = ("stages", "peak")
+
+    def __init__(self, stages: List[Dict[str, Any]]):
+        self.stages = stages
+        self.peak = 0  # highest absolute traced size seen; stage() resets tracemalloc's own peak
+
+
+_current: contextvars.ContextVar[Optional[_Recording]] = contextvars.ContextVar("memdiag_recording", default=None)
+
+_PAGE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def rss_bytes() -> Optional[int]:
+    """Current resident set size (Linux /proc), or None where unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def max_rss_bytes() -> Optional[int]:
+    """Peak RSS of this process so far."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+@contextmanager
+def stage(name: str, **sizes: int):
+    """
+    Traced allocation delta and peak of a block, appended to the current
+    recording. Yields a dict the block can add payload sizes to.
+    tracemalloc is process-wide, so overlapping requests blur the numbers.
+    """
+    info: Dict[str, Any] = {"stage": name, **sizes}
+    rec = _current.get()
+    if not ENABLED or rec is None:
+        yield info
+        return
+    before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    try:
+        yield info
+    finally:
+        current, peak = tracemalloc.get_traced_memory()
+        info.update(
+            seconds=round(time.perf_counter() - started, 6),
+            traced_delta=current - before,
+            traced_peak=peak - before,
+            pid=os.getpid(),
+        )
+        rec.peak = max(rec.peak, peak)
+        rec.stages.append(info)
+
+
+@contextmanager
+def recording():
+    """Collect stage() records of a block into a fresh list (e.g. inside a pool worker)."""
+    outer = _current.get()
+    rec = _Recording([])
+    token = _current.set(rec)
+    try:
+        yield rec.stages
+    finally:
+        _current.reset(token)
+        if outer is not None:
+            outer.peak = max(outer.peak, rec.peak)
+
+
+def extend(stages: Optional[List[Dict[str, Any]]]) -> None:
+    """Attach stage records produced elsewhere (a pool worker) to the current recording."""
+    rec = _current.get()
+    if stages and rec is not None:
+        rec.stages.extend(stages)
+
+
+class RequestLog:
+    """Recent and heaviest requests measured while diagnostics are on."""
+
+    def __init__(self, keep: int = 100, heaviest: int = 10):
+        self._lock = threading.Lock()
+        self._recent: Deque[Dict[str, Any]] = deque(maxlen=keep)
+        self._heaviest: List[Any] = []  # min-heap of (traced_peak, seq, record)
+        self._keep_heaviest = heaviest
+        self._seq = 0
+
+    @contextmanager
+    def measure(self, label: str):
+        record: Dict[str, Any] = {"request": label, "at": time.time(), "stages": []}
+        rec = _Recording(record["stages"])
+        token = _current.set(rec)
+        rss_before = rss_bytes()
+        max_before = max_rss_bytes()
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            _current.reset(token)
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, rec.peak)
+            rss_after = rss_bytes()
+            max_after = max_rss_bytes()
+            record.update(
+                seconds=round(time.perf_counter() - started, 6),
+                traced_peak=peak - before,
+                traced_delta=current - before,
+                rss_before=rss_before,
+                rss_after=rss_after,
+                max_rss=max_after,
+                # the process-wide RSS high-water mark moved during this request
+                max_rss_growth=(max_after - max_before) if max_after is not None and max_before is not None else None,
+            )
+            self._add(record)
+
+    def _add(self, record: Dict[str, Any]) -> None:
+        growth = max(record["traced_peak"], record["max_rss_growth"] or 0)
+        if growth >= LOG_THRESHOLD_BYTES:
+            logger.warning(
+                "Memory-heavy request %s: traced peak %.1f MB, RSS high-water +%.1f MB, stages %s",
+                record["request"],
+                record["traced_peak"] / 1e6,
+                (record["max_rss_growth"] or 0) / 1e6,
+                [(s["stage"], round(s.get("traced_peak", 0) / 1e6, 1)) for s in record["stages"]],
+            )
+        with self._lock:
+            self._recent.append(record)
+            self._seq += 1
+            item = (record["traced_peak"], self._seq, record)
+            if len(self._heaviest) < self._keep_heaviest:
+                heapq.heappush(self._heaviest, item)
+            else:
+                heapq.heappushpop(self._heaviest, item)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "recent": list(self._recent)[-20:],
+                "heaviest": [r for _, _, r in sorted(self._heaviest, key=lambda i: -i[0])],
+            }
+
+
+def traced_bytes() -> int:
+    return tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+
+
+def top_allocations(limit: int = 10) -> List[Dict[str, Any]]:
+    """Largest live allocation sites right now (source lines)."""
+    if not tracemalloc.is_tracing():
+        return []
+    stats = tracemalloc.take_snapshot().statistics("lineno")[:limit]
+    return [{"where": str(s.traceback[0]), "bytes": s.size, "blocks": s.count} for s in stats]
+
+
+def deep_size(obj: Any, limit: int = 5_000_000) -> int:
+    """
+    Approximate retained size of a JSON-like object graph (dicts, lists, str,
+    numbers, plus __dict__/__slots__ objects), visiting at most `limit` objects.
+    """
+    seen = set()
+    total = 0
+    stack = [obj]
+    while stack and len(seen) < limit:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset, deque)):
+            stack.extend(o)
+        elif isinstance(o, (str, bytes, bytearray, int, float, bool)) or o is None:
+            continue
+        else:
+            if hasattr(o, "__dict__"):
+                stack.append(vars(o))
+            for slot in getattr(type(o), "__slots__", ()):
+                if hasattr(o, slot):
+                    stack.append(getattr(o, slot))
+    return total
@@ -0,0 +1,149 @@
+import time
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+
+from tree_builder import build_tree
+from tree_index import TreeIndex, leaf_prefix
+
+
+def parse_amount(val: Any) -> float:
+    """SAP amounts arrive as strings ("1234.50", sometimes "1234.50-")."""
+    if val is None or val == "":
+        return 0.0
+    if isinstance(val, (int, float)):
+        return float(val)
+    s = str(val).strip()
+    try:
+        if s.endswith("-"):
+            return -float(s[:-1])
+        return float(s)
+    except ValueError:
+        return 0.0
+
+
+class PeriodCube:
+    """
+    Node x period matrix of ReportingPeriodAmount, one slice per reporting period.
+
+    Rows are aligned by HierarchyNode over the union of all slices and laid
+    out in pre-order of that union, so a node's subtree is the contiguous row
+    range [tin, tout]; per-period leaf prefix sums (tree_index.leaf_prefix)
+    then give any rollup in O(1). The union is linked by build_tree, whose
+    report on its parent links (orphans, cycles) is kept in diagnostics.
+    """
+
+    ITEMSIZE = array("d").itemsize
+
+    def __init__(self, periods: List[str], slices: List[TreeIndex], amount_field: str = "ReportingPeriodAmount"):
+        self.periods = list(periods)
+        self.built_at = time.time()
+        # the cube changes exactly when one of its slices does
+        self.etag = hashlib.sha1("|".join(str(s.etag) for s in slices).encode("utf-8")).hexdigest()
+        self.last_modified = max((s.built_at or self.built_at for s in slices), default=self.built_at)
+        roots, self.diagnostics = _union_skeleton(slices)
+        self.index = TreeIndex(roots)
+        n = len(self.index)
+        leaf = self.index.leaf_mask()
+
+        self.values: List[array] = []
+        self.prefix: List[array] = []
+        for sl in slices:
+            col = array("d", bytes(n * self.ITEMSIZE))
+            for node_id, rec in sl.by_id.items():
+                pos = self.index.tin.get(node_id)
+                if pos is not None:
+                    col[pos] = parse_amount(rec.get(amount_field))
+            self.values.append(col)
+            self.prefix.append(leaf_prefix(col, leaf))
+
+    @staticmethod
+    def estimate_bytes(nodes: int, periods: int) -> int:
+        return (2 * nodes + 1) * periods * PeriodCube.ITEMSIZE
+
+    @property
+    def memory_bytes(self) -> int:
+        return sum(a.buffer_info()[1] * a.itemsize for a in self.values + self.prefix)
+
+    def period_pos(self, period: str) -> int:
+        return self.periods.index(period)
+
+    def value(self, node_id: str, p: int, rollup: bool = True) -> float:
+        lo = self.index.tin[node_id]
+        if not rollup:
+            return self.values[p][lo]
+        hi = self.index.tout[node_id]
+        return self.prefix[p][hi + 1] - self.prefix[p][lo]
+
+    def rows(self, root: Optional[str] = None, max_depth: Optional[int] = None) -> List[str]:
+        """Pre-order node ids of the whole cube or of root's subtree, depth-limited."""
+        if root is None:
+            lo, hi, base = 0, len(self.index) - 1, 0
+        else:
+            lo, hi, base = self.index.tin[root], self.index.tout[root], self.index.depth[root]
+        ids = self.index.order[lo:hi + 1]
+        if max_depth is None:
+            return ids
+        return [i for i in ids if self.index.depth[i] - base <= max_depth]
+
+    def compare(self, node_id: str, base: int, other: int, rollup: bool = True) -> Dict[str, Optional[float]]:
+        a = self.value(node_id, base, rollup)
+        b = self.value(node_id, other, rollup)
+        return {"delta": b - a, "growth": (b - a) / abs(a) if a else None}
+
+
+def _union_skeleton(slices: List[TreeIndex]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    (roots, diagnostics) of a structure-only copy of all nodes seen in any
+    slice (first occurrence wins), linked by tree_builder.build_tree.
+    """
+    nodes: Dict[str, Dict[str, Any]] = {}
+    for sl in slices:
+        for node_id in sl.order:
+            if node_id in nodes:
+                continue
+            rec = sl.by_id[node_id]
+            nodes[node_id] = {
+                "HierarchyNode": rec.get("HierarchyNode"),
+                "ParentNode": rec.get("ParentNode"),
+                "NodeType": rec.get("NodeType"),
+                "FinancialStatementItem": rec.get("FinancialStatementItem"),
+                "FinancialStatementItemText": rec.get("FinancialStatementItemText"),
+            }
+    return build_tree(list(nodes.values()))
+
+
+class CubeCache:
+    """In-process LRU of built cubes, bounded by total matrix bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[str, PeriodCube]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(c.memory_bytes for c in self._data.values())
+
+    def sizes(self) -> Dict[str, int]:
+        with self._lock:
+            return {k: c.memory_bytes for k, c in self._data.items()}
+
+    def get(self, key: str) -> Optional[PeriodCube]:
+        with self._lock:
+            cube = self._data.get(key)
+            if cube is not None:
+                self._data.move_to_end(key)
+            return cube
+
+    def put(self, key: str, cube: PeriodCube) -> None:
+        with self._lock:
+            self._data[key] = cube
+            self._data.move_to_end(key)
+            total = sum(c.memory_bytes for c in self._data.values())
+            while total > self.max_bytes and len(self._data) > 1:
+                _, evicted = self._data.popitem(last=False)
+                total -= evicted.memory_bytes
@@ -0,0 +1,200 @@
+import json
+import asyncio
+import threading
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from skeleton import AMOUNT_FIELDS
+from tree_index import node_key
+
+
+class Subscriber:
+    """One WebSocket connection: its queue of outgoing (serialized) messages and subscribed topics."""
+
+    __slots__ = ("queue", "topics", "dropped")
+
+    def __init__(self, queue_size: int):
+        self.queue: "asyncio.Queue[str]" = asyncio.Queue(queue_size)
+        self.topics: Set[str] = set()
+        self.dropped = 0
+
+
+def amount_snapshot(payload: bytes) -> Dict[str, Tuple[Any, ...]]:
+    """HierarchyNode -> AMOUNT_FIELDS values of a serialized tree."""
+    out: Dict[str, Tuple[Any, ...]] = {}
+    stack = list(json.loads(payload)["records"])
+    while stack:
+        node = stack.pop()
+        out[node_key(node)] = tuple(node.get(f) for f in AMOUNT_FIELDS)
+        stack.extend(node.get("Children") or [])
+    return out
+
+
+def tree_delta(old: Dict[str, Tuple[Any, ...]], new: Dict[str, Tuple[Any, ...]]) -> Dict[str, Any]:
+    changed = [
+        {"HierarchyNode": node_id, **dict(zip(AMOUNT_FIELDS, values))}
+        for node_id, values in new.items()
+        if node_id in old and old[node_id] != values
+    ]
+    return {
+        "changed": changed,
+        "added": [node_id for node_id in new if node_id not in old],
+        "removed": [node_id for node_id in old if node_id not in new],
+    }
+
+
+class PushHub:
+    """
+    Per-worker fan-out of server events to WebSocket subscribers by topic
+    ("tree:<cache key>", "job:<id>").
+
+    Topic tables are only touched on the event loop; publish() may be called
+    from any thread (refresh loaders, job callbacks) and hops onto the loop.
+    Events are serialized once per publish, not per subscriber. Each subscriber
+    has a bounded queue: a client that stops reading loses its oldest events
+    instead of growing server memory.
+
+    For tree topics the hub keeps one amount snapshot per subscribed topic (not
+    per connection), so a refresh is pushed as the nodes whose amounts changed.
+
+    Publishing only reaches this worker's connections. Events that happen on
+    another worker (a tree rebuilt there, a job it owns finishing) are picked
+    up by polling the shared cache (Backend3 poll_shared_events): each topic's
+    version() is the tree etag or final job status its subscribers last saw.
+    """
+
+    def __init__(self, queue_size: int = 100, max_delta: int = 500):
+        self.queue_size = queue_size
+        self.max_delta = max_delta
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._topics: Dict[str, Set[Subscriber]] = {}
+        self._connections = 0
+        self._snapshots: Dict[str, Dict[str, Tuple[Any, ...]]] = {}
+        self._versions: Dict[str, Any] = {}
+        self._lock = threading.Lock()  # guards _snapshots, _versions and counters
+        self._published = 0
+        self._delivered = 0
+        self._dropped = 0
+
+    # ---- loop side ----
+    def connect(self) -> Subscriber:
+        self._loop = asyncio.get_running_loop()
+        self._connections += 1
+        return Subscriber(self.queue_size)
+
+    def disconnect(self, sub: Subscriber) -> None:
+        for topic in list(sub.topics):
+            self.unsubscribe(sub, topic)
+        self._connections -= 1
+
+    def subscribe(self, sub: Subscriber, topic: str) -> None:
+        sub.topics.add(topic)
+        self._topics.setdefault(topic, set()).add(sub)
+
+    def unsubscribe(self, sub: Subscriber, topic: str) -> None:
+        sub.topics.discard(topic)
+        subs = self._topics.get(topic)
+        if subs is None:
+            return
+        subs.discard(sub)
+        if not subs:
+            del self._topics[topic]
+            with self._lock:
+                self._snapshots.pop(topic, None)
+                self._versions.pop(topic, None)
+
+    def topics(self) -> List[str]:
+        return list(self._topics)
+
+    def _fan_out(self, topic: str, event: str) -> None:
+        subs = self._topics.get(topic)
+        if not subs:
+            return
+        delivered = dropped = 0
+        for sub in subs:
+            if sub.queue.full():
+                sub.queue.get_nowait()
+                sub.dropped += 1
+                dropped += 1
+            sub.queue.put_nowait(event)
+            delivered += 1
+        with self._lock:
+            self._delivered += delivered
+            self._dropped += dropped
+
+    # ---- any thread ----
+    def has_subscribers(self, topic: str) -> bool:
+        return topic in self._topics
+
+    def version(self, topic: str) -> Any:
+        with self._lock:
+            return self._versions.get(topic)
+
+    def mark(self, topic: str, version: Any) -> None:
+        """Record what subscribers of `topic` have been told, so polling does not repeat it."""
+        if not self.has_subscribers(topic):
+            return
+        with self._lock:
+            self._versions[topic] = version
+
+    def publish(self, topic: str, event: Dict[str, Any]) -> None:
+        loop = self._loop
+        if loop is None or not self.has_subscribers(topic):
+            return
+        with self._lock:
+            self._published += 1
+        message = json.dumps({"topic": topic, **event}, default=str)
+        try:
+            if loop.is_running() and _running_loop() is loop:
+                self._fan_out(topic, message)
+            else:
+                loop.call_soon_threadsafe(self._fan_out, topic, message)
+        except RuntimeError:  # loop closed during shutdown
+            pass
+
+    def seed_tree(self, topic: str, payload: bytes, etag: Optional[str] = None) -> None:
+        """Remember the amounts a new subscriber starts from (first subscriber only)."""
+        with self._lock:
+            if topic in self._snapshots:
+                return
+        snapshot = amount_snapshot(payload)
+        with self._lock:
+            if topic not in self._snapshots:
+                self._snapshots[topic] = snapshot
+                self._versions[topic] = etag
+
+    def publish_tree(self, topic: str, entry: Dict[str, Any]) -> None:
+        """Push a rebuilt tree as a delta against the last one subscribers saw."""
+        if not self.has_subscribers(topic):
+            return
+        new = amount_snapshot(entry["payload"])
+        with self._lock:
+            old = self._snapshots.get(topic)
+            self._snapshots[topic] = new
+            self._versions[topic] = entry["etag"]
+        event: Dict[str, Any] = {"type": "tree", "etag": entry["etag"], "built_at": entry["built_at"]}
+        delta = tree_delta(old, new) if old is not None else None
+        if delta is None or sum(len(v) for v in delta.values()) > self.max_delta:
+            event["full_refresh"] = True  # no baseline or too much changed: refetch
+        else:
+            event.update(delta)
+        self.publish(topic, event)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "connections": self._connections,
+                "topics": len(self._topics),
+                "subscriptions": sum(len(s) for s in list(self._topics.values())),
+                "tree_snapshots": len(self._snapshots),
+                "published": self._published,
+                "delivered": self._delivered,
+                "dropped": self._dropped,
+            }
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
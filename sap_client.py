@@ -0,0 +1,184 @@
+import os
+import time
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, MaxRetryError, NewConnectionError
+
+logger = logging.getLogger("sap-finstat-api")
+
+
+def _env_bool(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+
+def _connect_failure(error: requests.ConnectionError) -> bool:
+    """True if the request never reached SAP (refused, unresolvable, connect timeout)."""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    cause = error.args[0] if error.args else None
+    return isinstance(cause, MaxRetryError) and isinstance(cause.reason, (NewConnectionError, ConnectTimeoutError))
+
+
+class SapClient:
+    """
+    Managed SAP OData session shared by all request threads of a worker.
+
+    - one requests.Session with a sized urllib3 pool (SAP_POOL_SIZE) and keep-alive
+    - CSRF token fetched once and reused; session cookies (SAP_SESSIONID...) are
+      kept by the session, so SAP does not mint a new token/session per call.
+      The token is only re-fetched when SAP answers 403 "X-CSRF-Token: Required".
+    - GETs retried with exponential backoff only where SAP did not run the
+      query: connection failures and 502/503/504 from the gateway. Read
+      timeouts and 500s are not retried (each retry would re-run a
+      $top=1000000 query), and all attempts of one get() share a deadline
+      (SAP_RETRY_DEADLINE), which also caps each attempt's read timeout.
+    - connection reuse statistics via stats()
+    """
+
+    RETRY_STATUSES = (502, 503, 504)
+    CONNECT_TIMEOUT = 10.0
+
+    def __init__(
+        self,
+        username: str,
+        password: str,
+        *,
+        timeout: int = 60,
+        verify: bool = True,
+        pool_size: Optional[int] = None,
+        keep_alive: Optional[bool] = None,
+        max_retries: Optional[int] = None,
+        backoff_factor: Optional[float] = None,
+        retry_deadline: Optional[float] = None,
+    ):
+        self.timeout = timeout
+        self.verify = verify
+        self.pool_size = pool_size if pool_size is not None else int(os.getenv("SAP_POOL_SIZE", "20"))
+        self.keep_alive = keep_alive if keep_alive is not None else _env_bool("SAP_KEEP_ALIVE", "True")
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("SAP_MAX_RETRIES", "3"))
+        self.backoff_factor = backoff_factor if backoff_factor is not None else float(os.getenv("SAP_RETRY_BACKOFF", "0.5"))
+        self.retry_deadline = (
+            retry_deadline if retry_deadline is not None else float(os.getenv("SAP_RETRY_DEADLINE", str(timeout * 1.5)))
+        )
+
+        self.session = requests.Session()
+        self.session.auth = (username, password)
+        self.session.headers.update({
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+            "Connection": "keep-alive" if self.keep_alive else "close",
+        })
+        # retries are done in _send(), where they can share one deadline
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._adapter = adapter
+
+        self._csrf_token: Optional[str] = None
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._token_fetches = 0
+        self._token_refreshes = 0
+        self._retries = 0
+
+    def get(self, url: str, **kwargs: Any) -> requests.Response:
+        resp = self._get(url, **kwargs)
+        if resp.status_code == 403 and resp.headers.get("x-csrf-token", "").lower() == "required":
+            logger.info("SAP rejected CSRF token; fetching a new one")
+            with self._lock:
+                self._csrf_token = None
+                self._token_refreshes += 1
+            resp = self._get(url, **kwargs)
+        return resp
+
+    def _get(self, url: str, **kwargs: Any) -> requests.Response:
+        with self._lock:
+            token = self._csrf_token
+            self._requests += 1
+            if token is None:
+                self._token_fetches += 1
+        headers = dict(kwargs.pop("headers", None) or {})
+        headers["X-CSRF-Token"] = token or "Fetch"
+        kwargs.setdefault("verify", self.verify)
+        resp = self._send(url, headers, kwargs)
+
+        issued = resp.headers.get("x-csrf-token")
+        if issued and issued.lower() not in ("required", "fetch"):
+            with self._lock:
+                self._csrf_token = issued
+        return resp
+
+    def _send(self, url: str, headers: Dict[str, str], kwargs: Dict[str, Any]) -> requests.Response:
+        read_timeout = kwargs.pop("timeout", self.timeout)
+        deadline = time.monotonic() + self.retry_deadline
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            timeout = (min(self.CONNECT_TIMEOUT, remaining), min(read_timeout, remaining))
+            try:
+                resp = self.session.get(url, headers=headers, timeout=timeout, **kwargs)
+            except requests.ConnectionError as e:
+                # only failures to connect are safe to retry; a dropped response may have run the query
+                if not _connect_failure(e) or not self._retry_pause(attempt, deadline, None, e):
+                    raise
+                attempt += 1
+                continue
+            if resp.status_code not in self.RETRY_STATUSES or not self._retry_pause(attempt, deadline, resp, None):
+                return resp
+            attempt += 1
+
+    def _retry_pause(
+        self, attempt: int, deadline: float, resp: Optional[requests.Response], error: Optional[Exception]
+    ) -> bool:
+        """Sleep before the next attempt; False when retries or the deadline are used up."""
+        if attempt >= self.max_retries:
+            return False
+        delay = self.backoff_factor * 2 ** attempt
+        retry_after = resp.headers.get("retry-after") if resp is not None else None
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                except (TypeError, ValueError):
+                    pass
+        if time.monotonic() + max(delay, 0) >= deadline:
+            return False
+        logger.warning(
+            "SAP request failed (%s), retry %d/%d in %.1fs",
+            error or resp.status_code, attempt + 1, self.max_retries, delay,
+        )
+        with self._lock:
+            self._retries += 1
+        time.sleep(max(delay, 0))
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        connections = 0
+        pool_requests = 0
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            connections += pool.num_connections
+            pool_requests += pool.num_requests
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "http_requests": pool_requests,
+                "connections_opened": connections,
+                "connection_reuse_ratio": (1 - connections / pool_requests) if pool_requests else None,
+                "csrf_token_cached": self._csrf_token is not None,
+                "csrf_token_fetches": self._token_fetches,
+                "csrf_token_refreshes": self._token_refreshes,
+                "retries": self._retries,
+                "pool_size": self.pool_size,
+                "keep_alive": self.keep_alive,
+            }
@@ -0,0 +1,226 @@
+import json
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from tree_builder import SAMPLE_SIZE, build_tree, parent_key
+from tree_index import node_key
+
+# fields that only depend on the FS version / chart of accounts (the skeleton
+# cache key). Everything else on a statement row (amounts, but also Ledger,
+# company-specific account names, functional area...) varies with the other
+# request parameters and is fetched per request.
+HIERARCHY_FIELDS = [
+    "HierarchyNode",
+    "ParentNode",
+    "ChildNode",
+    "NodeType",
+    "FinancialStatementItem",
+    "FinancialStatementItemText",
+    "FinStatementHierarchyLevelVal",
+    "FinancialStatementVariant",
+]
+# the amounts pushed as tree deltas (push.py)
+AMOUNT_FIELDS = [
+    "Currency",
+    "ReportingPeriodAmount",
+    "ComparisonPeriodAmount",
+    "RelativeDifferencePercent",
+    "AbsoluteDifferenceAmount",
+]
+
+
+def period_select(fields: List[str]) -> List[str]:
+    """What a fetch against a cached skeleton selects: the node id plus every non-hierarchy field."""
+    return ["HierarchyNode"] + [f for f in fields if f not in HIERARCHY_FIELDS]
+
+
+class SkeletonMismatch(Exception):
+    """The period rows reference nodes the cached skeleton does not have; extend it."""
+
+
+def make_skeleton(roots: List[Dict[str, Any]], max_depth: Optional[int] = None) -> bytes:
+    """
+    Serialize the structure of a built tree: the HIERARCHY_FIELDS of each node
+    in pre-order, with each node's parent position (-1 for roots). Pre-order
+    puts every parent before its children. Roots whose ParentNode was set are
+    flagged with why build_tree(records, max_depth) re-rooted them ("orphan",
+    "cycle" or "depth_cut"), so materialize() can report the problems of the
+    nodes a request actually returns.
+    """
+    nodes: List[Dict[str, Any]] = []
+    parent: List[int] = []
+    stack: List[Tuple[Dict[str, Any], int]] = [(r, -1) for r in reversed(roots)]
+    while stack:
+        node, p = stack.pop()
+        pos = len(nodes)
+        nodes.append({k: node[k] for k in HIERARCHY_FIELDS if k in node})
+        parent.append(p)
+        for child in reversed(node.get("Children") or []):
+            stack.append((child, pos))
+
+    depth = [0] * len(nodes)
+    size = [1] * len(nodes)
+    for i in range(1, len(nodes)):
+        if parent[i] >= 0:
+            depth[i] = depth[parent[i]] + 1
+    for i in range(len(nodes) - 1, 0, -1):
+        if parent[i] >= 0:
+            size[parent[i]] += size[i]
+    pos_of = {node_key(n): i for i, n in enumerate(nodes)}
+    issues: Dict[int, str] = {}
+    for i, node in enumerate(nodes):
+        pk = parent_key(node) if parent[i] < 0 else None
+        if pk is None:
+            continue
+        j = pos_of.get(pk)
+        if j is None:
+            issues[i] = "orphan"
+        elif max_depth is not None and depth[j] == max_depth and not i <= j < i + size[i]:
+            issues[i] = "depth_cut"  # the parent sits at the depth limit
+        else:
+            issues[i] = "cycle"  # re-rooted although its parent is in the tree
+    skeleton = {"built_at": time.time(), "nodes": nodes, "parent": parent, "issues": issues}
+    return json.dumps(skeleton, separators=(",", ":")).encode("utf-8")
+
+
+def _cycle(nodes: List[Dict[str, Any]], pos_of: Dict[str, int], i: int) -> Optional[List[int]]:
+    """Positions on the ParentNode chain from node i back to itself, or None if it never returns."""
+    chain: List[int] = []
+    j = pos_of.get(parent_key(nodes[i]) or "")
+    while j is not None and j != i and len(chain) < len(nodes):
+        chain.append(j)
+        j = pos_of.get(parent_key(nodes[j]) or "")
+    return chain if j == i else None
+
+
+def extend_skeleton(
+    skeleton: Dict[str, Any], roots: List[Dict[str, Any]], max_depth: Optional[int] = None
+) -> bytes:
+    """
+    Skeleton covering both the cached `skeleton` and a freshly built tree, so
+    requests for different companies (whose node sets differ) keep sharing one
+    hierarchy instead of replacing each other's. The fresh tree's links win.
+    """
+    rows: List[Dict[str, Any]] = []
+    stack = list(reversed(roots))
+    while stack:
+        node = stack.pop()
+        rows.append({k: node[k] for k in HIERARCHY_FIELDS if k in node})
+        stack.extend(reversed(node.get("Children") or []))
+    rows.extend(dict(n) for n in skeleton["nodes"])  # build_tree keeps the first row per id
+    union, _ = build_tree(rows, max_depth)
+    return make_skeleton(union, max_depth)
+
+
+def merge_skeletons(newer: bytes, older: bytes, max_depth: Optional[int] = None) -> bytes:
+    """`newer` plus the nodes only `older` has (two extensions of one skeleton raced)."""
+    new = json.loads(newer)
+    old = json.loads(older)
+    known = {node_key(n) for n in new["nodes"]}
+    if all(node_key(n) in known for n in old["nodes"]):
+        return newer
+    union, _ = build_tree([dict(n) for n in new["nodes"]] + [dict(n) for n in old["nodes"]], max_depth)
+    return make_skeleton(union, max_depth)
+
+
+def align_rows(
+    skeleton: Dict[str, Any], records: List[Dict[str, Any]]
+) -> Tuple[List[Optional[Dict[str, Any]]], List[str]]:
+    """
+    (period rows by skeleton position, duplicate ids). Positions the fetch
+    returned no row for are None; of duplicate rows the first one is kept,
+    as build_tree does.
+    """
+    if "issues" not in skeleton:
+        raise SkeletonMismatch("cached hierarchy predates per-node issue flags")
+    pos = {node_key(n): i for i, n in enumerate(skeleton["nodes"])}
+    rows: List[Optional[Dict[str, Any]]] = [None] * len(skeleton["nodes"])
+    duplicates: List[str] = []
+    for r in records:
+        i = pos.get(node_key(r))
+        if i is None:
+            raise SkeletonMismatch(f"HierarchyNode {node_key(r)} is not in the cached hierarchy")
+        if rows[i] is None:
+            rows[i] = r
+        else:
+            duplicates.append(node_key(r))
+    return rows, duplicates
+
+
+def materialize(
+    skeleton: Dict[str, Any], rows: List[Optional[Dict[str, Any]]], duplicates: Optional[List[str]] = None
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    (roots, diagnostics) for one request: the skeleton nodes the period fetch
+    returned rows for, linked by skeleton position, with the period fields
+    filled in. No id lookups or cycle checks: the links were validated when
+    the skeleton was built. As in build_tree, a node whose parent has no row
+    in this result becomes an orphan root, and the diagnostics (same shape as
+    build_tree's) describe the returned rows only.
+    """
+    nodes = skeleton["nodes"]
+    parent = skeleton["parent"]
+    issues = {int(i): kind for i, kind in skeleton["issues"].items()}  # JSON object keys are strings
+    pos_of: Optional[Dict[str, int]] = None
+
+    def position(node_id: Optional[str]) -> Optional[int]:
+        nonlocal pos_of
+        if pos_of is None:
+            pos_of = {node_key(n): k for k, n in enumerate(nodes)}
+        return pos_of.get(node_id) if node_id is not None else None
+
+    built: List[Optional[Dict[str, Any]]] = [None] * len(nodes)
+    depth = [0] * len(nodes)
+    roots: List[Dict[str, Any]] = []
+    found: Dict[str, List[Any]] = {"orphan": [], "cycle": [], "depth_cut": []}
+    for i, node in enumerate(nodes):
+        if rows[i] is None:
+            continue
+        rec = dict(node)
+        rec.update(rows[i])
+        rec["Children"] = []
+        built[i] = rec
+        p = parent[i]
+        if p >= 0 and built[p] is not None:
+            depth[i] = depth[p] + 1
+            built[p]["Children"].append(rec)
+            continue
+        roots.append(rec)
+        if p >= 0:
+            found["orphan"].append(node_key(node))  # the parent's row was not returned
+            continue
+        kind = issues.get(i)
+        if kind is None:
+            continue
+        j = position(parent_key(node))
+        if j is None or rows[j] is None:
+            found["orphan"].append(node_key(node))
+        elif kind == "cycle":
+            members = _cycle(nodes, pos_of, i) or []  # pos_of is built by position() above
+            found["cycle"].append([node_key(node)] + [node_key(nodes[k]) for k in reversed(members)])
+        else:
+            found[kind].append(node_key(node))
+
+    duplicates = duplicates or []
+    counts = {
+        "duplicates": len(duplicates),
+        "orphans": len(found["orphan"]),
+        "cycles": len(found["cycle"]),
+        "depth_cut": len(found["depth_cut"]),
+        "missing_id": 0,  # rows without an id never align (SkeletonMismatch)
+    }
+    n = sum(1 for r in rows if r is not None)
+    diagnostics = {
+        "ok": not any(counts.values()),
+        "rows": n + len(duplicates),
+        "nodes": n,
+        "roots": len(roots),
+        "depth": max((depth[i] for i in range(len(nodes)) if rows[i] is not None), default=0),
+        "counts": counts,
+        "duplicate_ids": duplicates[:SAMPLE_SIZE],
+        "orphan_ids": found["orphan"][:SAMPLE_SIZE],
+        "cycles": found["cycle"][:SAMPLE_SIZE],
+        "depth_cut_ids": found["depth_cut"][:SAMPLE_SIZE],
+        "skeleton_built_at": skeleton["built_at"],
+    }
+    return roots, diagnostics
@@ -0,0 +1,99 @@
+import json
+import os
+import re
+import sys
+
+import pytest
+
+# the service modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def statement_records(n=30, company="1000"):
+    """Flat SAP rows: N0 and N1 are roots, every other node hangs under an earlier one."""
+    rows = []
+    for i in range(n):
+        amount = (i + 1) * 10.0 if company == "1000" else (i + 1) * 20.0
+        rows.append({
+            "HierarchyNode": f"N{i}",
+            "ParentNode": "000000" if i < 2 else f"N{(i - 2) // 2}",
+            "NodeType": "L",
+            "FinancialStatementItem": f"FS{i}",
+            "FinancialStatementItemText": f"Item {i}",
+            "CorporateGroupAccount": f"CG{i}",
+            "Currency": "EUR",
+            "Ledger": "0L",
+            "ReportingPeriodAmount": str(amount),
+            "ComparisonPeriodAmount": str(amount / 2),
+            "AbsoluteDifferenceAmount": str(amount / 2),
+            "RelativeDifferencePercent": "100",
+        })
+    return rows
+
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200):
+        self.status_code = status_code
+        self.content = json.dumps(payload).encode("utf-8")
+        self.text = self.content.decode("utf-8")
+        self.headers = {}
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class FakeSap:
+    """Stands in for the SAP session: rows per company code, honouring $select; records every URL."""
+
+    def __init__(self):
+        self.urls = []
+        self.records = statement_records
+
+    def get(self, url, **kwargs):
+        self.urls.append(url)
+        select = url.split("$select=")[1].split("&")[0].split(",")
+        company = re.search(r"P_BUKRS=%27(\w*)%27", url).group(1)
+        rows = [{k: v for k, v in r.items() if k in select} for r in self.records(company=company)]
+        return FakeResponse({"d": {"results": rows}})
+
+
+@pytest.fixture(scope="session")
+def backend_module():
+    os.environ.update(
+        SAP_USERNAME="user",
+        SAP_PASSWORD="secret",
+        SAP_BASE_URL="http://sap.test",
+        CPU_POOL_WORKERS="0",
+        PUSH_POLL_INTERVAL="0",
+        LLM_WARMUP="False",
+    )
+    import Backend3
+
+    return Backend3
+
+
+@pytest.fixture
+def backend(backend_module, monkeypatch):
+    """Backend3 with empty caches and SAP answered by FakeSap (backend.fake_sap)."""
+    from cache_backend import InProcessCache
+
+    b = backend_module
+    monkeypatch.setattr(b, "cache", InProcessCache())
+    monkeypatch.setattr(b, "_tree_index_memo", InProcessCache(b.TREE_INDEX_MEMO_SIZE))
+    monkeypatch.setattr(b, "cube_cache", b.CubeCache(b.CUBE_CACHE_MAX_BYTES))
+    monkeypatch.setattr(b, "get_llm", lambda: None)
+    monkeypatch.setattr(
+        b, "admission", b.AdmissionController(max_concurrency=4, max_queue=16, max_wait=5, rate_per_min=600, burst=100)
+    )
+    fake = FakeSap()
+    monkeypatch.setattr(b.get_sap().session, "get", fake.get)
+    monkeypatch.setattr(b, "fake_sap", fake, raising=False)
+    return b
+
+
+@pytest.fixture
+def client(backend):
+    from fastapi.testclient import TestClient
+
+    with TestClient(backend.app) as c:
+        yield c
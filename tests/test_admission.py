@@ -0,0 +1,97 @@
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected, RequestCharge, current_charge
+
+
+def controller(**kw):
+    args = dict(max_concurrency=1, max_queue=1, max_wait=0.05, rate_per_min=60, burst=2)
+    args.update(kw)
+    return AdmissionController(**args)
+
+
+def test_rate_limit_per_client():
+    gate = controller()
+    for _ in range(2):
+        with gate.admit("a"):
+            pass
+    with pytest.raises(AdmissionRejected) as exc:
+        with gate.admit("a"):
+            pass
+    assert exc.value.status_code == 429 and exc.value.retry_after >= 1
+    with gate.admit("b"):  # other clients have their own bucket
+        pass
+    assert gate.metrics()["rejected"]["rate_limited"] == 1
+
+
+def test_one_token_per_request_charge():
+    gate = controller(burst=1)
+    token = current_charge.set(RequestCharge())
+    try:
+        for _ in range(3):  # e.g. the slices of one trend request
+            with gate.admit("a"):
+                pass
+    finally:
+        current_charge.reset(token)
+    with pytest.raises(AdmissionRejected):
+        with gate.admit("a"):
+            pass
+
+
+def test_queue_full_and_wait_timeout():
+    gate = controller(rate_per_min=6000, burst=100, max_wait=1.0)
+    held = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with gate.admit("x"):
+            held.set()
+            release.wait(5)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    held.wait(5)
+    errors = []
+
+    def wait():
+        try:
+            with gate.admit("y"):
+                pass
+        except AdmissionRejected as e:
+            errors.append(e.status_code)
+
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    while not gate.metrics()["queue_depth"]:
+        time.sleep(0.001)
+    with pytest.raises(AdmissionRejected) as exc:
+        with gate.admit("z"):
+            pass
+    assert exc.value.status_code == 503
+    waiter.join()
+    assert errors == [503]
+    release.set()
+    holder.join()
+    rejected = gate.metrics()["rejected"]
+    assert rejected["queue_full"] == 1 and rejected["wait_timeout"] == 1
+
+
+def test_endpoint_rate_limit_and_forwarded_ids(backend, client, monkeypatch):
+    monkeypatch.setattr(
+        backend, "admission", AdmissionController(max_concurrency=4, max_queue=16, max_wait=5, rate_per_min=1, burst=1)
+    )
+    assert client.get("/financial-statements", params={"P_BUKRS": "1000"}).status_code == 200
+    resp = client.get("/financial-statements", params={"P_BUKRS": "2000"})
+    assert resp.status_code == 429
+    assert int(resp.headers["Retry-After"]) >= 1
+
+    # an untrusted peer cannot pick a fresh identity per request
+    resp = client.get("/financial-statements", params={"P_BUKRS": "3000"}, headers={"X-Client-Id": "fresh"})
+    assert resp.status_code == 429
+
+    # behind a trusted proxy the forwarded id is the rate-limit identity
+    monkeypatch.setattr(backend, "TRUSTED_PROXIES", {"testclient"})
+    resp = client.get("/financial-statements", params={"P_BUKRS": "3000"}, headers={"X-Client-Id": "other"})
+    assert resp.status_code == 200
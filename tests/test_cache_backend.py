@@ -0,0 +1,112 @@
+import threading
+import time
+
+import pytest
+
+from cache_backend import MISSING, CacheLockTimeout, FileCache, InProcessCache, cache_key
+
+
+def test_cache_key_is_stable_and_namespaced():
+    assert cache_key("tree", "http://x/?a=1") == cache_key("tree", "http://x/?a=1")
+    assert cache_key("tree", "http://x/?a=1").startswith("tree:")
+    assert cache_key("tree", "a") != cache_key("tree", "b")
+
+
+def test_in_process_ttl_and_lru():
+    cache = InProcessCache(max_entries=2)
+    cache.set("a", 1, 60)
+    cache.set("b", 2, 60)
+    assert cache.get("a") == 1  # a is now the most recently used
+    cache.set("c", 3, 60)
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+    cache.set("old", 4, -1)
+    assert cache.get("old") is MISSING
+
+
+def test_in_process_bounded_by_bytes():
+    cache = InProcessCache(max_entries=100, max_bytes=10_000)
+    for i in range(10):
+        cache.set(f"k{i}", b"x" * 3000, 60)
+    assert cache.total_bytes <= 10_000
+    assert cache.get("k9") is not MISSING
+    assert cache.get("k0") is MISSING
+
+    # the newest entry is kept even when it alone exceeds the bound
+    cache.set("big", b"x" * 50_000, 60)
+    assert [k for k, _ in cache.items()] == ["big"]
+    cache.delete("big")
+    assert cache.total_bytes == 0
+
+
+def test_in_process_replacing_a_key_updates_its_size():
+    cache = InProcessCache(max_bytes=1_000_000)
+    cache.set("a", b"x" * 5000, 60)
+    cache.set("a", b"x" * 100, 60)
+    assert cache.total_bytes < 1000
+
+
+def test_get_or_load_loads_once_under_concurrency():
+    cache = InProcessCache()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.05)
+        return "value"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load("k", 60, loader))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == ["value"] * 5
+    assert len(calls) == 1
+
+
+def test_in_process_lock_timeout():
+    cache = InProcessCache()
+    held = threading.Event()
+    release = threading.Event()
+
+    def holder():
+        with cache.lock("k"):
+            held.set()
+            release.wait(5)
+
+    t = threading.Thread(target=holder)
+    t.start()
+    held.wait(5)
+    with pytest.raises(CacheLockTimeout):
+        with cache.lock("k", timeout=0.05):
+            pass
+    release.set()
+    t.join()
+    with cache.lock("k", timeout=1):
+        pass
+
+
+def test_file_cache_roundtrip_and_expiry(tmp_path):
+    cache = FileCache(str(tmp_path))
+    cache.set("tree:abc", {"payload": b"{}"}, 60)
+    assert cache.get("tree:abc") == {"payload": b"{}"}
+    assert "tree:abc" in cache.sizes()
+
+    cache.set("tree:old", 1, -1)
+    assert cache.get("tree:old") is MISSING
+    cache.delete("tree:abc")
+    assert cache.get("tree:abc") is MISSING
+
+
+def test_file_cache_lock_timeout_and_sweep(tmp_path):
+    cache = FileCache(str(tmp_path))
+    cache.set("tree:old", 1, -1)
+    with cache.lock("tree:k"):
+        other = FileCache(str(tmp_path))
+        with pytest.raises(CacheLockTimeout):
+            with other.lock("tree:k", timeout=0.1):
+                pass
+    assert cache.sweep() >= 1
+    assert not any(p.name.endswith(".pkl") for p in tmp_path.iterdir())
@@ -0,0 +1,51 @@
+from starlette.requests import Request
+
+
+def request_with(**headers):
+    raw = [(k.replace("_", "-").lower().encode(), v.encode()) for k, v in headers.items()]
+    return Request({"type": "http", "method": "GET", "headers": raw})
+
+
+def test_if_none_match_wins_over_if_modified_since(backend_module):
+    b = backend_module
+    req = request_with(if_none_match='"other"', if_modified_since="Fri, 01 Jan 2100 00:00:00 GMT")
+    assert not b.is_not_modified(req, "tag", 1000.0)
+    assert b.is_not_modified(request_with(if_none_match='W/"tag", "x"'), "tag", None)
+    assert b.is_not_modified(request_with(if_none_match="*"), "tag", None)
+
+
+def test_if_modified_since(backend_module):
+    b = backend_module
+    assert b.is_not_modified(request_with(if_modified_since="Thu, 01 Jan 1970 00:16:40 GMT"), "tag", 1000.0)
+    assert not b.is_not_modified(request_with(if_modified_since="Thu, 01 Jan 1970 00:16:39 GMT"), "tag", 1000.0)
+    assert not b.is_not_modified(request_with(if_modified_since="garbage"), "tag", 1000.0)
+
+
+def test_tree_get_revalidates_with_304(client, backend):
+    first = client.get("/financial-statements?P_BUKRS=1000")
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    again = client.get("/financial-statements?P_BUKRS=1000", headers={"If-None-Match": etag})
+    assert again.status_code == 304 and again.content == b""
+    assert again.headers["etag"] == etag
+    assert len(backend.fake_sap.urls) == 1
+
+
+class CountingLlm:
+    def __init__(self):
+        self.calls = 0
+
+    def invoke(self, messages, **kwargs):
+        self.calls += 1
+        return type("Reply", (), {"content": "- summary"})()
+
+
+def test_summary_post_is_never_304(client, backend, monkeypatch):
+    llm = CountingLlm()
+    monkeypatch.setattr(backend, "get_llm", lambda: llm)
+    body = {"scope": "subtree", "nodes": [{"HierarchyNode": "A", "ReportingPeriodAmount": "1"}]}
+    first = client.post("/summarize_tree", json=body)
+    assert first.status_code == 200 and first.headers["etag"]
+    again = client.post("/summarize_tree", json=body, headers={"If-None-Match": first.headers["etag"]})
+    assert again.status_code == 200 and again.json()["summary"] == "- summary"
+    assert llm.calls == 1  # the repeat is served from the summary cache
@@ -0,0 +1,48 @@
+import pytest
+
+from conftest import statement_records
+from consolidation import Consolidation
+from tree_builder import build_tree
+from tree_index import TreeIndex
+
+
+def company_slice(company, n=30):
+    roots, diagnostics = build_tree(statement_records(n, company))
+    return TreeIndex(roots, etag=company, built_at=1.0, diagnostics=diagnostics)
+
+
+@pytest.fixture(scope="module")
+def group():
+    return Consolidation(["1000", "2000"], [company_slice("1000"), company_slice("2000")])
+
+
+def leaves_below(index, node_id):
+    return [i for i in index.order if index.is_ancestor(node_id, i) and not index.children[i]]
+
+
+def test_merged_tree_keeps_the_hierarchy(group):
+    assert group.diagnostics["ok"]
+    assert len(group.index) == 30
+    assert group.index.parent["FS5|CG5"] == "FS1|CG1"
+
+
+def test_own_amounts_and_rollups_per_company_and_group(group):
+    field = "ReportingPeriodAmount"
+    assert group.value(field, "FS4|CG4", 0, rollup=False) == 50.0
+    assert group.value(field, "FS4|CG4", 1, rollup=False) == 100.0
+    assert group.value(field, "FS4|CG4", rollup=False) == 150.0
+
+    for node_id in ("FS0|CG0", "FS3|CG3", "FS29|CG29"):
+        own = [group.value(field, i, rollup=False) for i in leaves_below(group.index, node_id)]
+        assert group.value(field, node_id) == pytest.approx(sum(own))
+        assert group.value(field, node_id, 0) + group.value(field, node_id, 1) == pytest.approx(sum(own))
+
+
+def test_tree_reports_contributions(group):
+    (node,) = group.tree(root="FS2|CG2", max_depth=0)
+    assert node["Children"] == []
+    contributions = node["Contributions"]
+    assert set(contributions) == {"1000", "2000"}
+    assert contributions["1000"]["ReportingPeriodAmount"] + contributions["2000"]["ReportingPeriodAmount"] == (
+        pytest.approx(node["ReportingPeriodAmount"])
+    )
@@ -0,0 +1,72 @@
+import csv
+import io
+
+import pytest
+
+import export
+from conftest import statement_records
+from tree_builder import build_tree
+from tree_index import TreeIndex
+
+FIELDS = ["HierarchyNode", "FinancialStatementItemText", "ReportingPeriodAmount"]
+
+
+@pytest.fixture(scope="module")
+def index():
+    return TreeIndex(build_tree(statement_records(30))[0])
+
+
+def read_csv(chunks):
+    return list(csv.reader(io.StringIO(b"".join(chunks).decode("utf-8"))))
+
+
+def test_csv_rows_levels_and_rollups(index, monkeypatch):
+    monkeypatch.setattr(export._batches, "__defaults__", (7,))  # several chunks
+    chunks = list(export.stream_csv(index, FIELDS))
+    assert len(chunks) > 1
+    header, *rows = read_csv(chunks)
+    assert header == export.export_columns(FIELDS)
+    assert [r[2] for r in rows] == index.order
+    by_id = {r[2]: r for r in rows}
+    assert by_id["N1"][1] == "Item 1" and by_id["N3"][1] == "  Item 3"
+
+    col = header.index("ReportingPeriodAmountRollup")
+    leaves = [i for i in index.order if index.is_ancestor("N1", i) and not index.children[i]]
+    assert float(by_id["N1"][col]) == pytest.approx(sum((int(i[1:]) + 1) * 10.0 for i in leaves))
+    assert float(by_id["N29"][col]) == 300.0
+
+
+def test_subtree_export_matches_full_export(index):
+    full = {r[2]: r for r in read_csv(export.stream_csv(index, FIELDS))[1:]}
+    _, *rows = read_csv(export.stream_csv(index, FIELDS, root="N3"))
+    assert rows[0][:2] == ["0", "Item 3"]
+    assert {r[2] for r in rows} == {i for i in index.order if index.is_ancestor("N3", i)}
+    for r in rows:
+        assert r[-3:] == full[r[2]][-3:]
+
+
+def test_xlsx_and_parquet(index):
+    pytest.importorskip("openpyxl")
+    pq = pytest.importorskip("pyarrow.parquet")
+    from openpyxl import load_workbook
+
+    ws = load_workbook(io.BytesIO(b"".join(export.stream_xlsx(index, FIELDS)))).active
+    assert ws.max_row == len(index) + 1
+
+    table = pq.read_table(io.BytesIO(b"".join(export.stream_parquet(index, FIELDS))))
+    assert table.num_rows == len(index)
+    assert table.column("HierarchyNode").to_pylist() == index.order
+
+
+def test_export_endpoint(client):
+    params = {"P_BUKRS": "1000", "root": "N1", "fields": "ReportingPeriodAmount"}
+    resp = client.get("/financial-statements/export", params=params)
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/csv")
+    assert "attachment" in resp.headers["content-disposition"]
+    header, first, *_ = read_csv([resp.content])
+    assert first[header.index("HierarchyNode")] == "N1"
+
+    again = client.get("/financial-statements/export", params=params, headers={"If-None-Match": resp.headers["etag"]})
+    assert again.status_code == 304
+    assert client.get("/financial-statements/export", params={"format": "pdf"}).status_code == 400
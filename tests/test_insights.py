@@ -0,0 +1,55 @@
+from insights import pre_summary, preview_nodes, render_pre_summary
+
+
+def sap_rows():
+    # flat rows as SAP returns them: parents carry the totals of their children
+    return [
+        {"HierarchyNode": "A", "ParentNode": "000000", "ReportingPeriodAmount": "30", "ComparisonPeriodAmount": "20"},
+        {"HierarchyNode": "A1", "ParentNode": "A", "ReportingPeriodAmount": "10", "ComparisonPeriodAmount": "10"},
+        {"HierarchyNode": "A2", "ParentNode": "A", "ReportingPeriodAmount": "20", "ComparisonPeriodAmount": "10"},
+    ]
+
+
+def ui_subtree():
+    # tree_view.js collectSubtree(): the selected node, then every descendant again
+    a1 = {"id": "A1", "name": "Cash", "amount": "10", "comparison": "10", "children": []}
+    a2 = {"id": "A2", "name": "Receivables", "amount": "20", "comparison": "10", "diffAbs": "10", "children": []}
+    a = {"id": "A", "name": "Assets", "amount": "30", "comparison": "20", "children": [a1, a2]}
+    return [a, a1, a2]
+
+
+def test_flat_rows_total_the_leaves_only():
+    stats = pre_summary(sap_rows())
+    assert stats["nodes"] == 3 and stats["leaves"] == 2
+    assert stats["totals"] == {"current": 30.0, "comparison": 20.0, "delta": 10.0, "delta_pct": 50.0}
+
+
+def test_tree_view_payload():
+    stats = pre_summary(ui_subtree())
+    assert stats["nodes"] == 3 and stats["leaves"] == 2
+    assert stats["totals"]["current"] == 30.0
+    top = stats["top_movers"][0]
+    assert top["HierarchyNode"] == "A2" and top["FinancialStatementItemText"] == "Receivables"
+    assert top["delta"] == 10.0 and top["share_of_parent"] == round(20 / 30, 4)
+    assert "Receivables" in render_pre_summary(stats)
+
+
+def test_sign_flips_and_outliers():
+    rows = [{"HierarchyNode": f"L{i}", "ReportingPeriodAmount": str(10 + i), "ComparisonPeriodAmount": "9"} for i in range(8)]
+    rows.append({"HierarchyNode": "X", "ReportingPeriodAmount": "-500", "ComparisonPeriodAmount": "400"})
+    stats = pre_summary(rows)
+    assert stats["sign_flip_count"] == 1 and stats["sign_flips"][0]["HierarchyNode"] == "X"
+    assert [o["HierarchyNode"] for o in stats["outliers"]] == ["X"]
+    assert stats["concentration"]["top_movers_share"] > 0.95
+
+
+def test_preview_drops_nested_children_and_repeats():
+    preview = preview_nodes(ui_subtree())
+    assert [n["id"] for n in preview] == ["A", "A1", "A2"]
+    assert all("children" not in n for n in preview)
+    assert len(preview_nodes(ui_subtree(), limit=2)) == 2
+
+
+def test_empty_selection():
+    stats = pre_summary([])
+    assert stats["nodes"] == 0 and stats["totals"]["current"] == 0.0
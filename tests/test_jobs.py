@@ -0,0 +1,83 @@
+import multiprocessing
+import time
+
+import pytest
+
+from cache_backend import InProcessCache
+from jobs import JobManager
+
+pytestmark = pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(), reason="job tests fork their workers"
+)
+
+
+def slow_square(job_id, progress, x, seconds=0.3):
+    progress[job_id] = {"stage": "computing"}
+    time.sleep(seconds)
+    return x * x
+
+
+def failing(job_id, progress):
+    raise ValueError("SAP said no")
+
+
+def wait_for(manager, job_id, statuses, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = manager.get(job_id)
+        if job is not None and job.status in statuses:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} never reached {statuses}")
+
+
+@pytest.fixture
+def managers():
+    made = []
+
+    def make(**kw):
+        manager = JobManager(1, retention=60, start_method="fork", **kw)
+        made.append(manager)
+        return manager
+
+    yield make
+    for manager in made:
+        manager.shutdown()
+
+
+def test_job_runs_reports_progress_and_deduplicates(managers):
+    finished = []
+    manager = managers(on_finish=finished.append)
+    job = manager.submit("square", "7", slow_square, 7, on_done=lambda job, result: {"value": result})
+    assert job.status in ("queued", "running")
+    assert manager.submit("square", "7", slow_square, 7) is job
+
+    wait_for(manager, job.id, ("running", "done"))
+    assert manager.progress(job.id)["stage"] in ("computing", "running")
+    done = wait_for(manager, job.id, ("done",))
+    assert done.result == {"value": 49}
+    assert done.to_dict()["finished_at"] is not None
+    assert finished == [job]
+
+
+def test_failed_job_keeps_the_error(managers):
+    manager = managers()
+    job = manager.submit("fail", "x", failing)
+    failed = wait_for(manager, job.id, ("failed",))
+    assert failed.error == "SAP said no"
+
+
+def test_other_workers_answer_from_the_shared_store(managers):
+    store = InProcessCache()
+    owner = managers(store=store)
+    other = managers(store=store)
+
+    job = owner.submit("square", "3", slow_square, 3, 0.5)
+    seen = other.get(job.id)
+    assert seen is not None and seen.id == job.id and seen.status in ("queued", "running")
+    assert other.submit("square", "3", slow_square, 3).id == job.id  # de-duplicated across workers
+    assert other.list() == []
+
+    done = wait_for(other, job.id, ("done",))
+    assert done.result == 9
+    assert other.get("unknown") is None
@@ -0,0 +1,58 @@
+import pytest
+
+from conftest import statement_records
+from period_cube import CubeCache, PeriodCube
+from tree_builder import build_tree
+from tree_index import TreeIndex
+
+
+def period_slice(rows):
+    roots, diagnostics = build_tree([dict(r) for r in rows])
+    return TreeIndex(roots, etag=str(len(rows)), built_at=1.0, diagnostics=diagnostics)
+
+
+def test_rollups_per_period():
+    rows = statement_records(15)
+    cube = PeriodCube(["2025001", "2025002"], [period_slice(rows), period_slice(rows[:7])])
+    assert cube.diagnostics["ok"]
+    assert len(cube.index) == 15
+    leaves = [i for i in cube.index.order if cube.index.is_ancestor("N0", i) and not cube.index.children[i]]
+    assert cube.value("N0", 0) == pytest.approx(sum(cube.value(i, 0, rollup=False) for i in leaves))
+    assert cube.value("N3", 0, rollup=False) == 40.0
+    assert cube.value("N7", 1, rollup=False) == 0.0  # not in the second period
+    assert cube.compare("N10", 0, 1, rollup=False) == {"delta": -110.0, "growth": -1.0}
+
+
+def test_union_reports_cycles_and_orphans_instead_of_dropping_nodes():
+    rows = statement_records(5)
+    first = rows + [
+        {"HierarchyNode": "A", "ParentNode": "B", "ReportingPeriodAmount": "1"},
+        {"HierarchyNode": "B", "ParentNode": "A", "ReportingPeriodAmount": "2"},
+    ]
+    second = rows + [{"HierarchyNode": "X", "ParentNode": "GONE", "ReportingPeriodAmount": "3"}]
+    cube = PeriodCube(["2025001", "2025002"], [period_slice(first), period_slice(second)])
+
+    assert {"A", "B", "X"} <= set(cube.index.order)
+    counts = cube.diagnostics["counts"]
+    assert counts["cycles"] == 1 and counts["orphans"] == 1
+    assert cube.diagnostics["orphan_ids"] == ["X"]
+    assert cube.value("B", 0, rollup=False) == 2.0
+
+
+def test_cube_cache_bounded_by_bytes():
+    cube = PeriodCube(["2025001"], [period_slice(statement_records(10))])
+    cache = CubeCache(max_bytes=cube.memory_bytes * 2)
+    for key in "abc":
+        cache.put(key, cube)
+    assert cache.get("a") is None
+    assert cache.get("c") is cube
+    assert cache.total_bytes <= cube.memory_bytes * 2
+
+
+def test_trend_endpoint_returns_cube_diagnostics(client):
+    resp = client.get("/financial-statements/trend", params={"periods": "2025001,2025002", "P_BUKRS": "1000"})
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["diagnostics"]["ok"]
+    assert len(body["rows"]) == 30
+    assert body["rows"][0]["Values"][0] == body["rows"][0]["Values"][1]
@@ -0,0 +1,48 @@
+from tree_builder import project_tree
+
+PARAMS = {"P_BUKRS": "1000"}
+
+
+def walk(records):
+    stack = list(records)
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(node["Children"])
+
+
+def test_project_tree_keeps_fields_and_drops_empty_values():
+    roots = [{"HierarchyNode": "A", "Text": "", "Amount": "1", "Children": [{"HierarchyNode": "B", "Amount": None}]}]
+    assert project_tree(roots, ["HierarchyNode", "Amount", "Text"]) == [
+        {"HierarchyNode": "A", "Amount": "1", "Children": [{"HierarchyNode": "B", "Children": []}]}
+    ]
+
+
+def test_fields_narrow_the_select_and_the_records(backend, client):
+    resp = client.get("/financial-statements", params={**PARAMS, "fields": "ReportingPeriodAmount"})
+    assert resp.status_code == 200
+    nodes = list(walk(resp.json()["records"]))
+    assert len(nodes) == 30
+    assert {frozenset(n) for n in nodes} == {
+        frozenset({"HierarchyNode", "ParentNode", "ReportingPeriodAmount", "Children"})
+    }
+    (url,) = backend.fake_sap.urls
+    assert "$select=HierarchyNode,ParentNode,ReportingPeriodAmount&" in url
+
+
+def test_projection_is_cut_from_a_cached_wider_tree(backend, client):
+    full = client.get("/financial-statements", params=PARAMS).json()["records"]
+    wide = client.get("/financial-statements", params={**PARAMS, "fields": "ReportingPeriodAmount,Currency"})
+    narrow = client.get("/financial-statements", params={**PARAMS, "fields": "Currency", "root": "N1"})
+    assert len(backend.fake_sap.urls) == 1
+
+    amounts = {n["HierarchyNode"]: n["ReportingPeriodAmount"] for n in walk(full)}
+    assert all(n["ReportingPeriodAmount"] == amounts[n["HierarchyNode"]] for n in walk(wide.json()["records"]))
+    (root,) = narrow.json()["records"]
+    assert set(root) == {"HierarchyNode", "ParentNode", "Currency", "Children"}
+
+
+def test_unknown_fields_are_rejected(client):
+    resp = client.get("/financial-statements", params={**PARAMS, "fields": "ReportingPeriodAmount,Nope"})
+    assert resp.status_code == 400
+    assert "Nope" in resp.json()["detail"]
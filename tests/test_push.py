@@ -0,0 +1,131 @@
+import asyncio
+import json
+
+from cache_backend import cache_key
+from conftest import statement_records
+from push import PushHub, amount_snapshot, tree_delta
+
+
+def payload(rows):
+    from tree_builder import build_tree
+
+    return json.dumps({"records": build_tree([dict(r) for r in rows])[0]}).encode("utf-8")
+
+
+def entry(rows, etag):
+    return {"payload": payload(rows), "etag": etag, "built_at": 1.0}
+
+
+def drain(sub):
+    out = []
+    while not sub.queue.empty():
+        out.append(json.loads(sub.queue.get_nowait()))
+    return out
+
+
+def test_tree_delta():
+    rows = statement_records(6)
+    old = amount_snapshot(payload(rows))
+    changed = [dict(r) for r in rows[:5]] + [{"HierarchyNode": "NEW", "ParentNode": "N0"}]
+    changed[3]["ReportingPeriodAmount"] = "1.5"
+    delta = tree_delta(old, amount_snapshot(payload(changed)))
+    assert [c["HierarchyNode"] for c in delta["changed"]] == ["N3"]
+    assert delta["changed"][0]["ReportingPeriodAmount"] == "1.5"
+    assert delta["added"] == ["NEW"] and delta["removed"] == ["N5"]
+
+
+def test_hub_pushes_deltas_and_bounds_queues():
+    async def scenario():
+        hub = PushHub(queue_size=2, max_delta=3)
+        sub = hub.connect()
+        rows = statement_records(10)
+        hub.publish_tree("tree:t", entry(rows, "e0"))  # nobody subscribed yet
+        hub.subscribe(sub, "tree:t")
+        hub.seed_tree("tree:t", payload(rows), "e0")
+        assert hub.version("tree:t") == "e0"
+
+        rows[4] = {**rows[4], "ReportingPeriodAmount": "7"}
+        hub.publish_tree("tree:t", entry(rows, "e1"))
+        (event,) = drain(sub)
+        assert event["etag"] == "e1" and [c["HierarchyNode"] for c in event["changed"]] == ["N4"]
+        assert hub.version("tree:t") == "e1"
+
+        hub.publish_tree("tree:t", entry(statement_records(20), "e2"))  # too many changes
+        assert drain(sub)[0]["full_refresh"] is True
+
+        for i in range(3):
+            hub.publish("tree:t", {"type": "ping", "n": i})
+        assert [e["n"] for e in drain(sub)] == [1, 2]
+        assert sub.dropped == 1
+
+        hub.disconnect(sub)
+        assert hub.topics() == [] and hub.version("tree:t") is None
+        assert hub.metrics()["connections"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_poll_picks_up_trees_rebuilt_on_other_workers(backend, monkeypatch):
+    hub = PushHub()
+    monkeypatch.setattr(backend, "push", hub)
+    url = backend.build_odata_url(P_BUKRS="1000")
+    topic = backend.tree_topic(url)
+    rows = statement_records(10)
+
+    async def scenario():
+        sub = hub.connect()
+        hub.subscribe(sub, topic)
+        hub.seed_tree(topic, payload(rows), "e0")
+
+        # another worker rebuilt the tree: new entry plus its etag marker
+        rows[2] = {**rows[2], "ReportingPeriodAmount": "999"}
+        backend.cache.set(backend.tree_key(url), entry(rows, "e1"), 60)
+        backend.cache.set(cache_key("tree-etag", backend.tree_key(url)), "e1", 60)
+        await asyncio.to_thread(backend.poll_shared_events, [topic])
+        await asyncio.sleep(0)
+        (event,) = drain(sub)
+        assert event["etag"] == "e1" and event["changed"][0]["HierarchyNode"] == "N2"
+
+        await asyncio.to_thread(backend.poll_shared_events, [topic])  # already pushed
+        await asyncio.sleep(0)
+        assert drain(sub) == []
+
+    asyncio.run(scenario())
+
+
+def test_poll_reports_jobs_finished_on_other_workers(backend, monkeypatch):
+    from jobs import Job
+
+    hub = PushHub()
+    monkeypatch.setattr(backend, "push", hub)
+    job = Job("j1", "statement", "url")
+    monkeypatch.setattr(backend.jobs, "get", lambda job_id: job if job_id == "j1" else None)
+
+    async def scenario():
+        sub = hub.connect()
+        hub.subscribe(sub, "job:j1")
+        await asyncio.to_thread(backend.poll_shared_events, ["job:j1"])
+        await asyncio.sleep(0)
+        assert drain(sub) == []  # still queued
+
+        job.status, job.finished_at = "done", 2.0
+        for _ in range(2):  # the second poll must not repeat the event
+            await asyncio.to_thread(backend.poll_shared_events, ["job:j1"])
+            await asyncio.sleep(0)
+        (event,) = drain(sub)
+        assert event["status"] == "done" and event["result_url"] == "/jobs/j1/result"
+        assert hub.version("job:j1") == "done"
+
+    asyncio.run(scenario())
+
+
+def test_websocket_subscribe_and_ping(client):
+    client.get("/financial-statements", params={"P_BUKRS": "1000"})
+    with client.websocket_connect("/ws") as ws:
+        ws.send_json({"op": "subscribe", "params": {"P_BUKRS": "1000"}})
+        ack = ws.receive_json()
+        assert ack["type"] == "subscribed" and ack["topic"].startswith("tree:") and ack["etag"]
+        ws.send_json({"op": "ping"})
+        assert ws.receive_json() == {"type": "pong"}
+        ws.send_json({"op": "subscribe", "job": "nope"})
+        assert ws.receive_json()["type"] == "error"
@@ -0,0 +1,68 @@
+import pytest
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+from sap_client import SapClient
+
+
+class Reply:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class Script:
+    """session.get stand-in: each call pops the next reply (or raises it)."""
+
+    def __init__(self, *steps):
+        self.steps = list(steps)
+        self.timeouts = []
+
+    def __call__(self, url, headers=None, timeout=None, **kwargs):
+        self.timeouts.append(timeout)
+        step = self.steps.pop(0)
+        if isinstance(step, Exception):
+            raise step
+        return step
+
+
+def make_client(script, **kw):
+    client = SapClient("u", "p", timeout=60, max_retries=3, backoff_factor=0, **kw)
+    client.session.get = script
+    return client
+
+
+def refused():
+    reason = NewConnectionError(None, "Connection refused")
+    return requests.ConnectionError(MaxRetryError(None, "/", reason))
+
+
+def test_gateway_errors_and_refused_connections_are_retried():
+    script = Script(Reply(503), refused(), Reply(502), Reply(200))
+    client = make_client(script)
+    assert client.get("http://sap/x").status_code == 200
+    assert client.stats()["retries"] == 3
+
+
+def test_server_errors_and_read_timeouts_are_not_retried():
+    assert make_client(Script(Reply(500))).get("http://sap/x").status_code == 500
+    with pytest.raises(requests.ReadTimeout):
+        make_client(Script(requests.ReadTimeout())).get("http://sap/x")
+    dropped = requests.ConnectionError(ProtocolError("Connection aborted."))
+    with pytest.raises(requests.ConnectionError):
+        make_client(Script(dropped, Reply(200))).get("http://sap/x")
+
+
+def test_retries_stop_at_max_retries():
+    script = Script(*[Reply(504)] * 5)
+    assert make_client(script).get("http://sap/x").status_code == 504
+    assert len(script.timeouts) == 4
+
+
+def test_deadline_caps_read_timeout_and_retry_after():
+    script = Script(Reply(503, {"retry-after": "120"}), Reply(200))
+    client = make_client(script, retry_deadline=30)
+    # waiting 120s would overrun the deadline: the 503 is returned instead
+    assert client.get("http://sap/x").status_code == 503
+    connect, read = script.timeouts[0]
+    assert connect <= SapClient.CONNECT_TIMEOUT and read <= 30
@@ -0,0 +1,139 @@
+import json
+
+import pytest
+
+from skeleton import (
+    HIERARCHY_FIELDS,
+    SkeletonMismatch,
+    align_rows,
+    extend_skeleton,
+    make_skeleton,
+    materialize,
+    merge_skeletons,
+    period_select,
+)
+from tree_builder import build_tree
+
+
+def statement_rows(amounts):
+    rows = [
+        {"HierarchyNode": "A", "ParentNode": "000000", "FinancialStatementItem": "1"},
+        {"HierarchyNode": "A1", "ParentNode": "A", "FinancialStatementItem": "11"},
+        {"HierarchyNode": "A2", "ParentNode": "A", "FinancialStatementItem": "12"},
+        {"HierarchyNode": "B", "ParentNode": "000000", "FinancialStatementItem": "2"},
+        {"HierarchyNode": "B1", "ParentNode": "B", "FinancialStatementItem": "21"},
+    ]
+    for r in rows:
+        r.update(Ledger="0L", ReportingPeriodAmount=amounts.get(r["HierarchyNode"], "0"))
+    return rows
+
+
+def period_rows(amounts, ledger="2L"):
+    return [{"HierarchyNode": k, "Ledger": ledger, "ReportingPeriodAmount": v} for k, v in amounts.items()]
+
+
+@pytest.fixture
+def skeleton():
+    roots, _ = build_tree(statement_rows({"A1": "5", "B1": "7"}))
+    return json.loads(make_skeleton(roots))
+
+
+def strip(nodes):
+    return [{**{k: v for k, v in n.items() if k != "Children"}, "Children": strip(n["Children"])} for n in nodes]
+
+
+def test_period_select_drops_hierarchy_fields():
+    assert period_select(["HierarchyNode", "ParentNode", "Ledger", "ReportingPeriodAmount"]) == [
+        "HierarchyNode",
+        "Ledger",
+        "ReportingPeriodAmount",
+    ]
+
+
+def test_skeleton_keeps_only_hierarchy_fields_in_pre_order(skeleton):
+    assert [n["HierarchyNode"] for n in skeleton["nodes"]] == ["A", "A1", "A2", "B", "B1"]
+    assert skeleton["parent"] == [-1, 0, 0, -1, 3]
+    for node in skeleton["nodes"]:
+        assert set(node) <= set(HIERARCHY_FIELDS)
+
+
+def test_materialize_matches_a_full_build(skeleton):
+    amounts = {"A": "9", "A1": "4", "A2": "5", "B": "1", "B1": "1"}
+    roots, diagnostics = materialize(skeleton, *align_rows(skeleton, period_rows(amounts, ledger="0L")))
+    expected, full = build_tree(statement_rows(amounts))
+    assert strip(roots) == strip(expected)
+    for key in ("ok", "rows", "nodes", "roots", "depth", "counts"):
+        assert diagnostics[key] == full[key]
+
+
+def test_materialize_takes_period_fields_from_the_fetch(skeleton):
+    roots, diagnostics = materialize(skeleton, *align_rows(skeleton, period_rows({"B": "3", "B1": "3"})))
+    assert [r["HierarchyNode"] for r in roots] == ["B"]
+    b1 = roots[0]["Children"][0]
+    assert b1["Ledger"] == "2L" and b1["ReportingPeriodAmount"] == "3"
+    assert b1["FinancialStatementItem"] == "21"
+    assert diagnostics["nodes"] == 2 and diagnostics["ok"]
+
+
+def test_rows_without_their_parent_row_are_orphans(skeleton):
+    # as build_tree would report for the same rows
+    roots, diagnostics = materialize(skeleton, *align_rows(skeleton, period_rows({"A1": "1", "B1": "2"})))
+    assert [r["HierarchyNode"] for r in roots] == ["A1", "B1"]
+    assert diagnostics["counts"]["orphans"] == 2 and diagnostics["orphan_ids"] == ["A1", "B1"]
+    assert not diagnostics["ok"]
+
+
+def test_cycles_and_depth_cuts_are_reported_for_returned_rows():
+    rows = [
+        {"HierarchyNode": "X", "ParentNode": "Z"},
+        {"HierarchyNode": "Y", "ParentNode": "X"},
+        {"HierarchyNode": "Z", "ParentNode": "Y"},
+        {"HierarchyNode": "R", "ParentNode": "000000"},
+        {"HierarchyNode": "R1", "ParentNode": "R"},
+        {"HierarchyNode": "R2", "ParentNode": "R1"},
+    ]
+    roots, full = build_tree([dict(r) for r in rows], max_depth=1)
+    skel = json.loads(make_skeleton(roots, max_depth=1))
+    _, diagnostics = materialize(skel, *align_rows(skel, [{"HierarchyNode": r["HierarchyNode"]} for r in rows]))
+    assert diagnostics["counts"] == full["counts"]
+    assert sorted(diagnostics["cycles"][0]) == ["X", "Y", "Z"]
+    assert sorted(diagnostics["depth_cut_ids"]) == ["R2", "Z"]
+    # without the rest of its cycle, X is just an orphan
+    _, partial = materialize(skel, *align_rows(skel, [{"HierarchyNode": "X"}]))
+    assert partial["counts"]["cycles"] == 0 and partial["orphan_ids"] == ["X"]
+
+
+def test_extend_skeleton_keeps_nodes_of_both_trees(skeleton):
+    other = [
+        {"HierarchyNode": "A", "ParentNode": "000000"},
+        {"HierarchyNode": "A3", "ParentNode": "A"},
+    ]
+    roots, _ = build_tree(other)
+    extended = json.loads(extend_skeleton(skeleton, roots))
+    assert [n["HierarchyNode"] for n in extended["nodes"]] == ["A", "A3", "A1", "A2", "B", "B1"]
+    rows, _ = align_rows(extended, period_rows({"A": "1", "A3": "1"}))
+    roots, diagnostics = materialize(extended, rows)
+    assert [c["HierarchyNode"] for c in roots[0]["Children"]] == ["A3"] and diagnostics["ok"]
+
+
+def test_align_rows_keeps_the_first_duplicate(skeleton):
+    rows, duplicates = align_rows(skeleton, period_rows({"A": "1"}) + period_rows({"A": "2"}))
+    assert rows[0]["ReportingPeriodAmount"] == "1"
+    assert rows[1:] == [None] * 4
+    assert duplicates == ["A"]
+    _, diagnostics = materialize(skeleton, rows, duplicates)
+    assert diagnostics["rows"] == 2 and diagnostics["counts"]["duplicates"] == 1
+
+
+def test_unknown_node_is_a_mismatch(skeleton):
+    with pytest.raises(SkeletonMismatch):
+        align_rows(skeleton, period_rows({"C": "1"}))
+
+
+def test_merge_skeletons_keeps_nodes_of_a_racing_extension(skeleton):
+    raw = make_skeleton(build_tree(statement_rows({}))[0])
+    other = make_skeleton(build_tree([{"HierarchyNode": "C", "ParentNode": "000000"}])[0])
+    merged = json.loads(merge_skeletons(other, raw))
+    assert sorted(n["HierarchyNode"] for n in merged["nodes"]) == ["A", "A1", "A2", "B", "B1", "C"]
+    assert merge_skeletons(raw, other) != raw
+    assert merge_skeletons(raw, raw) == raw
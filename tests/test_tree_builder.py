@@ -0,0 +1,71 @@
+from tree_builder import build_tree
+
+
+def row(node, parent="000000", **fields):
+    return {"HierarchyNode": node, "ParentNode": parent, **fields}
+
+
+def ids(nodes):
+    return [n["HierarchyNode"] for n in nodes]
+
+
+def test_links_children_in_result_order():
+    roots, diag = build_tree([row("A"), row("B", "A"), row("C", "A"), row("D", "B")])
+    assert ids(roots) == ["A"]
+    assert ids(roots[0]["Children"]) == ["B", "C"]
+    assert ids(roots[0]["Children"][0]["Children"]) == ["D"]
+    assert diag["ok"] and diag["depth"] == 2 and diag["nodes"] == 4
+
+
+def test_zero_filled_and_blank_parents_are_roots():
+    roots, diag = build_tree([row("A", "000000"), row("B", "  "), row("C", None)])
+    assert ids(roots) == ["A", "B", "C"]
+    assert diag["ok"]
+
+
+def test_duplicate_ids_keep_the_first_row():
+    roots, diag = build_tree([row("A", Amount=1), row("A", Amount=2), row("B", "A")])
+    assert ids(roots) == ["A"] and roots[0]["Amount"] == 1
+    assert ids(roots[0]["Children"]) == ["B"]
+    assert diag["counts"]["duplicates"] == 1 and diag["duplicate_ids"] == ["A"]
+    assert not diag["ok"]
+
+
+def test_orphans_become_roots():
+    roots, diag = build_tree([row("A"), row("B", "MISSING"), row("C", "B")])
+    assert ids(roots) == ["A", "B"]
+    assert ids(roots[1]["Children"]) == ["C"]
+    assert diag["counts"]["orphans"] == 1 and diag["orphan_ids"] == ["B"]
+
+
+def test_cycle_is_broken_at_its_first_member():
+    roots, diag = build_tree([row("R"), row("X", "Z"), row("Y", "X"), row("Z", "Y"), row("W", "Y")])
+    assert ids(roots) == ["R", "X"]
+    x = roots[1]
+    assert ids(x["Children"]) == ["Y"]
+    assert ids(x["Children"][0]["Children"]) == ["Z", "W"]
+    assert diag["counts"]["cycles"] == 1
+    assert sorted(diag["cycles"][0]) == ["X", "Y", "Z"]
+
+
+def test_self_parent_is_a_cycle():
+    roots, diag = build_tree([row("A", "A"), row("B", "A")])
+    assert ids(roots) == ["A"] and ids(roots[0]["Children"]) == ["B"]
+    assert diag["cycles"] == [["A"]]
+
+
+def test_depth_cut_re_roots_deep_nodes():
+    chain = [row("N0")] + [row(f"N{i}", f"N{i - 1}") for i in range(1, 6)]
+    roots, diag = build_tree(chain, max_depth=2)
+    assert ids(roots) == ["N0", "N3"]
+    assert ids(roots[0]["Children"][0]["Children"]) == ["N2"]
+    assert roots[0]["Children"][0]["Children"][0]["Children"] == []
+    assert ids(roots[1]["Children"][0]["Children"]) == ["N5"]
+    assert diag["counts"]["depth_cut"] == 1 and diag["depth_cut_ids"] == ["N3"]
+    assert diag["depth"] == 2
+
+
+def test_rows_without_id_are_counted():
+    roots, diag = build_tree([row("A"), {"ParentNode": "A"}])
+    assert diag["counts"]["missing_id"] == 1
+    assert diag["rows"] == 2 and diag["nodes"] == 2
@@ -0,0 +1,91 @@
+import random
+
+import pytest
+
+from tree_builder import build_tree
+from tree_index import TreeIndex, leaf_prefix
+
+
+def random_tree(n, seed):
+    rnd = random.Random(seed)
+    rows = []
+    for i in range(n):
+        parent = f"N{rnd.randrange(i)}" if i and rnd.random() < 0.9 else "000000"
+        rows.append({"HierarchyNode": f"N{i}", "ParentNode": parent})
+    return TreeIndex(build_tree(rows)[0])
+
+
+def rendered(index, expanded):
+    """Visible rows by walking the whole tree: what visible_window must agree with."""
+    out = []
+    stack = list(reversed(index.root_ids))
+    while stack:
+        node_id = stack.pop()
+        out.append(node_id)
+        if node_id in expanded:
+            stack.extend(reversed(index.children[node_id]))
+    return out
+
+
+@pytest.fixture(scope="module")
+def index():
+    return random_tree(300, seed=7)
+
+
+def test_euler_intervals(index):
+    for node_id in index.order:
+        for child in index.children[node_id]:
+            assert index.is_ancestor(node_id, child)
+            assert index.depth[child] == index.depth[node_id] + 1
+        assert index.subtree_size(node_id) == 1 + sum(index.subtree_size(c) for c in index.children[node_id])
+    assert index.path(index.order[-1])[0] in index.root_ids
+
+
+def test_leaf_mask(index):
+    mask = index.leaf_mask()
+    assert [index.order[p] for p in range(len(index)) if mask[p]] == [i for i in index.order if not index.children[i]]
+    node_id = index.root_ids[0]
+    lo, hi = index.tin[node_id], index.tout[node_id]
+    assert index.leaf_mask(lo, hi) == mask[lo:hi + 1]
+
+
+def test_leaf_prefix_sums_leaves_of_each_subtree(index):
+    values = [float(p + 1) for p in range(len(index))]
+    pre = leaf_prefix(values, index.leaf_mask())
+    for node_id in index.order:
+        leaves = [index.tin[i] + 1.0 for i in index.order if index.is_ancestor(node_id, i) and not index.children[i]]
+        assert pre[index.tout[node_id] + 1] - pre[index.tin[node_id]] == sum(leaves)
+
+
+@pytest.mark.parametrize("share", [0.0, 0.3, 1.0])
+def test_visible_window_seeks_to_any_offset(index, share):
+    rnd = random.Random(share)
+    expanded = {i for i in index.order if rnd.random() < share}
+    rows = rendered(index, expanded)
+    for offset in list(range(0, len(rows), 7)) + [len(rows) - 1]:
+        for limit in (1, 5, 40):
+            total, window = index.visible_window(expanded, offset, limit)
+            assert total == len(rows)
+            assert window == rows[offset:offset + limit]
+
+
+def test_visible_window_past_the_end_and_empty_limit(index):
+    collapsed = len(index.root_ids)
+    assert index.visible_window(set(), collapsed, 10) == (collapsed, [])
+    assert index.visible_window(set(), 0, 0) == (collapsed, [])
+
+
+def test_visible_window_expand_all_is_pre_order(index):
+    assert index.visible_window((), 10, 5, expand_all=True) == (len(index), index.order[10:15])
+
+
+def test_truncated_reports_what_was_cut(index):
+    root = max(index.root_ids, key=index.subtree_size)
+    top = index.truncated(root, 1)
+    assert [c["HierarchyNode"] for c in top["Children"]] == index.children[root]
+    for child in top["Children"]:
+        cut = index.children[child["HierarchyNode"]]
+        assert child["Children"] == []
+        if cut:
+            assert child["ChildCount"] == len(cut)
+            assert child["DescendantCount"] == index.subtree_size(child["HierarchyNode"]) - 1
@@ -0,0 +1,176 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+# ids listed per problem kind in a diagnostics report (counts are always exact)
+SAMPLE_SIZE = 20
+
+
+def parent_key(record: Dict[str, Any]) -> Optional[str]:
+    parent = record.get("ParentNode")
+    if parent is None:
+        return None
+    key = str(parent).strip()
+    # SAP NUMC fields are zero-filled when initial, so "000000" means "no parent"
+    return key if key.strip("0") else None
+
+
+def build_tree(
+    records: List[Dict[str, Any]], max_depth: Optional[int] = None
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Link flat SAP rows into Children[] trees in O(n) and report what was wrong
+    with the parent links instead of failing on them:
+      - duplicate HierarchyNode ids: the first row wins, later ones are dropped
+      - orphans (ParentNode not in the result set): become roots
+      - cycles (including self-parents): broken at the member that came first
+        in the SAP result, which becomes a root
+      - nodes deeper than max_depth: re-rooted so serialization stays bounded
+    Returns (roots, diagnostics).
+    """
+    nodes: List[Dict[str, Any]] = []
+    pos: Dict[str, int] = {}
+    duplicates: List[str] = []
+    missing_id = 0
+    for r in records:
+        r["Children"] = []
+        hn = r.get("HierarchyNode")
+        if hn is None:
+            missing_id += 1
+        else:
+            key = str(hn)
+            if key in pos:
+                duplicates.append(key)
+                continue
+            pos[key] = len(nodes)
+        nodes.append(r)
+
+    n = len(nodes)
+    parent = [-1] * n
+    orphans: List[str] = []
+    for i, r in enumerate(nodes):
+        pk = parent_key(r)
+        if pk is None:
+            continue
+        j = pos.get(pk)
+        if j is None:
+            orphans.append(str(r.get("HierarchyNode")))
+        else:
+            parent[i] = j
+
+    # every node has at most one parent, so each walk up the parent chain either
+    # reaches a finished node / root or closes a cycle on the current path
+    cycles: List[List[str]] = []
+    state = bytearray(n)  # 0 unvisited, 1 on the current path, 2 done
+    for i in range(n):
+        if state[i]:
+            continue
+        path: List[int] = []
+        j = i
+        while j != -1 and state[j] == 0:
+            state[j] = 1
+            path.append(j)
+            j = parent[j]
+        if j != -1 and state[j] == 1:
+            members = path[path.index(j):]
+            parent[min(members)] = -1
+            cycles.append([str(nodes[m].get("HierarchyNode")) for m in members])
+        for k in path:
+            state[k] = 2
+
+    kids: List[List[int]] = [[] for _ in range(n)]
+    roots_pos: List[int] = []
+    for i in range(n):
+        if parent[i] == -1:
+            roots_pos.append(i)
+        else:
+            kids[parent[i]].append(i)
+
+    depth_cut: List[str] = []
+    deepest = 0
+    stack = [(i, 0) for i in roots_pos]
+    while stack:
+        i, depth = stack.pop()
+        deepest = max(deepest, depth)
+        children = nodes[i]["Children"]
+        for c in kids[i]:
+            if max_depth is not None and depth + 1 > max_depth:
+                depth_cut.append(str(nodes[c].get("HierarchyNode")))
+                roots_pos.append(c)
+                stack.append((c, 0))
+            else:
+                children.append(nodes[c])
+                stack.append((c, depth + 1))
+
+    roots = [nodes[i] for i in roots_pos]
+    counts = {
+        "duplicates": len(duplicates),
+        "orphans": len(orphans),
+        "cycles": len(cycles),
+        "depth_cut": len(depth_cut),
+        "missing_id": missing_id,
+    }
+    diagnostics = {
+        "ok": not any(counts.values()),
+        "rows": len(records),
+        "nodes": n,
+        "roots": len(roots),
+        "depth": deepest,
+        "counts": counts,
+        "duplicate_ids": duplicates[:SAMPLE_SIZE],
+        "orphan_ids": orphans[:SAMPLE_SIZE],
+        "cycles": cycles[:SAMPLE_SIZE],
+        "depth_cut_ids": depth_cut[:SAMPLE_SIZE],
+    }
+    return roots, diagnostics
+
+
+def project_tree(roots: List[Dict[str, Any]], fields: List[str]) -> List[Dict[str, Any]]:
+    """
+    Copy of a built tree keeping only `fields` (plus Children) on every node and
+    leaving out null / empty-string values, so sparse rows stay small on the wire.
+    """
+    keep = set(fields)
+
+    def project(node: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: v for k, v in node.items() if k in keep and v is not None and v != ""}
+
+    out = [project(r) for r in roots]
+    stack = list(zip(roots, out))
+    while stack:
+        src, dst = stack.pop()
+        dst["Children"] = [project(c) for c in src.get("Children") or []]
+        stack.extend(zip(src.get("Children") or [], dst["Children"]))
+    return out
+
+
+class TreeBuildStats:
+    """Per-worker totals of build diagnostics plus the most recent problem reports."""
+
+    def __init__(self, keep: int = 50):
+        self._lock = threading.Lock()
+        self._builds = 0
+        self._with_problems = 0
+        self._totals: Dict[str, int] = {}
+        self._recent: Deque[Dict[str, Any]] = deque(maxlen=keep)
+
+    def record(self, key: str, diagnostics: Optional[Dict[str, Any]]) -> None:
+        if not diagnostics:
+            return
+        with self._lock:
+            self._builds += 1
+            for kind, count in diagnostics["counts"].items():
+                self._totals[kind] = self._totals.get(kind, 0) + count
+            if not diagnostics["ok"]:
+                self._with_problems += 1
+                self._recent.append({"key": key, "at": time.time(), **diagnostics})
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "builds": self._builds,
+                "builds_with_problems": self._with_problems,
+                "totals": dict(self._totals),
+                "recent_problems": list(self._recent),
+            }
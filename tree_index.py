@@ -0,0 +1,202 @@
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+from operator import mul
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+class TreeIndex:
+    """
+    Read-only index over a built statement tree (records carrying Children[]).
+
+    Built once per cached tree so that node lookups, ancestor paths and subtree
+    membership are O(1)/O(k) instead of a DFS over the whole tree:
+      - by_id:  HierarchyNode -> record
+      - parent: HierarchyNode -> parent HierarchyNode (None for roots)
+      - depth:  HierarchyNode -> depth (roots are 0)
+      - tin/tout: Euler-tour (pre-order) interval; v is in the subtree of u
+        iff tin[u] <= tin[v] <= tout[u]
+      - children / root_ids: indexed child ids in display order
+    """
+
+    def __init__(
+        self,
+        roots: List[Dict[str, Any]],
+        etag: Optional[str] = None,
+        built_at: Optional[float] = None,
+        diagnostics: Optional[Dict[str, Any]] = None,
+    ):
+        self.roots = roots
+        self.etag = etag  # content hash of the records the tree was built from
+        self.built_at = built_at
+        self.diagnostics = diagnostics  # tree_builder.build_tree() report, if known
+        self.by_id: Dict[str, Dict[str, Any]] = {}
+        self.parent: Dict[str, Optional[str]] = {}
+        self.depth: Dict[str, int] = {}
+        self.tin: Dict[str, int] = {}
+        self.tout: Dict[str, int] = {}
+        self.order: List[str] = []  # pre-order ids, order[tin[id]] == id
+        self.children: Dict[str, List[str]] = {}
+        self.root_ids: List[str] = []
+
+        # iterative DFS so deep SAP hierarchies cannot hit the recursion limit
+        stack = [(r, None, 0, False) for r in reversed(roots)]
+        while stack:
+            node, parent_id, depth, done = stack.pop()
+            node_id = node_key(node)
+            if done:
+                self.tout[node_id] = len(self.order) - 1
+                continue
+            if node_id in self.tin:
+                continue
+            self.by_id[node_id] = node
+            self.parent[node_id] = parent_id
+            self.children[node_id] = []
+            if parent_id is None:
+                self.root_ids.append(node_id)
+            else:
+                self.children[parent_id].append(node_id)
+            self.depth[node_id] = depth
+            self.tin[node_id] = len(self.order)
+            self.order.append(node_id)
+            stack.append((node, parent_id, depth, True))
+            for child in reversed(node.get("Children") or []):
+                stack.append((child, node_id, depth + 1, False))
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def __contains__(self, node_id: str) -> bool:
+        return node_id in self.by_id
+
+    def get(self, node_id: str) -> Optional[Dict[str, Any]]:
+        return self.by_id.get(node_id)
+
+    def subtree_size(self, node_id: str) -> int:
+        return self.tout[node_id] - self.tin[node_id] + 1
+
+    def leaf_mask(self, lo: int = 0, hi: Optional[int] = None) -> bytearray:
+        """1 at the pre-order positions lo..hi of leaves (a subtree of one), indexed from lo."""
+        hi = len(self.order) - 1 if hi is None else hi
+        return bytearray(1 if self.tout[self.order[pos]] == pos else 0 for pos in range(lo, hi + 1))
+
+    def is_ancestor(self, ancestor_id: str, node_id: str) -> bool:
+        return self.tin[ancestor_id] <= self.tin[node_id] <= self.tout[ancestor_id]
+
+    def path(self, node_id: str) -> List[str]:
+        """Ancestor ids from the root down to (and including) node_id."""
+        out: List[str] = []
+        cur: Optional[str] = node_id
+        while cur is not None:
+            out.append(cur)
+            cur = self.parent.get(cur)
+        out.reverse()
+        return out
+
+    def visible_counts(self, expanded: Iterable[str]) -> Dict[str, int]:
+        """
+        Rows each expanded node occupies when rendered (itself + visible descendants).
+        Collapsed nodes and leaves occupy 1 row and are not stored.
+        """
+        ids = sorted((i for i in set(expanded) if self.children.get(i)), key=self.tin.__getitem__, reverse=True)
+        counts: Dict[str, int] = {}
+        # reverse pre-order: expanded descendants are counted before their ancestors
+        for node_id in ids:
+            counts[node_id] = 1 + sum(counts.get(c, 1) for c in self.children[node_id])
+        return counts
+
+    def visible_window(
+        self, expanded: Iterable[str], offset: int, limit: int, expand_all: bool = False
+    ) -> Tuple[int, List[str]]:
+        """
+        (total visible rows, ids of visible rows [offset, offset + limit)) for a
+        tree rendered with `expanded` open. Seeks to offset by bisecting prefix sums
+        of the visible subtree sizes on each level, so rows before offset are never
+        walked; cost grows with depth, sibling counts on the path and limit.
+        """
+        if expand_all:
+            # everything open: the visible list is the pre-order itself
+            return len(self.order), self.order[offset:offset + limit]
+
+        open_ids = set(expanded)
+        counts = self.visible_counts(open_ids)
+
+        def level(ids: List[str]) -> Tuple[List[str], List[int]]:
+            return ids, list(accumulate(counts.get(i, 1) for i in ids))
+
+        ids, prefix = level(self.root_ids)
+        total = prefix[-1] if prefix else 0
+        if offset >= total or limit <= 0:
+            return total, []
+
+        # seek: frames of (sibling ids, prefix sums, position) down to the row at offset
+        frames: List[List[Any]] = []
+        skip = offset
+        while True:
+            pos = bisect_right(prefix, skip)
+            skip -= prefix[pos - 1] if pos else 0
+            frames.append([ids, prefix, pos])
+            if skip == 0:
+                break
+            skip -= 1  # the node's own row; the target is among its children
+            ids, prefix = level(self.children[ids[pos]])
+
+        out: List[str] = []
+        while frames and len(out) < limit:
+            frame = frames[-1]
+            ids, _, pos = frame
+            if pos >= len(ids):
+                frames.pop()
+                if frames:
+                    frames[-1][2] += 1
+                continue
+            node_id = ids[pos]
+            out.append(node_id)
+            if node_id in open_ids and self.children[node_id]:
+                frames.append([*level(self.children[node_id]), 0])
+            else:
+                frame[2] += 1
+        return total, out
+
+    def truncated(self, node_id: str, max_depth: Optional[int]) -> Dict[str, Any]:
+        """
+        Copy of the subtree at node_id cut off at max_depth levels below it.
+        Cut nodes keep an empty Children[] plus ChildCount / DescendantCount so
+        the UI can lazily request the rest with root=<HierarchyNode>.
+        """
+        return _truncate(self, self.by_id[node_id], max_depth)
+
+
+def leaf_prefix(values: Sequence[float], leaf: bytearray) -> array:
+    """
+    Prefix sums of a pre-order column over its leaf rows: with pre =
+    leaf_prefix(...), the rollup of the node at [tin, tout] is
+    pre[tout + 1] - pre[tin]. Only leaves are summed because SAP parent rows
+    already carry their totals.
+    """
+    return array("d", accumulate(map(mul, values, leaf), initial=0.0))
+
+
+def node_key(node: Dict[str, Any]) -> str:
+    return str(node.get("HierarchyNode"))
+
+
+def _truncate(index: TreeIndex, node: Dict[str, Any], max_depth: Optional[int]) -> Dict[str, Any]:
+    if max_depth is None:
+        return node
+    top = {k: v for k, v in node.items() if k != "Children"}
+    stack = [(node, top, 0)]
+    while stack:
+        src, dst, depth = stack.pop()
+        children = src.get("Children") or []
+        if depth >= max_depth and children:
+            dst["Children"] = []
+            dst["ChildCount"] = len(children)
+            dst["DescendantCount"] = index.subtree_size(node_key(src)) - 1
+            continue
+        dst["Children"] = []
+        for child in children:
+            copy = {k: v for k, v in child.items() if k != "Children"}
+            dst["Children"].append(copy)
+            stack.append((child, copy, depth + 1))
+    return top